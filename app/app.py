@@ -1,18 +1,89 @@
+import os
+import sys
+from concurrent.futures import FIRST_EXCEPTION, ThreadPoolExecutor, wait
+from typing import Callable, Iterable, Iterator, List, Optional, Union
+
+import numpy as np
 import pandas as pd
+import arrow_frames
+import dataset_cleaner
+import db_loader
+import files_handler
+import frame_dtypes
+import fuzzy_match
+import imdb_preproc
+import title_keys
+import top_k
+from arrow_frames import ArrowFrame
 from dataset_cleaner import DatasetCleaner
-from files_handler import write_wiki_to_csv, read_wiki, read_imdb_movies_metadata
+from db_loader import (
+    RESULT_SCHEMA,
+    RESULT_INDEX_COLUMNS,
+    RESULT_TABLE,
+    UPLOAD_PARTITIONS,
+    copy_dataframe_to_table,
+    db_pool_size,
+    table_row_count,
+)
+from files_handler import (
+    IMDB_CSV_FILE,
+    WIKI_CACHE_FILE,
+    WIKI_COLUMNS,
+    WIKI_XML_FILE,
+    iter_wiki_cache,
+    write_wiki_to_csv,
+    read_wiki,
+    read_wiki_arrow,
+    read_wiki_batches,
+    read_imdb_movies_metadata,
+    resolve_wiki_dump,
+)
+from frame_dtypes import MEMORY_REPORT_FILE, memory_report, optimise_dtypes
+from fuzzy_match import fill_unmatched_urls
 from imdb_preproc import imdb_preproc_list
+from instrumentation import RUN_REPORT_FILE, finish_run, measure, start_run
+from title_keys import TITLE_KEY_SUFFIX, add_title_keys, match_keys, title_key
+from top_k import TOP_COLUMN, TOP_N, select_top_k
+from stage_cache import STAGE_CACHE_DIR, StageCache, code_fingerprint, file_fingerprint
 from sqlalchemy import create_engine
 
-engine = create_engine("postgresql://postgres@truelayer_db:5432/truelayer")
+# A bounded pool: the upload never opens more than one connection per partition plus one, the pool is sized for the
+# PIPELINE_UPLOAD_PARTITIONS of run_app.py, see copy_dataframe_to_table
+engine = create_engine(
+    "postgresql://postgres@truelayer_db:5432/truelayer",
+    pool_size=db_pool_size(
+        int(os.environ.get("PIPELINE_UPLOAD_PARTITIONS", UPLOAD_PARTITIONS))
+    ),
+    max_overflow=0,
+)
 
 
-def merge_imdb_and_wiki(df_imdb: pd.DataFrame, df_wiki: pd.DataFrame) -> pd.DataFrame:
+def merge_imdb_and_wiki(
+    df_imdb: pd.DataFrame,
+    df_wiki: Union[pd.DataFrame, ArrowFrame],
+    title_fallback: bool = False,
+    title_keys: bool = False,
+    strip_disambiguator: bool = False,
+) -> pd.DataFrame:
     """
     Merges the imdb and wiki dataframes based on original title and title from imdb dataset to title in wiki dataset.
 
+    The wiki titles are probed once against a hash index of the imdb keys, so every imdb row gets at most
+    one url. Precedence rule:
+        1. the url of the wiki page whose title is the imdb original_title (the last one if there are several)
+        2. only with title_fallback, the url of the wiki page whose title is the imdb title
+    Without title_fallback the result is the same as the former left merges on title and on original_title followed
+    by drop_duplicates(["title", "original_title", "release_date"], keep="last"), in which the original_title
+    matches always overwrote the title ones.
+
     param: df_imdb: pandas DF for the imdb dataset
-    param: df_wiki: pandas DF for the wiki dataset
+    param: df_wiki: pandas DF for the wiki dataset, or an ArrowFrame of which only the rows that can match an imdb
+                    title are gathered, see _arrow_candidate_rows
+    param: title_fallback: look the imdb title up when the original_title has no wiki page
+    param: title_keys: match the normalised titles (see title_key) instead of the exact ones, with the same
+                       precedence. The {column}_key columns are used when the dataframes have them (see
+                       add_title_keys), otherwise they are computed.
+    param: strip_disambiguator: when the keys are computed here, remove the "(1995 film)" like disambiguators
     returns: df_joined: pandas DF with the datasets merged
     """
     # Because this function is very specific to merging these 2 datasets we expect some specific columns
@@ -22,26 +93,117 @@ def merge_imdb_and_wiki(df_imdb: pd.DataFrame, df_wiki: pd.DataFrame) -> pd.Data
     assert "original_title" in df_imdb, msg.format("original_title", "imdb")
     assert "title" in df_wiki, msg.format("title", "wiki")
     assert "url" in df_wiki, msg.format("url", "wiki")
-    # We merge df_imdb with df_wiki first on (title, title) and then on (original_title, title)
-    # Some wikipedia pages could contain the original_title rather than the title
-    # Then, we clean the datasets and concatenate them, then drop duplicates
 
     # This will result in a dataframe that contains all the rows from imdb with a wikipedia url if it exists
-    df_joined_on_title = df_imdb.merge(df_wiki, on="title", how="left")
-    df_joined_on_original_title = pd.merge(
-        df_imdb, df_wiki, how="left", left_on=["original_title"], right_on=["title"]
-    )
-    df_joined_on_original_title = df_joined_on_original_title.rename(
-        columns={"title_x": "title"}
+    df_imdb = df_imdb.drop_duplicates(
+        ["title", "original_title", "release_date"], keep="last"
+    ).reset_index(drop=True)
+    if isinstance(df_wiki, ArrowFrame):
+        df_wiki = _arrow_candidate_rows(
+            df_imdb, df_wiki, title_keys, strip_disambiguator
+        )
+    if title_keys:
+        df_wiki, positions = _title_key_positions(
+            df_imdb, df_wiki, title_fallback, strip_disambiguator
+        )
+    else:
+        df_wiki, positions = _title_positions(df_imdb, df_wiki, title_fallback)
+
+    # Position -1 is not in the index, so reindex gives missing values for the imdb rows without a wiki page
+    key_columns = [col + TITLE_KEY_SUFFIX for col in ["title", "original_title"]]
+    df_wiki_matched = (
+        df_wiki.drop(columns=["title"] + key_columns, errors="ignore")
+        .reset_index(drop=True)
+        .reindex(positions)
     )
-    df_joined_on_original_title = df_joined_on_original_title.drop("title_y", axis=1)
+    df_wiki_matched.index = df_imdb.index
     df_joined = pd.concat(
-        [df_joined_on_title, df_joined_on_original_title]
-    ).drop_duplicates(["title", "original_title", "release_date"], keep="last")
+        [df_imdb.drop(columns=key_columns, errors="ignore"), df_wiki_matched], axis=1
+    )
 
     return df_joined
 
 
+def _arrow_candidate_rows(
+    df_imdb: pd.DataFrame,
+    df_wiki: ArrowFrame,
+    title_keys: bool,
+    strip_disambiguator: bool,
+) -> pd.DataFrame:
+    """
+    The wiki rows whose title (or title key) is one of the imdb candidate titles, see imdb_candidate_titles.
+    The titles are probed in arrow over the whole table, only the candidate rows are gathered into a pandas
+    dataframe, in the order of the wiki dataset so the precedence of merge_imdb_and_wiki is kept.
+    """
+    if not title_keys:
+        return df_wiki.filter(
+            df_wiki.isin("title", imdb_candidate_titles(df_imdb))
+        ).to_pandas()
+    columns = ["title", "original_title"]
+    if not all(col + TITLE_KEY_SUFFIX in df_imdb for col in columns):
+        df_imdb = add_title_keys(df_imdb.copy(), columns, strip_disambiguator)
+    if "title" + TITLE_KEY_SUFFIX not in df_wiki:
+        df_wiki = add_title_keys(df_wiki, ["title"], strip_disambiguator)
+    candidates = imdb_candidate_titles(df_imdb, True)
+    return df_wiki.filter(
+        df_wiki.isin("title" + TITLE_KEY_SUFFIX, candidates)
+    ).to_pandas()
+
+
+def _title_positions(
+    df_imdb: pd.DataFrame, df_wiki: pd.DataFrame, title_fallback: bool
+) -> tuple:
+    """
+    The exact title matching of merge_imdb_and_wiki.
+
+    returns: (the wiki rows that can match, position of the wiki row of each imdb row in them or -1)
+    """
+    # The wiki dataset is far bigger than the imdb one, so the hash index is built over the imdb keys and probed
+    # once with the wiki titles. Only the few wiki rows matching a key are kept for the actual lookup.
+    imdb_keys = df_imdb["original_title"]
+    if title_fallback:
+        imdb_keys = pd.concat([imdb_keys, df_imdb["title"]])
+    imdb_key_index = pd.Index(imdb_keys.unique())
+    df_wiki = df_wiki[imdb_key_index.get_indexer(df_wiki["title"]) != -1]
+    df_wiki = df_wiki.drop_duplicates("title", keep="last")
+    wiki_title_index = pd.Index(df_wiki["title"])
+    positions = wiki_title_index.get_indexer(df_imdb["original_title"])
+    if title_fallback:
+        unmatched = positions == -1
+        positions[unmatched] = wiki_title_index.get_indexer(
+            df_imdb.loc[unmatched, "title"]
+        )
+    return df_wiki, positions
+
+
+def _title_key_positions(
+    df_imdb: pd.DataFrame,
+    df_wiki: pd.DataFrame,
+    title_fallback: bool,
+    strip_disambiguator: bool,
+) -> tuple:
+    """
+    The normalised title matching of merge_imdb_and_wiki.
+
+    returns: (the wiki rows matched, position of the wiki row of each imdb row in them or -1)
+    """
+
+    def keys(df: pd.DataFrame, col: str) -> pd.Series:
+        if col + TITLE_KEY_SUFFIX in df:
+            return df[col + TITLE_KEY_SUFFIX]
+        return title_key(df[col], strip_disambiguator)
+
+    wiki_keys = keys(df_wiki, "title")
+    positions = match_keys(keys(df_imdb, "original_title"), wiki_keys)
+    if title_fallback:
+        unmatched = positions == -1
+        positions[unmatched] = match_keys(keys(df_imdb, "title")[unmatched], wiki_keys)
+    # Only the matched wiki rows are kept, so the merge never copies the whole wiki dataset
+    rows = np.unique(positions[positions != -1])
+    positions = np.where(positions == -1, -1, np.searchsorted(rows, positions))
+    return df_wiki.iloc[rows], positions
+
+
 def calculate_columns_ratio(
     df: pd.DataFrame,
     numerator: str = "budget",
@@ -49,7 +211,7 @@ def calculate_columns_ratio(
     resulting_col_name: str = "ratio",
 ) -> pd.DataFrame:
     """
-    Calculate num/denom and stores it into a column called ratio.
+    Calculate num/denom and stores it into a column called ratio, as a single vectorised numpy division.
 
     returns: df with added column called ratio
     """
@@ -60,7 +222,13 @@ def calculate_columns_ratio(
         resulting_col_name not in df.columns
     ), f"Your resulting column name {resulting_col_name} is already present in the dataframe columns. You will override existing data. Do this outside this function if it is expected behaviour."
 
-    df[resulting_col_name] = round(df[numerator] / df[denominator], 3)
+    # Plain float64 arrays, whatever the (downcast) dtypes of the columns, x/0 gives inf and 0/0 nan as in pandas
+    with np.errstate(divide="ignore", invalid="ignore"):
+        ratio = np.divide(
+            df[numerator].to_numpy(dtype=np.float64, na_value=np.nan),
+            df[denominator].to_numpy(dtype=np.float64, na_value=np.nan),
+        )
+    df[resulting_col_name] = np.round(ratio, 3)
 
     return df
 
@@ -74,8 +242,20 @@ def imdb_run_preproc_and_cleaner(df_imdb: pd.DataFrame) -> pd.DataFrame:
     # Get the imdb dataset
     # Clean the imdb dataset
     for preproc in imdb_preproc_list:
-        df_imdb = preproc(df_imdb)
+        df_imdb = measure(preproc.__name__, preproc, df_imdb)
 
+    # The audit evaluates the rules, so it is written inside the cleaner stage with the rules nested in it
+    df_imdb = measure("cleaner", _imdb_cleaned_dataframe, df_imdb)
+
+    return df_imdb
+
+
+def _imdb_cleaned_dataframe(df_imdb: pd.DataFrame) -> pd.DataFrame:
+    """
+    Cleans the imdb dataset and writes the audit log of its rules
+
+    returns: the rows of df_imdb that passed all the rules
+    """
     dataset_cleaner_imdb = DatasetCleaner(df_imdb)
 
     # We make an assumption that missing values for the 4 columns means we have no data for them, so we remove the rows
@@ -87,58 +267,461 @@ def imdb_run_preproc_and_cleaner(df_imdb: pd.DataFrame) -> pd.DataFrame:
     dataset_cleaner_imdb.check_zero_values(["revenue", "budget"])
     dataset_cleaner_imdb.write_to_csv("./logs_dataset_cleaner_result_imdb.csv")
 
-    df_imdb = dataset_cleaner_imdb.get_cleaned_dataframe()
-
-    return df_imdb
+    return dataset_cleaner_imdb.get_cleaned_dataframe()
 
 
-def wiki_run_preproc_and_cleaner(df_wiki: pd.DataFrame) -> pd.DataFrame:
+def _wiki_dataset_cleaner(
+    df_wiki: Union[pd.DataFrame, ArrowFrame, Iterable[pd.DataFrame]],
+) -> DatasetCleaner:
     """
-    Running the preprocessing and cleaner for the wiki dataset
-
-    returns: cleaned df_wiki
+    The dataset cleaner of the wiki dataset, with its rules and audit log set
     """
-    # Get the wiki dataset
-    # Clean the wiki dataset
-    df_wiki = read_wiki()
     dataset_cleaner_wiki = DatasetCleaner(df_wiki)
     dataset_cleaner_wiki.check_missing_values(["title", "url"])
     dataset_cleaner_wiki.write_to_csv("./logs_dataset_cleaner_result_wiki.csv")
-    df_wiki = dataset_cleaner_wiki.get_cleaned_dataframe()
+    return dataset_cleaner_wiki
+
+
+def wiki_run_preproc_and_cleaner(
+    df_wiki: Union[pd.DataFrame, ArrowFrame, Iterable[pd.DataFrame]],
+) -> Union[pd.DataFrame, ArrowFrame]:
+    """
+    Running the preprocessing and cleaner for the wiki dataset
+
+    param: df_wiki: pandas DF for the wiki dataset, an iterable of batches as returned by read_wiki_batches or an
+                    ArrowFrame as returned by read_wiki_arrow
+    returns: cleaned df_wiki, an ArrowFrame with a narrower selection for an ArrowFrame
+    """
+    # Clean the wiki dataset, batches are cleaned one at a time by the cleaner. The cleaner is built inside the
+    # stage, as writing the audit of a dataframe evaluates the rules
+    df_wiki = measure(
+        "cleaner", lambda df: _wiki_dataset_cleaner(df).get_cleaned_dataframe(), df_wiki
+    )
 
     return df_wiki
 
 
-def run_process() -> None:
+def wiki_iter_preproc_and_cleaner(
+    wiki_batches: Iterable[pd.DataFrame],
+) -> Iterator[pd.DataFrame]:
+    """
+    Same as wiki_run_preproc_and_cleaner, but yields the cleaned batches one at a time instead of concatenating them
+
+    returns: iterator of the cleaned wiki batches
+    """
+    return _wiki_dataset_cleaner(wiki_batches).iter_cleaned_batches()
+
+
+def run_concurrently(*funcs: Callable) -> List:
+    """
+    Runs the functions in one thread each and waits for all of them, unless one raises: its error is raised as soon
+    as it happens, the functions not started yet are cancelled and the ones still running are abandoned (a thread
+    can not be stopped, it finishes in the background and its result is dropped).
+
+    returns: the results of the functions, in order
+    """
+    executor = ThreadPoolExecutor(max_workers=len(funcs))
+    futures = [executor.submit(func) for func in funcs]
+    try:
+        done, not_done = wait(futures, return_when=FIRST_EXCEPTION)
+        failed = next((f for f in futures if f in done and f.exception()), None)
+        if failed is not None:
+            failed_name = funcs[futures.index(failed)].__name__
+            for func, future in zip(funcs, futures):
+                if future in not_done and not future.cancel():
+                    print(
+                        f"{failed_name} failed, abandoning {func.__name__} still running"
+                    )
+            raise failed.exception()
+        return [future.result() for future in futures]
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
+
+
+def imdb_candidate_titles(df_imdb: pd.DataFrame, title_keys: bool = False) -> pd.Index:
+    """
+    The titles a wiki page can be joined on, see merge_imdb_and_wiki: the union of the imdb title and original_title.
+
+    param: title_keys: return the union of their keys instead, the {column}_key columns of add_title_keys
+    returns: index of the unique candidate titles
+    """
+    columns = ["title", "original_title"]
+    if title_keys:
+        columns = [col + TITLE_KEY_SUFFIX for col in columns]
+    titles = pd.concat([df_imdb[col].astype(object) for col in columns])
+    return pd.Index(titles.dropna().unique())
+
+
+def match_wiki_batches(
+    df_imdb: pd.DataFrame,
+    wiki_batches: Iterable[pd.DataFrame],
+    title_keys: bool = False,
+    strip_disambiguator: bool = False,
+) -> pd.DataFrame:
+    """
+    Reduces a stream of wiki batches to the rows merge_imdb_and_wiki can use: the last wiki row for each of the
+    imdb candidate titles. Only one batch and the matched rows are held in memory at any time.
+
+    merge_imdb_and_wiki(df_imdb, match_wiki_batches(df_imdb, batches)) gives the same result as
+    merge_imdb_and_wiki(df_imdb, pd.concat(batches)).
+
+    param: title_keys: match on the title keys instead (df_imdb must have them, see add_title_keys), the key of
+                       each batch is computed with strip_disambiguator and kept in the title_key column
+    returns: the matched wiki rows, at most one per title
+    """
+    titles = imdb_candidate_titles(df_imdb, title_keys)
+    column = "title" + TITLE_KEY_SUFFIX if title_keys else "title"
+    df_matched = None
+    for batch in wiki_batches:
+        if title_keys:
+            batch = batch.assign(
+                **{column: title_key(batch["title"], strip_disambiguator)}
+            )
+        batch = batch[batch[column].isin(titles)]
+        if df_matched is not None:
+            batch = pd.concat([df_matched, batch])
+        # The last row of a title wins, as in merge_imdb_and_wiki
+        df_matched = batch.drop_duplicates(column, keep="last")
+    if df_matched is None:
+        return pd.DataFrame(columns=WIKI_COLUMNS)
+    return df_matched.reset_index(drop=True)
+
+
+def wiki_source_fingerprint(
+    xml_file: str = WIKI_XML_FILE, wiki_file: str = WIKI_CACHE_FILE
+) -> dict:
+    """
+    The wiki dataset is built from the dump, or only from the cache when the dump is not on disk.
+    """
+    wiki_dump = resolve_wiki_dump(xml_file)
+    if os.path.exists(wiki_dump):
+        return file_fingerprint(wiki_dump)
+    return file_fingerprint(wiki_file)
+
+
+# The modules whose code produces the output of a stage, the result stage selects the top k and the upload stage
+# copies the result with db_loader
+PIPELINE_MODULES = (
+    sys.modules[__name__],
+    arrow_frames,
+    dataset_cleaner,
+    db_loader,
+    files_handler,
+    frame_dtypes,
+    fuzzy_match,
+    imdb_preproc,
+    title_keys,
+    top_k,
+)
+
+
+def pipeline_code_fingerprint() -> str:
+    """
+    The fingerprint of the code of the pipeline stages, see code_fingerprint.
+    """
+    return code_fingerprint(*PIPELINE_MODULES)
+
+
+def run_process(
+    wiki_from_xml: bool = False,
+    semi_join: bool = False,
+    cache_dir: Optional[str] = STAGE_CACHE_DIR,
+    force: bool = False,
+    top_n: int = TOP_N,
+    sort_column: str = TOP_COLUMN,
+    chunk_rows: Optional[int] = None,
+    report_file: Optional[str] = RUN_REPORT_FILE,
+    report_to_db: bool = False,
+    normalise_titles: bool = False,
+    strip_disambiguators: bool = False,
+    concurrent_loads: bool = True,
+    optimise_frame_dtypes: bool = True,
+    memory_report_file: Optional[str] = MEMORY_REPORT_FILE,
+    fuzzy_titles: bool = False,
+    fuzzy_workers: int = 1,
+    upload_partitions: int = UPLOAD_PARTITIONS,
+    arrow_wiki: bool = False,
+) -> None:
     """
     Starting point for the pipeline
+
+    Every stage (imdb, wiki, result, upload) is skipped when its inputs (files, parameters, code of the
+    preprocessing and cleaner, upstream stages) did not change since the last run, its output is reused instead.
+    See StageCache.
+
+    param: wiki_from_xml: stream the wiki dataset straight from the xml dump instead of the cache
+                          created by run_create_wiki_csv.py
+    param: semi_join: only keep the wiki rows whose title is one of the imdb candidate titles while the wiki dataset
+                      is read, so the wiki side is a few tens of thousands of rows before it is cleaned and merged
+    param: cache_dir: where the stage outputs are persisted, None runs every stage without persisting anything
+    param: force: run every stage even if its inputs did not change. The upload also runs again whenever the
+                  result table is missing or doesn't hold as many rows as the result.
+    param: top_n: number of rows uploaded, the ones with the highest sort_column
+    param: chunk_rows: run the wiki side in bounded memory: the imdb dataset stays in memory while the wiki rows
+                       are read, cleaned and matched to the imdb titles chunk_rows at a time, so the memory used
+                       depends on chunk_rows and not on the size of the dump. None reads the whole wiki dataset.
+                       The result is the same in both modes.
+    param: report_file: where the run report (wall and cpu time, rows in/out and peak memory of every stage, see
+                        RunReport) is written as json, None to not write it
+    param: report_to_db: also append the run report to the pipeline_runs table
+    param: normalise_titles: join on the normalised titles (case, unicode and whitespace, see title_key) rather
+                             than on the exact ones. The keys are computed once in the imdb and wiki stages.
+                             With the semi-join, the wiki rows are filtered on their keys as they are read.
+    param: strip_disambiguators: with normalise_titles, also match "Heat (1995 film)" to the imdb "Heat"
+    param: concurrent_loads: load (read and clean) the imdb and wiki datasets at the same time, in two threads.
+                             Only when the wiki stage doesn't depend on the imdb titles (no semi_join nor chunk_rows).
+    param: optimise_frame_dtypes: store the joined dataset with smaller dtypes before the ratio is computed:
+                                  downcast numerics, release_date as a datetime (uploaded as a timestamp) and
+                                  categoricals for the repetitive strings, see optimise_dtypes
+    param: memory_report_file: where the memory used by each column before and after optimise_frame_dtypes is
+                               written as csv, None to only print it
+    param: fuzzy_titles: after the merge, fuzzy match the films still without url to the wiki titles sharing a
+                         rare word with them (see fill_unmatched_urls). Needs the whole wiki dataset, so not with
+                         semi_join nor chunk_rows, which only keep the exact matches.
+    param: fuzzy_workers: number of processes scoring the fuzzy candidates
+    param: upload_partitions: maximum number of partitions of the result uploaded concurrently, each over its own
+                              connection, see copy_dataframe_to_table. Bounded by the engine pool, sized from
+                              PIPELINE_UPLOAD_PARTITIONS.
+    param: arrow_wiki: keep the wiki side in arrow (see ArrowFrame): the cache is memory mapped, the cleaner and the
+                       semi-join only narrow a selection of its rows, the merge gathers the rows it matches and the
+                       urls stay arrow strings up to the upload. Not with chunk_rows, which already streams the wiki
+                       rows in bounded memory.
     """
+    if fuzzy_titles and (semi_join or chunk_rows is not None):
+        raise ValueError(
+            "fuzzy_titles needs the whole wiki dataset, it can't be used with semi_join or chunk_rows"
+        )
+    if arrow_wiki and chunk_rows is not None:
+        raise ValueError("arrow_wiki can't be used with chunk_rows")
     print("Starting proccess")
-    print("Reading imdb")
-    df_imdb = read_imdb_movies_metadata()
-    print("Running preproc and dataset cleaner for imdb.")
-    df_imdb = imdb_run_preproc_and_cleaner(df_imdb)
-
-    print("Reading wiki")
-    df_wiki = read_wiki()
-    print("Running preproc and dataset cleaner for wiki")
-    df_wiki = wiki_run_preproc_and_cleaner(df_wiki)
-
-    print("Merging datasets")
-    df_joined = merge_imdb_and_wiki(df_imdb, df_wiki)
-    print("Calculating ratio budget to revenue: budget/revenue")
-    df_joined = calculate_columns_ratio(
-        df_joined, numerator="budget", denominator="revenue", resulting_col_name="ratio"
+    run_report = start_run()
+    try:
+        _run_stages(
+            wiki_from_xml=wiki_from_xml,
+            semi_join=semi_join,
+            cache_dir=cache_dir,
+            force=force,
+            top_n=top_n,
+            sort_column=sort_column,
+            chunk_rows=chunk_rows,
+            normalise_titles=normalise_titles,
+            strip_disambiguators=strip_disambiguators,
+            concurrent_loads=concurrent_loads,
+            optimise_frame_dtypes=optimise_frame_dtypes,
+            memory_report_file=memory_report_file,
+            fuzzy_titles=fuzzy_titles,
+            fuzzy_workers=fuzzy_workers,
+            upload_partitions=upload_partitions,
+            arrow_wiki=arrow_wiki,
+        )
+    finally:
+        finish_run()
+        if report_file is not None:
+            run_report.write_json(report_file)
+    if report_to_db:
+        run_report.write_to_db(engine)
+    print("Finished process")
+
+
+def _run_stages(
+    wiki_from_xml: bool,
+    semi_join: bool,
+    cache_dir: Optional[str],
+    force: bool,
+    top_n: int,
+    sort_column: str,
+    chunk_rows: Optional[int],
+    normalise_titles: bool,
+    strip_disambiguators: bool,
+    concurrent_loads: bool,
+    optimise_frame_dtypes: bool,
+    memory_report_file: Optional[str],
+    fuzzy_titles: bool,
+    fuzzy_workers: int,
+    upload_partitions: int,
+    arrow_wiki: bool,
+) -> None:
+    """
+    The stages of run_process, see its parameters
+    """
+    stage_cache = StageCache(cache_dir, force=force)
+    code = pipeline_code_fingerprint()
+    title_key_options = [normalise_titles, strip_disambiguators]
+
+    def imdb_stage() -> pd.DataFrame:
+        print("Reading imdb")
+        df_imdb = measure("read", read_imdb_movies_metadata)
+        print("Running preproc and dataset cleaner for imdb.")
+        df_imdb = imdb_run_preproc_and_cleaner(df_imdb)
+        if normalise_titles:
+            df_imdb = measure(
+                "title_keys",
+                add_title_keys,
+                df_imdb,
+                ["title", "original_title"],
+                strip_disambiguators,
+            )
+        return df_imdb
+
+    def run_imdb_stage() -> pd.DataFrame:
+        return stage_cache.run(
+            "imdb",
+            {
+                "file": file_fingerprint(IMDB_CSV_FILE, content_hash=True),
+                "preproc": [preproc.__name__ for preproc in imdb_preproc_list],
+                "title_keys": title_key_options,
+                "code": code,
+            },
+            imdb_stage,
+        )
+
+    # With the semi-join or by chunks the wiki rows kept depend on the imdb titles
+    wiki_needs_imdb = semi_join or chunk_rows is not None
+
+    def wiki_stage(
+        df_imdb: Optional[pd.DataFrame],
+    ) -> Union[pd.DataFrame, ArrowFrame]:
+        print("Reading wiki")
+        # The semi-join runs in the reader, on the exact titles or on the title keys of each batch (or arrow
+        # column), so the other rows are dropped before they are gathered and cleaned
+        titles = imdb_candidate_titles(df_imdb, normalise_titles) if semi_join else None
+        title_filter = dict(
+            titles=titles,
+            title_keys=normalise_titles,
+            strip_disambiguator=strip_disambiguators,
+        )
+        if chunk_rows is not None:
+            # Bounded memory: the wiki rows flow through the reader, the cleaner and the matching chunk by chunk
+            if wiki_from_xml:
+                wiki_batches = read_wiki_batches(batch_size=chunk_rows, **title_filter)
+            else:
+                wiki_batches = iter_wiki_cache(batch_size=chunk_rows, **title_filter)
+            print("Running preproc, dataset cleaner and matching for wiki by chunks")
+            # Reading and cleaning happen while the batches are consumed, so they are measured inside match
+            return measure(
+                "match",
+                match_wiki_batches,
+                df_imdb,
+                wiki_iter_preproc_and_cleaner(wiki_batches),
+                title_keys=normalise_titles,
+                strip_disambiguator=strip_disambiguators,
+            )
+        if arrow_wiki:
+            # The batches are already filtered, the cache is filtered on its arrow columns
+            wiki_batches = read_wiki_batches(**title_filter) if wiki_from_xml else None
+            df_wiki = measure(
+                "read", read_wiki_arrow, batches=wiki_batches, **title_filter
+            )
+        elif wiki_from_xml:
+            df_wiki = measure("read", read_wiki_batches, **title_filter)
+        else:
+            df_wiki = measure("read", read_wiki, **title_filter)
+        print("Running preproc and dataset cleaner for wiki")
+        df_wiki = wiki_run_preproc_and_cleaner(df_wiki)
+        if normalise_titles:
+            df_wiki = measure(
+                "title_keys", add_title_keys, df_wiki, ["title"], strip_disambiguators
+            )
+        return df_wiki
+
+    def run_wiki_stage(
+        df_imdb: Optional[pd.DataFrame] = None,
+    ) -> Union[pd.DataFrame, ArrowFrame]:
+        return stage_cache.run(
+            "wiki",
+            {
+                "file": wiki_source_fingerprint(),
+                "wiki_from_xml": wiki_from_xml,
+                "imdb": stage_cache.keys["imdb"] if wiki_needs_imdb else None,
+                "chunked": chunk_rows is not None,
+                "arrow": arrow_wiki,
+                "title_keys": title_key_options,
+                "code": code,
+            },
+            lambda: wiki_stage(df_imdb),
+        )
+
+    if wiki_needs_imdb or not concurrent_loads:
+        df_imdb = run_imdb_stage()
+        df_wiki = run_wiki_stage(df_imdb)
+    else:
+        # The two sources are independent and are loaded in two threads. The frames are shared by the threads,
+        # nothing is copied or pickled. Most of the time is spent parsing in lxml, arrow and the csv parser, which
+        # release the GIL, so the loads overlap.
+        df_imdb, df_wiki = run_concurrently(run_imdb_stage, run_wiki_stage)
+
+    def result_stage() -> pd.DataFrame:
+        print("Merging datasets")
+        df_joined = measure(
+            "merge",
+            merge_imdb_and_wiki,
+            df_imdb,
+            df_wiki,
+            title_keys=normalise_titles,
+        )
+        if fuzzy_titles:
+            print("Fuzzy matching the films without url")
+            exact_rate = df_joined["url"].notna().mean()
+            df_joined = fill_unmatched_urls(df_joined, df_wiki, workers=fuzzy_workers)
+            print(
+                f"Match rate: {exact_rate:.1%} exact, "
+                f"{df_joined['url'].notna().mean():.1%} with the fuzzy matches"
+            )
+        if optimise_frame_dtypes:
+            print("Optimising the dtypes of the joined dataset")
+            df_optimised = measure("dtypes", optimise_dtypes, df_joined)
+            print(memory_report(df_joined, df_optimised, memory_report_file))
+            df_joined = df_optimised
+        print("Calculating ratio budget to revenue: budget/revenue")
+        df_joined = measure(
+            "ratio",
+            calculate_columns_ratio,
+            df_joined,
+            numerator="budget",
+            denominator="revenue",
+            resulting_col_name="ratio",
+        )
+
+        return measure("top_k", select_top_k, df_joined, n=top_n, column=sort_column)
+
+    df_joined = stage_cache.run(
+        "result",
+        {
+            "imdb": stage_cache.keys["imdb"],
+            "wiki": stage_cache.keys["wiki"],
+            "title_keys": title_key_options,
+            "optimise_dtypes": optimise_frame_dtypes,
+            "fuzzy_titles": fuzzy_titles,
+            "arrow_wiki": arrow_wiki,
+            "top_n": top_n,
+            "sort_column": sort_column,
+            "code": code,
+        },
+        result_stage,
     )
 
-    df_joined.sort_values(by=["ratio"], inplace=True, ascending=False)
-    df_joined = df_joined.head(1000)
-    print("Uploading to db.")
-    df_joined.to_sql(
-        "truelayer_films_result",
-        engine,
-        schema="truelayer_schema",
-        if_exists="replace",
-        index=False,
+    def upload_stage() -> None:
+        print("Uploading to db.")
+        measure(
+            "copy",
+            copy_dataframe_to_table,
+            df_joined,
+            engine,
+            table_name=RESULT_TABLE,
+            schema=RESULT_SCHEMA,
+            partitions=upload_partitions,
+        )
+
+    # The upload is only skipped when the table still holds the result: the database may have been recreated, or
+    # the table dropped or truncated, since the last upload
+    uploaded_rows = table_row_count(engine, RESULT_TABLE, RESULT_SCHEMA)
+    stage_cache.run(
+        "upload",
+        {
+            "result": stage_cache.keys["result"],
+            "table": [RESULT_SCHEMA, RESULT_TABLE],
+            "indexes": RESULT_INDEX_COLUMNS,
+        },
+        upload_stage,
+        force=uploaded_rows != len(df_joined),
     )
-    print("Finished process")
@@ -0,0 +1,141 @@
+from typing import Iterable, Iterator, List, Optional
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+
+# The selected rows of an ArrowFrame are gathered this many at a time when they are written out
+ARROW_BATCH_ROWS = 500_000
+
+
+def arrow_to_numpy(values) -> np.ndarray:
+    """
+    A (chunked) arrow array as a numpy array, the chunks are converted one at a time.
+    """
+    if isinstance(values, pa.ChunkedArray):
+        if values.num_chunks == 0:
+            return np.array([], dtype=values.type.to_pandas_dtype())
+        return np.concatenate(
+            [chunk.to_numpy(zero_copy_only=False) for chunk in values.chunks]
+        )
+    return values.to_numpy(zero_copy_only=False)
+
+
+def table_to_pandas(table: pa.Table) -> pd.DataFrame:
+    """
+    The table as a pandas dataframe whose string columns are arrow backed (the "string[pyarrow]" dtype), so the
+    strings stay in contiguous arrow buffers instead of becoming python objects.
+    """
+    return table.to_pandas(types_mapper={pa.string(): pd.StringDtype("pyarrow")}.get)
+
+
+class ArrowFrame:
+    def __init__(self, table: pa.Table, selection: Optional[np.ndarray] = None):
+        """
+        An arrow table and a selection vector, the positions of the rows of the table the frame holds.
+        The arrow backed alternative to a pandas dataframe used for the wiki side, see run_process arrow_wiki.
+
+        Filtering only narrows the selection, the columns are never copied: a table memory mapped from the wiki
+        cache is read, cleaned and probed in place, and only the rows the merge matches are ever gathered.
+
+        param: selection: increasing positions of the rows held, None holds every row of the table
+        """
+        self.table = table
+        self._selection = selection
+
+    @property
+    def selection(self) -> np.ndarray:
+        if self._selection is None:
+            return np.arange(self.table.num_rows)
+        return self._selection
+
+    @property
+    def columns(self) -> List[str]:
+        return self.table.column_names
+
+    def __len__(self) -> int:
+        if self._selection is None:
+            return self.table.num_rows
+        return len(self._selection)
+
+    def __contains__(self, column: str) -> bool:
+        return column in self.table.column_names
+
+    def column(self, name: str) -> pa.ChunkedArray:
+        """
+        The column over all the rows of the table, selected or not, see at_selection.
+        """
+        return self.table.column(name)
+
+    def at_selection(self, values: np.ndarray) -> np.ndarray:
+        """
+        Restricts values, computed over all the rows of the table, to the selected rows.
+        """
+        if self._selection is None:
+            return values
+        return values[self._selection]
+
+    def filter(self, mask: np.ndarray) -> "ArrowFrame":
+        """
+        Keeps the selected rows for which mask (a boolean per selected row) is True, without copying any column.
+        """
+        return ArrowFrame(self.table, self.selection[mask])
+
+    def isin(self, column: str, values: Iterable) -> np.ndarray:
+        """
+        Same as pandas Series.isin, the values of the column are probed in arrow.
+
+        returns: boolean array, for each selected row whether its value is in values
+        """
+        value_set = pa.array(
+            pd.Series(list(values), dtype="object"),
+            type=self.table.schema.field(column).type,
+            from_pandas=True,
+        )
+        found = pc.fill_null(pc.is_in(self.column(column), value_set=value_set), False)
+        return self.at_selection(arrow_to_numpy(found))
+
+    def with_column(self, name: str, values: pa.ChunkedArray) -> "ArrowFrame":
+        """
+        Adds (or replaces) the column name, values are computed over all the rows of the table.
+        """
+        table = self.table
+        if name in table.column_names:
+            table = table.remove_column(table.column_names.index(name))
+        return ArrowFrame(table.append_column(name, values), self._selection)
+
+    def take(self, positions: Optional[np.ndarray] = None) -> pa.Table:
+        """
+        Gathers the selected rows, or the ones at positions among them, into a new table.
+        """
+        rows = self.selection if positions is None else self.selection[positions]
+        return self.table.take(pa.array(rows, type=pa.int64()))
+
+    def selected_column(self, name: str) -> pa.Array:
+        """
+        The column of the selected rows as a single arrow array.
+        """
+        column = self.column(name)
+        if self._selection is not None:
+            column = column.take(pa.array(self._selection, type=pa.int64()))
+        return (
+            column.combine_chunks() if column.num_chunks else pa.array([], column.type)
+        )
+
+    def iter_batches(self, batch_rows: int = ARROW_BATCH_ROWS) -> Iterator[pa.Table]:
+        """
+        Yields the selected rows batch_rows at a time, so they are written out without gathering all of them.
+        """
+        for start in range(0, len(self), batch_rows):
+            yield self.take(np.arange(start, min(start + batch_rows, len(self))))
+
+    def to_pandas(self, positions: Optional[np.ndarray] = None) -> pd.DataFrame:
+        """
+        The selected rows, or the ones at positions among them, as a pandas dataframe indexed by their position in
+        the table, as boolean indexing would. The strings stay arrow backed, see table_to_pandas.
+        """
+        rows = self.selection if positions is None else self.selection[positions]
+        df = table_to_pandas(self.take(positions))
+        df.index = pd.Index(rows)
+        return df
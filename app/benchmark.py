@@ -0,0 +1,344 @@
+import argparse
+import json
+import os
+from typing import Iterable, List, Optional
+
+import pandas as pd
+from sqlalchemy import create_engine
+from sqlalchemy import text as sql_text
+
+from app import (
+    calculate_columns_ratio,
+    imdb_run_preproc_and_cleaner,
+    merge_imdb_and_wiki,
+    wiki_run_preproc_and_cleaner,
+)
+from db_loader import RESULT_SCHEMA, copy_dataframe_to_table, db_pool_size
+from files_handler import (
+    read_imdb_movies_metadata,
+    read_wiki,
+    read_wiki_arrow,
+    write_wiki_cache,
+    write_wiki_to_csv,
+)
+from frame_dtypes import optimise_dtypes
+from fuzzy_match import fill_unmatched_urls
+from instrumentation import finish_run, measure, stage, start_run
+from synthetic_data import generate_datasets, generate_imdb_metadata
+from title_keys import add_title_keys
+
+BENCHMARK_SCALES = [10_000, 100_000, 1_000_000, 10_000_000]
+BENCHMARK_DATA_DIR = "/tmp/truelayer_benchmark"
+BENCHMARK_RESULTS_FILE = "./benchmark_results.json"
+# The fast tier run by the regression gate of test_orchestrator, a few seconds per repeat
+FAST_BENCHMARK_SCALES = [100_000]
+FAST_BENCHMARK_REPEAT = 3
+BENCHMARK_BASELINE_FILE = "./benchmark_baseline.json"
+# A step regresses when its throughput drops, or its peak memory grows, by more than the tolerance
+BENCHMARK_TOLERANCE = 0.3
+# Steps faster than this in the baseline are dominated by timer noise and are not compared
+MIN_COMPARED_WALL_S = 0.005
+# The COPY loader is compared to the to_sql baseline it replaced, at each size
+UPLOAD_BENCHMARK_SIZES = [1_000, 100_000, 1_000_000]
+UPLOAD_BENCHMARK_PARTITIONS = [1, 2, 4, 8]
+UPLOAD_BENCHMARK_TABLE = "truelayer_films_upload_benchmark"
+
+
+def benchmark_scale(
+    n_docs: int,
+    data_dir: str = BENCHMARK_DATA_DIR,
+    seed: int = 0,
+    fuzzy_workers: int = 1,
+) -> dict:
+    """
+    Runs the pipeline steps, without the database, on the synthetic datasets of n_docs abstracts (generated in
+    data_dir the first time, see generate_datasets) and measures each of them.
+
+    param: fuzzy_workers: number of processes of the fuzzy_match step, see fill_unmatched_urls
+    returns: dict step name -> wall_s, cpu_s, rows, rows_per_s and peak_rss_mb, the cleaner rules are nested
+             steps (e.g. clean_imdb/no_zero_values_budget). The merge and fuzzy_match steps also have the
+             match_rate, the share of the films with an url after them.
+    """
+    csv_file, xml_file = generate_datasets(data_dir, n_docs, seed)
+    scale_dir = os.path.join(data_dir, f"run_{n_docs}_{seed}")
+    os.makedirs(scale_dir, exist_ok=True)
+    wiki_csv_file = os.path.join(scale_dir, "wiki_data.csv")
+    wiki_cache_file = os.path.join(scale_dir, "wiki_data.feather")
+
+    # The cleaners write their logs in the working directory
+    cwd = os.getcwd()
+    os.chdir(scale_dir)
+    start_run()
+    try:
+        # The dump steps return nothing, their rows are the docs of the dump
+        with stage("write_wiki_to_csv", rows_in=n_docs):
+            write_wiki_to_csv(xml_file, wiki_csv_file)
+        with stage("write_wiki_cache", rows_in=n_docs):
+            write_wiki_cache(xml_file, wiki_cache_file)
+        df_imdb = measure("read_imdb", read_imdb_movies_metadata, csv_file)
+        df_imdb = measure("clean_imdb", imdb_run_preproc_and_cleaner, df_imdb)
+        # The arrow steps run before the pandas wiki dataset is read, so their peak memory doesn't include it
+        wiki_frame = measure(
+            "read_wiki_arrow", read_wiki_arrow, wiki_cache_file, xml_file=xml_file
+        )
+        wiki_frame = measure(
+            "clean_wiki_arrow", wiki_run_preproc_and_cleaner, wiki_frame
+        )
+        with stage("merge_arrow", rows_in=len(df_imdb) + len(wiki_frame)) as record:
+            record.rows_out = len(merge_imdb_and_wiki(df_imdb, wiki_frame))
+        del wiki_frame
+        measure("read_wiki_csv", read_wiki, wiki_csv_file)
+        df_wiki = measure("read_wiki", read_wiki, wiki_cache_file, xml_file=xml_file)
+        df_wiki = measure("clean_wiki", wiki_run_preproc_and_cleaner, df_wiki)
+        with stage("merge", rows_in=len(df_imdb) + len(df_wiki)) as record:
+            df_joined = merge_imdb_and_wiki(df_imdb, df_wiki)
+            record.rows_out = len(df_joined)
+        exact_match_rate = df_joined["url"].notna().mean()
+        # fill_unmatched_urls measures itself, rows are the films without url and rows_out the fuzzy matches
+        fuzzy_match_rate = (
+            fill_unmatched_urls(df_joined, df_wiki, workers=fuzzy_workers)["url"]
+            .notna()
+            .mean()
+        )
+        df_optimised = measure("dtypes", optimise_dtypes, df_joined)
+        measure("ratio", calculate_columns_ratio, df_joined)
+        measure("ratio_optimised_dtypes", calculate_columns_ratio, df_optimised)
+        df_imdb = measure(
+            "imdb_title_keys", add_title_keys, df_imdb, ["title", "original_title"]
+        )
+        df_wiki = measure("wiki_title_keys", add_title_keys, df_wiki, ["title"])
+        with stage("merge_title_keys", rows_in=len(df_imdb) + len(df_wiki)) as record:
+            df_joined = merge_imdb_and_wiki(df_imdb, df_wiki, title_keys=True)
+            record.rows_out = len(df_joined)
+    finally:
+        report = finish_run()
+        os.chdir(cwd)
+
+    results = {}
+    for name, step in report["stages"].items():
+        rows = step["rows_in"] if step["rows_in"] is not None else step["rows_out"]
+        results[name] = {
+            "wall_s": step["wall_s"],
+            "cpu_s": step["cpu_s"],
+            "rows": rows,
+            "rows_per_s": rows / step["wall_s"] if rows and step["wall_s"] else None,
+            "peak_rss_mb": step["peak_rss_mb"],
+        }
+    results["merge"]["match_rate"] = exact_match_rate
+    results["fuzzy_match"]["match_rate"] = fuzzy_match_rate
+    return results
+
+
+def _result_like_frame(n_rows: int, seed: int = 0) -> pd.DataFrame:
+    """
+    A frame with the columns and dtypes of the uploaded result, built from the synthetic imdb metadata.
+    """
+    df = generate_imdb_metadata(n_rows, seed)
+    df = df[
+        [
+            "title",
+            "original_title",
+            "budget",
+            "revenue",
+            "release_date",
+            "vote_average",
+            "production_companies",
+        ]
+    ]
+    df = df.assign(
+        budget=pd.to_numeric(df["budget"], errors="coerce"),
+        revenue=pd.to_numeric(df["revenue"], errors="coerce"),
+        url="https://en.wikipedia.org/wiki/"
+        + df["title"].fillna("").str.replace(" ", "_"),
+    )
+    return calculate_columns_ratio(optimise_dtypes(df))
+
+
+def benchmark_upload(
+    database_url: str,
+    sizes: Iterable[int] = UPLOAD_BENCHMARK_SIZES,
+    partition_counts: Iterable[int] = UPLOAD_BENCHMARK_PARTITIONS,
+    seed: int = 0,
+) -> dict:
+    """
+    Uploads a result-like frame of each size to a scratch table of the database, dropped afterwards: first with
+    to_sql(if_exists="replace"), the row-wise inserts the COPY loader replaced, then with copy_dataframe_to_table,
+    index build included, once for each partition count.
+
+    returns: dict size (as a string, as in the json) -> dict "to_sql" or "copy_{partitions}" -> wall_s, cpu_s,
+             rows, rows_per_s and peak_rss_mb
+    """
+    partition_counts = list(partition_counts)
+    engine = create_engine(
+        database_url, pool_size=db_pool_size(max(partition_counts)), max_overflow=0
+    )
+    with engine.begin() as connection:
+        connection.execute(sql_text(f"CREATE SCHEMA IF NOT EXISTS {RESULT_SCHEMA}"))
+    start_run()
+    try:
+        for n_rows in sizes:
+            df = _result_like_frame(n_rows, seed)
+            with stage(str(n_rows)):
+                with stage("to_sql", rows_in=len(df)):
+                    df.to_sql(
+                        UPLOAD_BENCHMARK_TABLE,
+                        engine,
+                        schema=RESULT_SCHEMA,
+                        if_exists="replace",
+                        index=False,
+                    )
+                for partitions in partition_counts:
+                    with stage(f"copy_{partitions}", rows_in=len(df)):
+                        copy_dataframe_to_table(
+                            df,
+                            engine,
+                            table_name=UPLOAD_BENCHMARK_TABLE,
+                            # Partitions of any size, so the partition count is the one asked for
+                            partitions=partitions,
+                            min_partition_rows=1,
+                        )
+    finally:
+        report = finish_run()
+        with engine.begin() as connection:
+            connection.execute(
+                sql_text(
+                    f"DROP TABLE IF EXISTS {RESULT_SCHEMA}.{UPLOAD_BENCHMARK_TABLE}"
+                )
+            )
+        engine.dispose()
+
+    results = {}
+    for name, step in report["stages"].items():
+        if "/" not in name:
+            continue
+        n_rows, loader = name.split("/")
+        results.setdefault(n_rows, {})[loader] = {
+            "wall_s": step["wall_s"],
+            "cpu_s": step["cpu_s"],
+            "rows": step["rows_in"],
+            "rows_per_s": step["rows_in"] / step["wall_s"],
+            "peak_rss_mb": step["peak_rss_mb"],
+        }
+    for n_rows, loaders in results.items():
+        to_sql_wall_s = loaders["to_sql"]["wall_s"]
+        print(f"\nUpload of {n_rows} rows")
+        print(
+            f"{'loader':<12}{'wall_s':>10}{'cpu_s':>10}{'rows/s':>14}{'peak_mb':>10}"
+            f"{'speedup':>10}"
+        )
+        for loader, step in loaders.items():
+            print(
+                f"{loader:<12}{step['wall_s']:>10.3f}{step['cpu_s']:>10.3f}"
+                f"{step['rows_per_s']:>14.0f}{step['peak_rss_mb']:>10.1f}"
+                f"{to_sql_wall_s / step['wall_s']:>9.1f}x"
+            )
+    return results
+
+
+def run_benchmarks(
+    scales: Iterable[int] = BENCHMARK_SCALES,
+    data_dir: str = BENCHMARK_DATA_DIR,
+    seed: int = 0,
+    output_file: Optional[str] = BENCHMARK_RESULTS_FILE,
+    repeat: int = 1,
+    fuzzy_workers: int = 1,
+) -> dict:
+    """
+    Runs benchmark_scale for each scale, prints the results and writes them as json in output_file.
+
+    param: repeat: run each scale that many times and keep the best run of each step, the highest throughput
+                   and lowest peak memory, which are the least affected by the other processes of the machine
+    returns: dict scale (as a string, as in the json) -> results of benchmark_scale
+    """
+    results = {}
+    for n_docs in scales:
+        runs = [
+            benchmark_scale(n_docs, data_dir, seed, fuzzy_workers)
+            for _ in range(repeat)
+        ]
+        results[str(n_docs)] = {
+            name: min(
+                (run[name] for run in runs),
+                key=lambda step: (step["wall_s"], step["peak_rss_mb"]),
+            )
+            for name in runs[0]
+        }
+        print(f"\n{n_docs} wiki docs")
+        print(f"{'step':<45}{'wall_s':>10}{'cpu_s':>10}{'rows/s':>14}{'peak_mb':>10}")
+        for name, step in results[str(n_docs)].items():
+            rows_per_s = f"{step['rows_per_s']:.0f}" if step["rows_per_s"] else "-"
+            print(
+                f"{name:<45}{step['wall_s']:>10.3f}{step['cpu_s']:>10.3f}"
+                f"{rows_per_s:>14}{step['peak_rss_mb']:>10.1f}"
+            )
+        for name, step in results[str(n_docs)].items():
+            if "match_rate" in step:
+                print(f"match rate after {name}: {step['match_rate']:.1%}")
+    if output_file is not None:
+        with open(output_file, "w") as f:
+            json.dump(results, f, indent=2)
+    return results
+
+
+def compare_to_baseline(
+    results: dict, baseline: dict, tolerance: float = BENCHMARK_TOLERANCE
+) -> List[str]:
+    """
+    Compares the results of run_benchmarks to a baseline of the same format, scale by scale and step by step.
+
+    returns: a message for each step whose throughput (rows/s) is lower than the baseline one by more than
+             tolerance, or whose peak memory is higher by more than tolerance. Empty when nothing regressed.
+    """
+    regressions = []
+    for scale, steps in results.items():
+        for name, step in steps.items():
+            base_step = baseline.get(scale, {}).get(name)
+            if base_step is None or base_step["wall_s"] < MIN_COMPARED_WALL_S:
+                continue
+            if base_step["rows_per_s"] and step["rows_per_s"]:
+                if step["rows_per_s"] < base_step["rows_per_s"] * (1 - tolerance):
+                    regressions.append(
+                        f"{scale} docs, {name}: {step['rows_per_s']:.0f} rows/s, "
+                        f"baseline {base_step['rows_per_s']:.0f} rows/s"
+                    )
+            if step["peak_rss_mb"] > base_step["peak_rss_mb"] * (1 + tolerance):
+                regressions.append(
+                    f"{scale} docs, {name}: peak memory {step['peak_rss_mb']:.1f} MB, "
+                    f"baseline {base_step['peak_rss_mb']:.1f} MB"
+                )
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Benchmarks the pipeline steps on synthetic datasets, without docker nor database."
+    )
+    parser.add_argument("--scales", type=int, nargs="+", default=BENCHMARK_SCALES)
+    parser.add_argument("--data-dir", default=BENCHMARK_DATA_DIR)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default=BENCHMARK_RESULTS_FILE)
+    parser.add_argument("--repeat", type=int, default=1)
+    parser.add_argument("--fuzzy-workers", type=int, default=1)
+    parser.add_argument(
+        "--database-url",
+        help="also benchmark the upload to this postgres database, e.g. postgresql://postgres@localhost/truelayer",
+    )
+    parser.add_argument(
+        "--upload-sizes", type=int, nargs="+", default=UPLOAD_BENCHMARK_SIZES
+    )
+    parser.add_argument(
+        "--upload-partitions", type=int, nargs="+", default=UPLOAD_BENCHMARK_PARTITIONS
+    )
+    args = parser.parse_args()
+    if args.database_url:
+        benchmark_upload(
+            args.database_url, args.upload_sizes, args.upload_partitions, args.seed
+        )
+    run_benchmarks(
+        args.scales,
+        args.data_dir,
+        args.seed,
+        args.output,
+        args.repeat,
+        args.fuzzy_workers,
+    )
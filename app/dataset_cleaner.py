@@ -1,79 +1,500 @@
+import os
+from typing import Iterable, Iterator, Optional, Union
+
+import numpy as np
 import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+from arrow_frames import ArrowFrame, arrow_to_numpy
+from instrumentation import stage
+
+# The outcome of every rule is stored as 1 bit per row, so we can't track more rules than bits in the mask
+MAX_TRACKED_RULES = 64
+
+# "rejected" only logs the removed rows with their bitmask as a reason code, "full" logs every row with
+# one boolean column per rule
+AUDIT_MODES = ["rejected", "full"]
+REASON_CODE_COLUMN = "failed_rules"
 
 
 class DatasetCleaner:
-    def __init__(self, df):
+    def __init__(self, df: Union[pd.DataFrame, ArrowFrame, Iterable[pd.DataFrame]]):
         """
-        Constructor that receives the dataframe to instantiate the DatasetCleaner class
+        Constructor that receives the dataframe to instantiate the DatasetCleaner class.
+        It also accepts an iterable of dataframes (batches), in which case the rules are evaluated batch by batch,
+        see iter_cleaned_batches, or an ArrowFrame, in which case the rules are evaluated in arrow and the cleaned
+        dataframe is the same ArrowFrame with a narrower selection.
         """
         self._df = df
-        self._initial_columns = df.columns
-        self._tracked_columns = []
+        self._reset_rules()
 
     @property
     def df(self):
-        return self._df
+        """
+        The dataframe with an extra boolean column for each of the tracked columns, see get_audit_dataframe.
+        """
+        return self.get_audit_dataframe()
 
     @df.setter
     def df(self, df):
         self._df = df
+        self._reset_rules()
+
+    @property
+    def is_stream(self) -> bool:
+        return not isinstance(self._df, (pd.DataFrame, ArrowFrame))
+
+    def _reset_rules(self) -> None:
+        self._initial_columns = None if self.is_stream else self._df.columns
+        # The plan is the list of rules to evaluate: (tracking_col_name, rule, columns, params)
+        # The rules are only evaluated when a result is needed, all of them in the same pass over the data.
+        self._plan = []
+        # Bit i of a row is set when the row failed the rule self._plan[i], None until the plan is evaluated
+        self._failed_rules = None
+        self._audit_file_path = None
+        self._audit_mode = None
+        self._stream_consumed = False
+
+    def _add_rule(
+        self, tracking_col_name: str, rule: str, columns: list, **params
+    ) -> None:
+        if len(self._plan) >= MAX_TRACKED_RULES:
+            raise ValueError(
+                f"DatasetCleaner can track at most {MAX_TRACKED_RULES} rules."
+            )
+        self._plan.append((tracking_col_name, rule, columns, params))
+        self._failed_rules = None
+
+    @property
+    def _tracked_columns(self) -> list:
+        return [tracking_col_name for tracking_col_name, _, _, _ in self._plan]
 
     def check_missing_values(self, columns: list) -> None:
         """
-        Creates a new column for each of the columns in the columns parameter.
-        Each of the new columns state whether there are no missing values in the column they track.
-        The new columns' names are computed as "no_missing_{check_col}".
+        Tracks a rule for each of the columns in the columns parameter.
+        Each of the rules state whether there are no missing values in the column they track.
+        The rules' names are computed as "no_missing_{check_col}".
 
         At the end of the cleaner we write the dataframe to a csv.
-        Hence we can see the reason we removed each row based on these new columns.
+        Hence we can see the reason we removed each row based on these rules, written as extra columns.
         We can always go back to see which rows have been removed from the initial dataset.
 
         To get a full dataframe with the cleaned rows see method get_cleaned_dataframe.
         """
         for check_col in columns:
-            tracking_col_name = f"no_missing_{check_col}"
-            # We need the following code line for the method get_cleaned_dataframe such that we can check
-            # if all the tracked column have missing values from the required columns or not. If they do
-            # then we remove them. If not, we retain them and return in a clean dataframe.
-            self._tracked_columns.append(tracking_col_name)
-            self._df[tracking_col_name] = True
-            self._df.loc[self._df[check_col].isna(), tracking_col_name] = False
+            self._add_rule(f"no_missing_{check_col}", "missing", [check_col])
 
     def check_zero_values(self, columns: list) -> None:
         """
-        Creates a new column for each of the columns in the columns parameter.
-        Each of the new columns state whether there are zero values in the column they track.
-        The new columns' names are computed as "no_zero_values_{check_col}".
+        Tracks a rule for each of the columns in the columns parameter.
+        Each of the rules state whether there are zero values in the column they track.
+        The rules' names are computed as "no_zero_values_{check_col}".
 
         At the end of the cleaner we write the dataframe to a csv.
-        Hence we can see the reason we removed each row based on these new columns.
+        Hence we can see the reason we removed each row based on these rules, written as extra columns.
         We can always go back to see which rows have been removed from the initial dataset.
 
         To get a full dataframe with the cleaned rows see method get_cleaned_dataframe.
         """
         for check_col in columns:
-            tracking_col_name = f"no_zero_values_{check_col}"
-            # We need the following code line for the method get_cleaned_dataframe such that we can check
-            # if all the tracked column have missing values from the required columns or not. If they do
-            # then we remove them. If not, we retain them and return in a clean dataframe.
-            self._tracked_columns.append(tracking_col_name)
-            self._df[tracking_col_name] = True
-            self._df.loc[self._df[check_col] == 0, tracking_col_name] = False
+            self._add_rule(f"no_zero_values_{check_col}", "zero", [check_col])
+
+    def check_range(
+        self,
+        columns: list,
+        min_value: Optional[float] = None,
+        max_value: Optional[float] = None,
+    ) -> None:
+        """
+        Tracks a rule for each of the columns in the columns parameter.
+        Each of the rules state whether the values of the column they track are within [min_value, max_value],
+        a bound set to None is not checked. Missing values are not out of range, see check_missing_values.
+        The rules' names are computed as "in_range_{check_col}".
+        """
+        for check_col in columns:
+            self._add_rule(
+                f"in_range_{check_col}",
+                "range",
+                [check_col],
+                min_value=min_value,
+                max_value=max_value,
+            )
+
+    def check_regex(self, columns: list, pattern: str) -> None:
+        """
+        Tracks a rule for each of the columns in the columns parameter.
+        Each of the rules state whether the string values of the column they track match the regex pattern
+        from their start. Missing values are not checked, see check_missing_values.
+        The rules' names are computed as "matches_regex_{check_col}".
+        """
+        for check_col in columns:
+            self._add_rule(
+                f"matches_regex_{check_col}", "regex", [check_col], pattern=pattern
+            )
+
+    def check_duplicates(self, columns: list) -> None:
+        """
+        Tracks a single rule stating whether the row is the first occurrence of its values in the columns parameter.
+        Over a stream of batches the duplicates are also found across batches.
+        The rule's name is computed as "no_duplicates_{col1}_{col2}...".
+        """
+        self._add_rule(f"no_duplicates_{'_'.join(columns)}", "duplicates", columns)
+
+    @staticmethod
+    def _failed_arrow_rows(
+        frame: ArrowFrame, rule: str, columns: list, params: dict
+    ) -> np.ndarray:
+        """
+        Evaluates a rule of the plan on the selected rows of an ArrowFrame. The missing, zero and range rules run
+        in arrow over the whole column, the regex and duplicates ones on the pandas columns of the selected rows.
+
+        returns: boolean array stating which selected rows failed the rule
+        """
+        if rule in ["regex", "duplicates"]:
+            return DatasetCleaner._failed_rows(
+                frame.to_pandas()[columns], rule, columns, params, None
+            )
+
+        def selected(failed: pa.ChunkedArray) -> np.ndarray:
+            return frame.at_selection(arrow_to_numpy(pc.fill_null(failed, False)))
+
+        values = frame.column(columns[0])
+        if rule == "missing":
+            failed = selected(pc.is_null(values))
+            if pa.types.is_floating(values.type):
+                failed |= selected(pc.is_nan(values))
+            return failed
+        if rule == "zero":
+            # As in pandas, where a string never equals 0 and False does
+            if pa.types.is_boolean(values.type):
+                return selected(pc.invert(values))
+            if not (
+                pa.types.is_integer(values.type)
+                or pa.types.is_floating(values.type)
+                or pa.types.is_decimal(values.type)
+            ):
+                return np.zeros(len(frame), dtype=bool)
+            return selected(pc.equal(values, 0))
+        if rule == "range":
+            failed = np.zeros(len(frame), dtype=bool)
+            if params["min_value"] is not None:
+                failed |= selected(pc.less(values, params["min_value"]))
+            if params["max_value"] is not None:
+                failed |= selected(pc.greater(values, params["max_value"]))
+            return failed
+        raise ValueError(f"Unknown DatasetCleaner rule {rule}.")
+
+    @staticmethod
+    def _failed_rows(
+        df: pd.DataFrame, rule: str, columns: list, params: dict, seen: Optional[set]
+    ) -> np.ndarray:
+        """
+        Evaluates a rule of the plan on df.
+
+        param: seen: the keys already met by a duplicates rule, kept between the batches of a stream.
+                     None when df is the whole dataset.
+        returns: boolean array stating which rows failed the rule
+        """
+        if rule == "missing":
+            return df[columns[0]].isna().to_numpy()
+        if rule == "zero":
+            return (df[columns[0]] == 0).to_numpy(dtype=bool)
+        if rule == "range":
+            values = df[columns[0]]
+            failed = np.zeros(len(df), dtype=bool)
+            if params["min_value"] is not None:
+                failed |= (values < params["min_value"]).to_numpy(dtype=bool)
+            if params["max_value"] is not None:
+                failed |= (values > params["max_value"]).to_numpy(dtype=bool)
+            return failed
+        if rule == "regex":
+            matches = df[columns[0]].str.match(params["pattern"], na=True)
+            return ~matches.to_numpy(dtype=bool)
+        if rule == "duplicates":
+            failed = df.duplicated(subset=columns, keep="first").to_numpy()
+            if seen is None:
+                return failed
+            # The missing values of a key are all None, so they match across batches as in df.duplicated
+            keys = list(
+                zip(
+                    *(
+                        df[col].astype(object).where(df[col].notna(), None)
+                        for col in columns
+                    )
+                )
+            )
+            if seen:
+                failed |= np.fromiter((key in seen for key in keys), bool, len(keys))
+            seen.update(key for key, is_failed in zip(keys, failed) if not is_failed)
+            return failed
+        raise ValueError(f"Unknown DatasetCleaner rule {rule}.")
+
+    def _evaluate_plan(self, df: pd.DataFrame, state: Optional[dict]) -> np.ndarray:
+        """
+        Evaluates all the rules of the plan on df in a single pass, without adding any column to it.
+
+        param: state: per rule state kept between the batches of a stream, None when df is the whole dataset
+        returns: the bitmask of the failed rules, using the smallest unsigned integer type that holds all the rules
+        """
+        dtype = np.min_scalar_type(1 << max(len(self._plan) - 1, 0))
+        failed_rules = np.zeros(len(df), dtype=dtype)
+        for bit, (tracking_col_name, rule, columns, params) in enumerate(self._plan):
+            seen = None if state is None else state.setdefault(tracking_col_name, set())
+            with stage(tracking_col_name, rows_in=len(df)) as record:
+                if isinstance(df, ArrowFrame):
+                    failed_rows = self._failed_arrow_rows(df, rule, columns, params)
+                else:
+                    failed_rows = self._failed_rows(df, rule, columns, params, seen)
+                record.rows_out = len(df) - int(np.count_nonzero(failed_rows))
+            np.bitwise_or(
+                failed_rules, dtype.type(1 << bit), out=failed_rules, where=failed_rows
+            )
+        return failed_rules
+
+    def _expand_audit(self, df: pd.DataFrame, failed_rules: np.ndarray) -> pd.DataFrame:
+        """
+        Expands the bitmask into one boolean column per tracked rule, named after the rule, which is True
+        when the row passed the rule.
+
+        Returns: a copy of df with the tracked columns added
+        """
+        audit_df = df.to_pandas() if isinstance(df, ArrowFrame) else df.copy()
+        for bit, tracking_col_name in enumerate(self._tracked_columns):
+            audit_df[tracking_col_name] = (failed_rules >> bit) & 1 == 0
+        return audit_df
+
+    def _get_failed_rules(self) -> np.ndarray:
+        if self.is_stream:
+            raise ValueError(
+                "The cleaner runs over a stream of batches, use iter_cleaned_batches or get_cleaned_dataframe."
+            )
+        if self._failed_rules is None:
+            self._failed_rules = self._evaluate_plan(self._df, None)
+        return self._failed_rules
+
+    def get_audit_dataframe(self) -> pd.DataFrame:
+        """
+        Returns a copy of the dataframe with an extra boolean column per tracked rule, which is True
+        when the row passed the rule. The dataframe given to the cleaner is not modified.
+        """
+        return self._expand_audit(self._df, self._get_failed_rules())
+
+    def _rejected_rows(
+        self, df: pd.DataFrame, failed_rules: np.ndarray
+    ) -> pd.DataFrame:
+        """
+        Returns the rows of df that failed at least a rule, with the bitmask of the failed rules
+        as a compact reason code in the REASON_CODE_COLUMN column. Bit i is the rule i of the summary.
+        """
+        rejected = failed_rules != 0
+        if isinstance(df, ArrowFrame):
+            rejected_df = df.to_pandas(np.flatnonzero(rejected))
+        else:
+            rejected_df = df[rejected].copy()
+        rejected_df[REASON_CODE_COLUMN] = failed_rules[rejected]
+        return rejected_df
+
+    def _count_failed_rows(self, failed_rules: np.ndarray) -> np.ndarray:
+        """
+        Returns the number of rows which failed each of the rules of the plan.
+        """
+        return np.array(
+            [
+                np.count_nonzero((failed_rules >> bit) & 1)
+                for bit in range(len(self._plan))
+            ],
+            dtype=np.int64,
+        )
+
+    @staticmethod
+    def _write_audit(
+        df: pd.DataFrame, file_path: str, mode: str = "w", header: bool = True
+    ) -> None:
+        """
+        Writes an audit dataframe as csv, or as a zstd compressed parquet file when file_path ends in .parquet
+        """
+        if file_path.endswith(".parquet"):
+            df.to_parquet(file_path, compression="zstd")
+        else:
+            df.to_csv(file_path, mode=mode, header=header)
+
+    def _append_audit(
+        self,
+        df: pd.DataFrame,
+        source_df: pd.DataFrame,
+        writer: Optional[pq.ParquetWriter],
+        first: bool,
+    ) -> Optional[pq.ParquetWriter]:
+        """
+        Appends the audit rows of a batch of a stream to the audit file, so they are never gathered in memory.
+        The first batch creates the file, with the header of the csv even when it has no row.
+
+        param: source_df: the batch the audit rows come from. The parquet schema is built from its dtypes, the
+                          audit rows of the first batch alone may leave a column without any value.
+        param: writer: the parquet writer returned for the previous batch, None for the first one
+        returns: the parquet writer to append the next batches to, None for a csv file
+        """
+        if not self._audit_file_path.endswith(".parquet"):
+            self._write_audit(
+                df, self._audit_file_path, mode="w" if first else "a", header=first
+            )
+            return None
+        table = pa.Table.from_pandas(df, preserve_index=True)
+        if writer is None:
+            source_schema = pa.Schema.from_pandas(source_df, preserve_index=True)
+            fields = [
+                (
+                    source_schema.field(name)
+                    if name in source_schema.names
+                    else table.schema.field(name)
+                )
+                for name in table.schema.names
+            ]
+            # A column without any value in the whole batch can't hold the values of the next ones
+            schema = pa.schema(
+                [
+                    (
+                        field.with_type(pa.string())
+                        if pa.types.is_null(field.type)
+                        else field
+                    )
+                    for field in fields
+                ],
+                metadata=table.schema.metadata,
+            )
+            writer = pq.ParquetWriter(self._audit_file_path, schema, compression="zstd")
+        writer.write_table(table.cast(writer.schema))
+        return writer
+
+    def _write_summary(
+        self,
+        file_path: str,
+        failed_rows: np.ndarray,
+        rejected_rows: int,
+        total_rows: int,
+    ) -> None:
+        """
+        Writes the number of rows failing each rule next to the audit file, as {audit file name}_summary.csv
+        """
+        summary_df = pd.DataFrame(
+            {
+                "rule": self._tracked_columns + ["rejected_rows", "total_rows"],
+                "bit": list(range(len(self._plan))) + [None, None],
+                "failed_rows": list(failed_rows) + [rejected_rows, total_rows],
+            }
+        )
+        summary_df.to_csv(f"{os.path.splitext(file_path)[0]}_summary.csv", index=False)
 
     def write_to_csv(
-        self, file_path: str = f"./logs_dataset_cleaner_result.csv"
+        self,
+        file_path: str = f"./logs_dataset_cleaner_result.csv",
+        audit_mode: str = "rejected",
     ) -> None:
-        self._df.to_csv(file_path)
+        """
+        Writes the audit of the cleaner to file_path (csv, or compressed parquet if the path ends in .parquet)
+        and the number of rows failing each rule to {file_path without extension}_summary.csv.
+
+        param: audit_mode: "rejected" writes only the removed rows, with the bitmask of the rules they failed in
+                           the failed_rules column. "full" writes every row with one boolean column per rule,
+                           see get_audit_dataframe.
+
+        Over a stream of batches the audit is written while the stream is consumed, see iter_cleaned_batches.
+        """
+        if audit_mode not in AUDIT_MODES:
+            raise ValueError(f"audit_mode must be one of {AUDIT_MODES}.")
+        if self.is_stream:
+            if audit_mode == "full" and file_path.endswith(".parquet"):
+                raise ValueError(
+                    "The full audit of a stream of batches can only be written to csv."
+                )
+            self._audit_file_path = file_path
+            self._audit_mode = audit_mode
+            return
+
+        failed_rules = self._get_failed_rules()
+        if audit_mode == "full":
+            audit_df = self._expand_audit(self._df, failed_rules)
+        else:
+            audit_df = self._rejected_rows(self._df, failed_rules)
+        self._write_audit(audit_df, file_path)
+        self._write_summary(
+            file_path,
+            self._count_failed_rows(failed_rules),
+            np.count_nonzero(failed_rules),
+            len(failed_rules),
+        )
+
+    def iter_cleaned_batches(self) -> Iterator[pd.DataFrame]:
+        """
+        Evaluates the plan and yields the rows that passed all the tracked rules, a batch at a time
+        when the cleaner runs over a stream (the stream can only be consumed once).
+        If write_to_csv was called on a stream, the audit of every batch (its rejected rows, or all its rows with
+        the full audit) is appended to its file as the batch is cleaned, and the summary is written once the stream
+        is consumed.
+        """
+        if not self.is_stream:
+            yield self.get_cleaned_dataframe()
+            return
+        if self._stream_consumed:
+            raise ValueError("The stream of batches has already been consumed.")
+        self._stream_consumed = True
+
+        state = {}
+        first = True
+        writer = None
+        failed_rows = np.zeros(len(self._plan), dtype=np.int64)
+        rejected_rows = 0
+        total_rows = 0
+        try:
+            for batch in self._df:
+                failed_rules = self._evaluate_plan(batch, state)
+                if self._audit_file_path is not None:
+                    failed_rows += self._count_failed_rows(failed_rules)
+                    rejected_rows += np.count_nonzero(failed_rules)
+                    total_rows += len(batch)
+                    if self._audit_mode == "full":
+                        audit_df = self._expand_audit(batch, failed_rules)
+                    else:
+                        audit_df = self._rejected_rows(batch, failed_rules)
+                    writer = self._append_audit(audit_df, batch, writer, first)
+                    first = False
+                yield batch[failed_rules == 0]
+
+            if self._audit_file_path is not None:
+                if first:
+                    # An empty stream still gets an audit file, with the columns known without any batch
+                    audit_df = pd.DataFrame(
+                        columns=(
+                            self._tracked_columns
+                            if self._audit_mode == "full"
+                            else [REASON_CODE_COLUMN]
+                        )
+                    )
+                    self._append_audit(audit_df, audit_df, None, first)
+                self._write_summary(
+                    self._audit_file_path, failed_rows, rejected_rows, total_rows
+                )
+        finally:
+            if writer is not None:
+                writer.close()
 
     def get_cleaned_dataframe(self) -> pd.DataFrame:
         """
-        Returns the dataframe rows where all the tracked columns contain True values.
+        Returns the dataframe rows that passed all the tracked rules, i.e. with no bit set in the bitmask.
         The columns returned will be stored in the self._initial_columns attribute, so we can always remove
-        the extra columns added by the dataset cleaner
+        any extra columns
+
+        On an ArrowFrame nothing is copied, the cleaned rows are an ArrowFrame over the same table.
 
         Returns: result_df: cleaned pandas Dataframe
         """
-        result_df = self._df[self._df[self._tracked_columns].all(axis="columns")][
-            self._initial_columns
-        ]
+        if self.is_stream:
+            batches = list(self.iter_cleaned_batches())
+            if not batches:
+                return pd.DataFrame()
+            return pd.concat(batches, ignore_index=True)
+        if isinstance(self._df, ArrowFrame):
+            return self._df.filter(self._get_failed_rules() == 0)
+        result_df = self._df.loc[self._get_failed_rules() == 0, self._initial_columns]
         return result_df
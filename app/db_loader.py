@@ -0,0 +1,233 @@
+import io
+from concurrent.futures import ThreadPoolExecutor
+from typing import Iterator, List, Optional
+
+import numpy as np
+import pandas as pd
+from psycopg2 import sql
+
+RESULT_SCHEMA = "truelayer_schema"
+RESULT_TABLE = "truelayer_films_result"
+# Rows written to the in-memory buffer for each COPY, so the buffer never holds the whole dataframe as text
+COPY_CHUNK_ROWS = 100_000
+# The dataframe is uploaded by up to UPLOAD_PARTITIONS concurrent COPY, each on its own connection of the engine pool,
+# a partition has at least MIN_PARTITION_ROWS rows so small results still go through a single connection
+UPLOAD_PARTITIONS = 4
+MIN_PARTITION_ROWS = COPY_CHUNK_ROWS
+# Indexed once the table is loaded, for the dashboards filtering or sorting on them
+RESULT_INDEX_COLUMNS = ["ratio", "title", "release_date"]
+
+
+def db_pool_size(partitions: int = UPLOAD_PARTITIONS) -> int:
+    """
+    The size of the engine pool uploading in up to partitions concurrent COPY: one connection per partition plus
+    the one creating and swapping the tables.
+    """
+    return max(1, partitions) + 1
+
+
+def postgres_column_types(df: pd.DataFrame) -> dict:
+    """
+    Maps the dataframe dtypes to postgres column types, anything that is not numeric, boolean or a date is text.
+
+    returns: dict column name -> postgres type
+    """
+    column_types = {}
+    for col, dtype in df.dtypes.items():
+        if pd.api.types.is_bool_dtype(dtype):
+            column_types[col] = "boolean"
+        elif pd.api.types.is_integer_dtype(dtype):
+            column_types[col] = "bigint"
+        elif pd.api.types.is_float_dtype(dtype):
+            column_types[col] = "double precision"
+        elif pd.api.types.is_datetime64_any_dtype(dtype):
+            column_types[col] = "timestamp"
+        else:
+            column_types[col] = "text"
+    return column_types
+
+
+def iter_csv_chunks(
+    df: pd.DataFrame, chunk_rows: int = COPY_CHUNK_ROWS
+) -> Iterator[io.StringIO]:
+    """
+    Writes the dataframe chunk by chunk in an in-memory csv buffer, in the format expected by COPY ... (FORMAT csv):
+    no header, no index and missing values as empty unquoted fields (NULL).
+    """
+    for start in range(0, len(df), chunk_rows):
+        buffer = io.StringIO()
+        df.iloc[start : start + chunk_rows].to_csv(buffer, index=False, header=False)
+        buffer.seek(0)
+        yield buffer
+
+
+def partition_bounds(
+    n_rows: int,
+    partitions: int = UPLOAD_PARTITIONS,
+    min_partition_rows: int = MIN_PARTITION_ROWS,
+) -> List[tuple]:
+    """
+    Splits n_rows rows in at most partitions contiguous ranges of nearly equal sizes, of at least min_partition_rows
+    rows each (except when there are fewer rows).
+
+    returns: list of (start, stop) positions, empty when there are no rows
+    """
+    partitions = max(1, min(partitions, n_rows // min_partition_rows))
+    bounds = np.linspace(0, n_rows, partitions + 1).astype(int)
+    return [
+        (start, stop) for start, stop in zip(bounds[:-1], bounds[1:]) if stop > start
+    ]
+
+
+def _copy_partition(
+    df: pd.DataFrame, engine, copy_statement: sql.Composed, chunk_rows: int
+) -> None:
+    """
+    COPY the rows of a partition to the staging table on a connection of its own, committed when done.
+    """
+    connection = engine.raw_connection()
+    try:
+        with connection.cursor() as cursor:
+            for buffer in iter_csv_chunks(df, chunk_rows):
+                cursor.copy_expert(copy_statement, buffer)
+        connection.commit()
+    except Exception:
+        connection.rollback()
+        raise
+    finally:
+        connection.close()
+
+
+def table_row_count(
+    engine, table_name: str = RESULT_TABLE, schema: str = RESULT_SCHEMA
+) -> Optional[int]:
+    """
+    The number of rows of schema.table_name, None when the table doesn't exist.
+    """
+    connection = engine.raw_connection()
+    try:
+        with connection.cursor() as cursor:
+            table = sql.Identifier(schema, table_name)
+            cursor.execute("SELECT to_regclass(%s)", [table.as_string(cursor)])
+            if cursor.fetchone()[0] is None:
+                return None
+            cursor.execute(sql.SQL("SELECT count(*) FROM {}").format(table))
+            return cursor.fetchone()[0]
+    finally:
+        connection.close()
+
+
+def _index_name(table_name: str, col: str) -> str:
+    return f"{table_name}_{col}_idx"
+
+
+def copy_dataframe_to_table(
+    df: pd.DataFrame,
+    engine,
+    table_name: str = RESULT_TABLE,
+    schema: str = RESULT_SCHEMA,
+    column_types: Optional[dict] = None,
+    chunk_rows: int = COPY_CHUNK_ROWS,
+    partitions: int = UPLOAD_PARTITIONS,
+    index_columns: Optional[List[str]] = None,
+    min_partition_rows: int = MIN_PARTITION_ROWS,
+) -> None:
+    """
+    Replaces schema.table_name with the content of the dataframe using COPY FROM STDIN instead of row-wise inserts.
+
+    The data is loaded into a staging table created with explicit column types. The rows are split in partitions
+    (see partition_bounds) copied concurrently, each over its own connection of the engine pool, so the pool size
+    bounds the connections used. The indexes are then built on the staging table, which replaces the table in a
+    single short transaction: readers see either the old or the new table, indexed, but never a half-written one.
+
+    param: engine: sqlalchemy engine of the postgres database (psycopg2 driver)
+    param: column_types: postgres types of the columns, derived from the dtypes when not given
+                         (see postgres_column_types)
+    param: chunk_rows: number of rows sent by each COPY
+    param: partitions: maximum number of concurrent COPY, 1 to load on a single connection. It is lowered to the
+                       size of the engine pool minus one, the connection creating and swapping the tables (see
+                       db_pool_size), as more partitions would only wait for a connection.
+    param: index_columns: columns indexed once the table is loaded, the ones of RESULT_INDEX_COLUMNS present in
+                          the dataframe when not given
+    param: min_partition_rows: smallest partition, see partition_bounds
+    """
+    pool_size = getattr(engine.pool, "size", None)
+    if pool_size is not None and partitions > pool_size() - 1:
+        print(
+            f"Uploading in {max(1, pool_size() - 1)} partitions instead of {partitions}, "
+            f"the engine pool has {pool_size()} connections."
+        )
+        partitions = max(1, pool_size() - 1)
+    column_types = column_types or postgres_column_types(df)
+    if index_columns is None:
+        index_columns = [col for col in RESULT_INDEX_COLUMNS if col in df.columns]
+    staging_table_name = f"{table_name}_staging"
+    staging_table = sql.Identifier(schema, staging_table_name)
+    target_table = sql.Identifier(schema, table_name)
+    columns = sql.SQL(", ").join(sql.Identifier(col) for col in df.columns)
+    column_definitions = sql.SQL(", ").join(
+        sql.SQL("{} {}").format(sql.Identifier(col), sql.SQL(column_types[col]))
+        for col in df.columns
+    )
+    copy_statement = sql.SQL("COPY {} ({}) FROM STDIN WITH (FORMAT csv)").format(
+        staging_table, columns
+    )
+
+    connection = engine.raw_connection()
+    try:
+        with connection.cursor() as cursor:
+            # The staging table is committed first, so the partition connections can see it
+            cursor.execute(sql.SQL("DROP TABLE IF EXISTS {}").format(staging_table))
+            cursor.execute(
+                sql.SQL("CREATE TABLE {} ({})").format(
+                    staging_table, column_definitions
+                )
+            )
+            connection.commit()
+
+            bounds = partition_bounds(len(df), partitions, min_partition_rows)
+            with ThreadPoolExecutor(max_workers=max(1, len(bounds))) as executor:
+                # list() raises the first error of the partitions, once they are all done
+                list(
+                    executor.map(
+                        lambda bound: _copy_partition(
+                            df.iloc[bound[0] : bound[1]],
+                            engine,
+                            copy_statement,
+                            chunk_rows,
+                        ),
+                        bounds,
+                    )
+                )
+
+            for col in index_columns:
+                cursor.execute(
+                    sql.SQL("CREATE INDEX {} ON {} ({})").format(
+                        sql.Identifier(_index_name(staging_table_name, col)),
+                        staging_table,
+                        sql.Identifier(col),
+                    )
+                )
+            cursor.execute(sql.SQL("ANALYZE {}").format(staging_table))
+            connection.commit()
+
+            cursor.execute(sql.SQL("DROP TABLE IF EXISTS {}").format(target_table))
+            cursor.execute(
+                sql.SQL("ALTER TABLE {} RENAME TO {}").format(
+                    staging_table, sql.Identifier(table_name)
+                )
+            )
+            for col in index_columns:
+                cursor.execute(
+                    sql.SQL("ALTER INDEX {} RENAME TO {}").format(
+                        sql.Identifier(schema, _index_name(staging_table_name, col)),
+                        sql.Identifier(_index_name(table_name, col)),
+                    )
+                )
+        connection.commit()
+    except Exception:
+        # A staging table left behind by a failed load is dropped by the next one
+        connection.rollback()
+        raise
+    finally:
+        connection.close()
@@ -1,51 +1,613 @@
+import bz2
+import gzip
+import io
+import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from typing import BinaryIO, Iterable, Iterator, List, Optional, Tuple
+
 import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.csv as pa_csv
+import pyarrow.feather as feather
+from arrow_frames import ArrowFrame, arrow_to_numpy
+from lxml import etree
+from title_keys import strip_title_prefix, title_key, title_key_array
+
+try:
+    # python-isal (in requirements.txt) is a drop in replacement for gzip that decompresses several times faster,
+    # the gzip module is only the fallback of an environment installed without it
+    from isal import igzip as gzip_module
+except ImportError:
+    gzip_module = gzip
+
+WIKI_XML_FILE = "/workdir/data_wikipedia/enwiki-latest-abstract.xml"
+WIKI_CSV_FILE = "/workdir/data_wikipedia/wiki_data.csv"
+WIKI_CACHE_FILE = "/workdir/data_wikipedia/wiki_data.feather"
+IMDB_CSV_FILE = "/workdir/data_imdb/movies_metadata.csv"
+
+# Only these children of each <doc> element are used downstream, the abstract and links are never read
+WIKI_COLUMNS = ["title", "url"]
+WIKI_BATCH_SIZE = 100_000
+
+IMDB_COLUMNS = [
+    "title",
+    "original_title",
+    "budget",
+    "revenue",
+    "release_date",
+    "vote_average",
+    "production_companies",
+]
+IMDB_NUMERIC_COLUMNS = ["budget", "revenue", "vote_average"]
+
+# Reading the compressed dump in big chunks keeps the decompressor busy instead of doing many small reads
+DUMP_READ_BUFFER_SIZE = 16 * 1024 * 1024
+_COMPRESSED_DUMP_SUFFIXES = [".gz", ".bz2"]
+
+# Parallel parsing splits the uncompressed dump in shards of about this many bytes, always cut on a <doc> tag
+WIKI_SHARD_SIZE = 64 * 1024 * 1024
+# Shards parsed ahead of the consumer by each worker, the parsed shards waiting to be consumed are bounded by this
+SHARDS_IN_FLIGHT_PER_WORKER = 2
+_DOC_START_TAG = b"<doc>"
+_DOC_END_TAG = b"</doc>"
+_SCAN_CHUNK_SIZE = 1024 * 1024
+
+# The wiki cache is an uncompressed Arrow IPC (feather v2) file, so it can be memory mapped.
+# The size and mtime of the dump it was built from are kept in the schema metadata to detect a stale cache.
+WIKI_CACHE_SCHEMA = pa.schema([("title", pa.string()), ("url", pa.string())])
+_CACHE_SOURCE_SIZE_KEY = b"source_size"
+_CACHE_SOURCE_MTIME_KEY = b"source_mtime_ns"
+
+
+def resolve_wiki_dump(xml_file: str = WIKI_XML_FILE) -> str:
+    """
+    Returns xml_file if it exists, otherwise the first compressed sibling (xml_file.gz, xml_file.bz2) found on disk.
+    This way the default path works whether the dump was unzipped or left as downloaded.
+    """
+    if os.path.exists(xml_file):
+        return xml_file
+    for suffix in _COMPRESSED_DUMP_SUFFIXES:
+        if os.path.exists(xml_file + suffix):
+            return xml_file + suffix
+    return xml_file
+
+
+def wiki_dump_compression(xml_file: str = WIKI_XML_FILE) -> Optional[str]:
+    """
+    Detects the compression of the dump from the magic bytes of the file, not the extension.
+
+    Returns: "gzip", "bz2" or None for plain xml
+    """
+    with open(resolve_wiki_dump(xml_file), "rb") as f:
+        magic = f.read(3)
+    if magic[:2] == b"\x1f\x8b":
+        return "gzip"
+    if magic == b"BZh":
+        return "bz2"
+    return None
+
+
+def open_wiki_dump(
+    xml_file: str = WIKI_XML_FILE, buffer_size: int = DUMP_READ_BUFFER_SIZE
+) -> BinaryIO:
+    """
+    Open the wiki dump for reading in binary mode, decompressing it on the fly if it is gzip or bz2 compressed.
+
+    Returns: a buffered binary file object, to be closed by the caller
+    """
+    compression = wiki_dump_compression(xml_file)
+    raw = open(resolve_wiki_dump(xml_file), "rb", buffering=buffer_size)
+    if compression == "gzip":
+        stream = gzip_module.GzipFile(fileobj=raw, mode="rb")
+    elif compression == "bz2":
+        stream = bz2.BZ2File(raw, mode="rb")
+    else:
+        return raw
+    return io.BufferedReader(stream, buffer_size=buffer_size)
+
+
+def iter_wiki_xml(
+    xml_file: str = WIKI_XML_FILE,
+    batch_size: int = WIKI_BATCH_SIZE,
+) -> Iterator[pd.DataFrame]:
+    """
+    Stream the wiki abstract dump and yield dataframes of at most batch_size rows with the raw title and url.
+
+    The <doc> elements are parsed one at a time and cleared as soon as their title and url are read,
+    so the memory used stays flat no matter how big the dump is.
+    The dump can be plain xml or the .gz/.bz2 file as downloaded, see open_wiki_dump.
+    """
+    with open_wiki_dump(xml_file) as f:
+        yield from _iterparse_wiki(f, batch_size)
+
+
+def _iterparse_wiki(f: BinaryIO, batch_size: int) -> Iterator[pd.DataFrame]:
+    """
+    Parse the <doc> elements of an open xml file object and yield dataframes of at most batch_size rows.
+    """
+    records = []
+    context = etree.iterparse(f, events=("end",), tag="doc")
+    for _, elem in context:
+        # Empty elements are stored as missing values, the same way read_csv would read them
+        records.append([elem.findtext(col) or None for col in WIKI_COLUMNS])
+        # Free the processed element and the already processed siblings kept alive by the root element
+        elem.clear()
+        while elem.getprevious() is not None:
+            del elem.getparent()[0]
+        if len(records) >= batch_size:
+            yield pd.DataFrame(records, columns=WIKI_COLUMNS)
+            records = []
+    del context
+    if records:
+        yield pd.DataFrame(records, columns=WIKI_COLUMNS)
+
+
+def _find_next_doc_offset(f: BinaryIO, position: int) -> Optional[int]:
+    """
+    Returns the offset of the first <doc> tag at or after position, None if there is none.
+    """
+    f.seek(position)
+    # Keep the end of the previous chunk in case the tag is split between 2 chunks
+    overlap = len(_DOC_START_TAG) - 1
+    buffer = b""
+    buffer_offset = position
+    while True:
+        chunk = f.read(_SCAN_CHUNK_SIZE)
+        if not chunk:
+            return None
+        buffer = buffer[-overlap:] + chunk if buffer else chunk
+        index = buffer.find(_DOC_START_TAG)
+        if index != -1:
+            return buffer_offset + index
+        buffer_offset += len(buffer) - overlap
+
+
+def _find_last_doc_end(f: BinaryIO, size: int) -> Optional[int]:
+    """
+    Returns the offset right after the last </doc> tag of the file, None if there is none.
+    """
+    end = size
+    while end > 0:
+        start = max(0, end - _SCAN_CHUNK_SIZE)
+        f.seek(start)
+        # Read a bit past the chunk in case the tag is split between 2 chunks
+        buffer = f.read(end - start + len(_DOC_END_TAG) - 1)
+        index = buffer.rfind(_DOC_END_TAG)
+        if index != -1:
+            return start + index + len(_DOC_END_TAG)
+        end = start
+    return None
+
+
+def split_wiki_dump(
+    xml_file: str = WIKI_XML_FILE, shard_size: int = WIKI_SHARD_SIZE
+) -> List[Tuple[int, int]]:
+    """
+    Splits the uncompressed dump in byte ranges of about shard_size bytes.
+    Every range starts on a <doc> tag and ends right before the next one (the last one after the last </doc>),
+    so each of them can be parsed on its own and the ranges cover all the documents in order.
+
+    Returns: list of (start, end) offsets
+    """
+    size = os.path.getsize(xml_file)
+    with open(xml_file, "rb") as f:
+        first_doc = _find_next_doc_offset(f, 0)
+        docs_end = _find_last_doc_end(f, size)
+        if first_doc is None or docs_end is None:
+            return []
+        boundaries = [first_doc]
+        while boundaries[-1] + shard_size < docs_end:
+            offset = _find_next_doc_offset(f, boundaries[-1] + shard_size)
+            if offset is None or offset >= docs_end:
+                break
+            boundaries.append(offset)
+        boundaries.append(docs_end)
+    return list(zip(boundaries[:-1], boundaries[1:]))
+
+
+def _parse_wiki_shard(
+    xml_file: str,
+    start: int,
+    end: int,
+    titles: Optional[pd.Index] = None,
+    title_keys: bool = False,
+    strip_disambiguator: bool = False,
+) -> pd.DataFrame:
+    """
+    Parse the <doc> elements between the start and end offsets of the dump, runs in a worker process.
+    Only the rows whose title is in titles are returned, when it is given, see _filter_wiki_titles.
+
+    Returns: the dataframe with the same columns and title adjustment as read_wiki
+    """
+    with open(xml_file, "rb") as f:
+        f.seek(start)
+        content = f.read(end - start)
+    # The shard is just a list of <doc> elements, so it needs a root element to be a valid xml document
+    shard = io.BytesIO(b"<feed>" + content + b"</feed>")
+    del content
+    frames = list(_iterparse_wiki(shard, batch_size=WIKI_BATCH_SIZE))
+    if not frames:
+        return pd.DataFrame(columns=WIKI_COLUMNS)
+    df = _strip_wiki_title_prefix(pd.concat(frames, ignore_index=True))
+    return _filter_wiki_titles(df, titles, title_keys, strip_disambiguator)
+
+
+def iter_wiki_xml_sharded(
+    xml_file: str = WIKI_XML_FILE,
+    workers: Optional[int] = None,
+    shard_size: int = WIKI_SHARD_SIZE,
+    titles: Optional[Iterable[str]] = None,
+    title_keys: bool = False,
+    strip_disambiguator: bool = False,
+) -> Iterator[pd.DataFrame]:
+    """
+    Parse the uncompressed dump in parallel, each shard (see split_wiki_dump) in its own process.
+    The titles filter (see read_wiki_batches) runs in the workers, so only the kept rows are sent back.
+    At most SHARDS_IN_FLIGHT_PER_WORKER shards per worker are submitted ahead of the consumer, so a slow consumer
+    doesn't pile up the parsed shards in memory.
+
+    param: workers: number of processes, the number of cpus when None
+    Returns: an iterator of dataframes, one per shard, in the order of the dump. Concatenated they are identical
+             to the output of read_wiki_batches.
+    """
+    workers = workers or os.cpu_count()
+    shards = split_wiki_dump(xml_file, shard_size)
+    titles = _titles_index(titles)
+    in_flight = deque()
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        try:
+            for start, end in shards:
+                if len(in_flight) >= workers * SHARDS_IN_FLIGHT_PER_WORKER:
+                    yield in_flight.popleft().result()
+                in_flight.append(
+                    executor.submit(
+                        _parse_wiki_shard,
+                        xml_file,
+                        start,
+                        end,
+                        titles,
+                        title_keys,
+                        strip_disambiguator,
+                    )
+                )
+            while in_flight:
+                yield in_flight.popleft().result()
+        finally:
+            # A consumer stopping early doesn't wait for the shards it will never read
+            for future in in_flight:
+                future.cancel()
+
+
+def _strip_wiki_title_prefix(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Remove the "Wikipedia: " prefix from the titles and keep only the columns required by the exercise.
+    """
+    df["title"] = strip_title_prefix(df["title"])
+    return df[WIKI_COLUMNS]
+
+
+def _titles_index(titles: Optional[Iterable[str]]) -> Optional[pd.Index]:
+    """
+    Returns the titles as a pandas Index, which keeps a hash table of its values for the isin lookups.
+    """
+    if titles is None or isinstance(titles, pd.Index):
+        return titles
+    return pd.Index(pd.Series(list(titles), dtype="object").dropna().unique())
+
+
+def _filter_wiki_titles(
+    df: pd.DataFrame,
+    titles: Optional[pd.Index],
+    title_keys: bool = False,
+    strip_disambiguator: bool = False,
+) -> pd.DataFrame:
+    """
+    Keeps only the rows of df whose adjusted title is in titles, all of them when titles is None.
+
+    param: title_keys: titles are title keys (see title_key), the rows are kept on the key of their title,
+                       computed with strip_disambiguator
+    """
+    if titles is None:
+        return df
+    if title_keys:
+        return df[title_key(df["title"], strip_disambiguator).isin(titles)]
+    return df[df["title"].isin(titles)]
+
+
+def _arrow_titles_mask(
+    column: pa.ChunkedArray,
+    titles: pd.Index,
+    title_keys: bool = False,
+    strip_disambiguator: bool = False,
+) -> pa.ChunkedArray:
+    """
+    Same as _filter_wiki_titles on an arrow column of titles: for each row whether its title (or its key) is in
+    titles, the keys are computed chunk by chunk.
+    """
+    if title_keys:
+        column = pa.chunked_array(
+            [title_key_array(chunk, strip_disambiguator) for chunk in column.chunks],
+            type=pa.string(),
+        )
+    value_set = pa.array(titles.to_numpy(), type=pa.string())
+    return pc.fill_null(pc.is_in(column, value_set=value_set), False)
+
+
+def read_wiki_batches(
+    xml_file: str = WIKI_XML_FILE,
+    batch_size: int = WIKI_BATCH_SIZE,
+    workers: int = 1,
+    titles: Optional[Iterable[str]] = None,
+    title_keys: bool = False,
+    strip_disambiguator: bool = False,
+) -> Iterator[pd.DataFrame]:
+    """
+    Stream the wiki abstract dump straight from the xml, without the csv pre-pass.
+
+    param: workers: parse the dump in this many processes (see iter_wiki_xml_sharded). A compressed dump can't be
+                    split in byte ranges, so it is always parsed in a single process.
+    param: titles: when given, only the rows whose (adjusted) title is in titles are kept, as they are parsed.
+                   Used to push the join with the imdb titles down to the reader, see imdb_candidate_titles.
+    param: title_keys: titles are title keys, each batch is filtered on the keys of its titles computed with
+                       strip_disambiguator (see title_key), so the join on the keys is pushed down as well
+
+    Returns: an iterator of dataframes with the same columns and title adjustment as read_wiki
+    """
+    titles = _titles_index(titles)
+    if workers > 1 and wiki_dump_compression(xml_file) is None:
+        yield from iter_wiki_xml_sharded(
+            resolve_wiki_dump(xml_file),
+            workers,
+            titles=titles,
+            title_keys=title_keys,
+            strip_disambiguator=strip_disambiguator,
+        )
+        return
+    for batch in iter_wiki_xml(xml_file, batch_size):
+        yield _filter_wiki_titles(
+            _strip_wiki_title_prefix(batch), titles, title_keys, strip_disambiguator
+        )
 
 
 def write_wiki_to_csv(
-    xml_file: str = "/workdir/data_wikipedia/enwiki-latest-abstract.xml",
-    csv_file: str = "/workdir/data_wikipedia/wiki_data.csv",
+    xml_file: str = WIKI_XML_FILE,
+    csv_file: str = WIKI_CSV_FILE,
+    batch_size: int = WIKI_BATCH_SIZE,
 ) -> None:
     """
     Reads the xml file and outputs it to csv such that it can be loaded much faster later.
+
+    The xml is streamed and written batch by batch, so the whole dump is never held in memory.
     """
-    wiki_df = pd.read_xml(xml_file)
-    wiki_df.to_csv(csv_file, index=False)
+    header = True
+    with open(csv_file, "w", newline="") as f:
+        for batch in iter_wiki_xml(xml_file, batch_size):
+            batch.to_csv(f, index=False, header=header)
+            header = False
+    if header:
+        # Empty dump, still write the header so read_wiki gets the expected columns
+        pd.DataFrame(columns=WIKI_COLUMNS).to_csv(csv_file, index=False)
 
 
-def read_wiki(csv_file: str = "/workdir/data_wikipedia/wiki_data.csv") -> pd.DataFrame:
+def _dump_fingerprint(xml_file: str) -> dict:
+    """
+    Returns the size and mtime of the (possibly compressed) dump as they are stored in the cache metadata.
+    """
+    stat = os.stat(resolve_wiki_dump(xml_file))
+    return {
+        _CACHE_SOURCE_SIZE_KEY: str(stat.st_size).encode(),
+        _CACHE_SOURCE_MTIME_KEY: str(stat.st_mtime_ns).encode(),
+    }
+
+
+def write_wiki_cache(
+    xml_file: str = WIKI_XML_FILE,
+    cache_file: str = WIKI_CACHE_FILE,
+    batch_size: int = WIKI_BATCH_SIZE,
+    workers: int = 1,
+) -> None:
     """
-    Read the wiki csv file into a dataframe.
+    Streams the xml dump into the columnar wiki cache, holding only the title (already adjusted) and url.
+    With workers > 1 an uncompressed dump is parsed in parallel shards, the resulting cache is the same.
+
+    The file is written to a temporary path and renamed at the end, so a crashed run never leaves a partial cache.
+    """
+    schema = WIKI_CACHE_SCHEMA.with_metadata(_dump_fingerprint(xml_file))
+    tmp_file = cache_file + ".tmp"
+    with pa.OSFile(tmp_file, "wb") as sink:
+        with pa.ipc.new_file(sink, schema) as writer:
+            for batch in read_wiki_batches(xml_file, batch_size, workers):
+                writer.write_table(
+                    pa.Table.from_pandas(batch, schema=schema, preserve_index=False)
+                )
+    os.replace(tmp_file, cache_file)
+
+
+def wiki_cache_is_fresh(
+    xml_file: str = WIKI_XML_FILE, cache_file: str = WIKI_CACHE_FILE
+) -> bool:
+    """
+    Checks the cache exists and was built from a dump with the same size and mtime as the one on disk.
+    When the dump itself is not on disk there is nothing to compare against and an existing cache is trusted.
+    """
+    if not os.path.exists(cache_file):
+        return False
+    if not os.path.exists(resolve_wiki_dump(xml_file)):
+        return True
+    with pa.memory_map(cache_file) as source:
+        metadata = pa.ipc.open_file(source).schema.metadata or {}
+    fingerprint = _dump_fingerprint(xml_file)
+    return all(metadata.get(key) == value for key, value in fingerprint.items())
+
+
+def read_wiki(
+    wiki_file: str = WIKI_CACHE_FILE,
+    batches: Optional[Iterable[pd.DataFrame]] = None,
+    memory_map: bool = False,
+    xml_file: str = WIKI_XML_FILE,
+    workers: int = 1,
+    titles: Optional[Iterable[str]] = None,
+    title_keys: bool = False,
+    strip_disambiguator: bool = False,
+) -> pd.DataFrame:
+    """
+    Read the wiki dataset into a dataframe.
+
+    By default it reads the columnar cache, (re)building it from xml_file first when it is missing or stale.
+    A path ending in .csv is read as a csv created by write_wiki_to_csv instead.
+
+    param: wiki_file: path to the columnar cache or to a csv file
+    param: batches: optional iterable of dataframes (see read_wiki_batches) consumed instead of the file
+    param: memory_map: memory map the cache instead of reading it in memory
+    param: xml_file: the dump the cache is built from and checked against
+    param: workers: number of processes used to parse the dump when the cache is (re)built
+    param: titles: when given, only the rows whose title is in titles are returned. On the cache the filter runs
+                   on the arrow data, so the other rows are never turned into python objects.
+    param: title_keys: titles are title keys, the rows are kept on the keys of their titles computed with
+                       strip_disambiguator, on the arrow data as well (see read_wiki_batches)
 
     Returns:
             the dataframe with the title adjusted by removing
             part of the string and just a subset of columns required by the exercise
     """
-    df = pd.read_csv(csv_file)
-    df["title"].replace(
-        to_replace="^Wikipedia: (.*)$", value=r"\1", regex=True, inplace=True
-    )
-    df = df[["title", "url"]]
-    return df
+    if batches is not None:
+        frames = list(batches)
+        if not frames:
+            return pd.DataFrame(columns=WIKI_COLUMNS)
+        df = pd.concat(frames, ignore_index=True)[WIKI_COLUMNS]
+        return _filter_wiki_titles(
+            df, _titles_index(titles), title_keys, strip_disambiguator
+        )
+
+    if wiki_file.endswith(".csv"):
+        df = _strip_wiki_title_prefix(pd.read_csv(wiki_file))
+        return _filter_wiki_titles(
+            df, _titles_index(titles), title_keys, strip_disambiguator
+        )
+
+    if not wiki_cache_is_fresh(xml_file, wiki_file):
+        write_wiki_cache(xml_file, wiki_file, workers=workers)
+    table = feather.read_table(wiki_file, memory_map=memory_map)
+    if titles is not None:
+        table = table.filter(
+            _arrow_titles_mask(
+                table["title"],
+                _titles_index(titles),
+                title_keys,
+                strip_disambiguator,
+            )
+        )
+    return table.to_pandas()[WIKI_COLUMNS]
+
+
+def read_wiki_arrow(
+    wiki_file: str = WIKI_CACHE_FILE,
+    batches: Optional[Iterable[pd.DataFrame]] = None,
+    xml_file: str = WIKI_XML_FILE,
+    workers: int = 1,
+    titles: Optional[Iterable[str]] = None,
+    title_keys: bool = False,
+    strip_disambiguator: bool = False,
+) -> ArrowFrame:
+    """
+    Same as read_wiki, but the wiki dataset stays in arrow: the columnar cache is memory mapped and returned as an
+    ArrowFrame, none of its strings is copied nor turned into a python object.
+
+    param: batches: optional iterable of dataframes (see read_wiki_batches) consumed instead of the cache, each of
+                    them is converted to arrow as it comes
+    param: titles: when given, only the rows whose title (or its key, with title_keys) is in titles are selected,
+                   see ArrowFrame.filter
+    """
+    if batches is not None:
+        tables = [
+            pa.Table.from_pandas(
+                batch[WIKI_COLUMNS], schema=WIKI_CACHE_SCHEMA, preserve_index=False
+            )
+            for batch in batches
+        ]
+        frame = ArrowFrame(
+            pa.concat_tables(tables) if tables else WIKI_CACHE_SCHEMA.empty_table()
+        )
+    else:
+        if not wiki_cache_is_fresh(xml_file, wiki_file):
+            write_wiki_cache(xml_file, wiki_file, workers=workers)
+        frame = ArrowFrame(
+            feather.read_table(wiki_file, memory_map=True).select(WIKI_COLUMNS)
+        )
+    if titles is not None:
+        mask = _arrow_titles_mask(
+            frame.column("title"),
+            _titles_index(titles),
+            title_keys,
+            strip_disambiguator,
+        )
+        frame = frame.filter(arrow_to_numpy(mask))
+    return frame
+
+
+def iter_wiki_cache(
+    wiki_file: str = WIKI_CACHE_FILE,
+    batch_size: int = WIKI_BATCH_SIZE,
+    xml_file: str = WIKI_XML_FILE,
+    workers: int = 1,
+    titles: Optional[Iterable[str]] = None,
+    title_keys: bool = False,
+    strip_disambiguator: bool = False,
+) -> Iterator[pd.DataFrame]:
+    """
+    Same as read_wiki on the columnar cache, but yields dataframes of at most batch_size rows instead of reading
+    the whole cache. The cache is memory mapped, so only the current batch is turned into python objects.
+    """
+    if not wiki_cache_is_fresh(xml_file, wiki_file):
+        write_wiki_cache(xml_file, wiki_file, workers=workers)
+    titles = _titles_index(titles)
+    with pa.memory_map(wiki_file) as source:
+        reader = pa.ipc.open_file(source)
+        for i in range(reader.num_record_batches):
+            record_batch = reader.get_batch(i)
+            for offset in range(0, record_batch.num_rows, batch_size):
+                batch = record_batch.slice(offset, batch_size).to_pandas()
+                yield _filter_wiki_titles(
+                    batch[WIKI_COLUMNS], titles, title_keys, strip_disambiguator
+                )
 
 
 def read_imdb_movies_metadata(
-    csv_file: str = "/workdir/data_imdb/movies_metadata.csv",
-) -> None:
+    csv_file: str = IMDB_CSV_FILE,
+    engine: str = "c",
+) -> pd.DataFrame:
     """
     Read the imdb csv file into a dataframe.
 
+    Only the IMDB_COLUMNS are parsed, with the dtypes declared up front: every column is read as a string, as a
+    few malformed rows hold strings in the numeric ones, so the parsing never depends on which rows are in the
+    file. The numeric columns are coerced to float after parsing, with a vectorised pd.to_numeric, the invalid
+    values become nan. The other columns of the file are never materialised.
+
+    param: engine: "c" for the pandas parser, or "pyarrow" for the multithreaded arrow one. The arrow parser is
+                   called directly, as read_csv(engine="pyarrow") would still infer dates from the string columns.
+
     Returns: the dataframe with only a subset of columns
     """
-    df = pd.read_csv(csv_file, quotechar='"')
-    df = df[
-        [
-            "title",
-            "original_title",
-            "budget",
-            "revenue",
-            "release_date",
-            "vote_average",
-            "production_companies",
-        ]
-    ]
-    return df
+    if engine == "pyarrow":
+        table = pa_csv.read_csv(
+            csv_file,
+            convert_options=pa_csv.ConvertOptions(
+                include_columns=IMDB_COLUMNS,
+                column_types={col: pa.string() for col in IMDB_COLUMNS},
+                strings_can_be_null=True,
+            ),
+        )
+        df = table.to_pandas()
+    else:
+        df = pd.read_csv(
+            csv_file,
+            usecols=IMDB_COLUMNS,
+            dtype={col: str for col in IMDB_COLUMNS},
+            engine=engine,
+        )
+    for col in IMDB_NUMERIC_COLUMNS:
+        df[col] = pd.to_numeric(df[col], errors="coerce").astype("float64")
+    return df[IMDB_COLUMNS]
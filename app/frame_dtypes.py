@@ -0,0 +1,118 @@
+import ast
+from typing import Optional
+
+import numpy as np
+import pandas as pd
+
+DATE_COLUMNS = ["release_date"]
+# Object columns with fewer distinct values than this share of their rows are stored as categoricals
+CATEGORICAL_MAX_UNIQUE_RATIO = 0.5
+MEMORY_REPORT_FILE = "./logs_memory_report.csv"
+
+
+def _is_lossless(values: pd.Series, downcast: pd.Series) -> bool:
+    return bool(((downcast.astype(values.dtype) == values) | values.isna()).all())
+
+
+def _downcast_numeric(values: pd.Series) -> pd.Series:
+    """
+    The smallest numeric dtype holding exactly the same values: an integer type for floats without decimals nor
+    missing values (e.g. the budgets), float32 when it doesn't lose precision. Otherwise the values are unchanged.
+    """
+    if pd.api.types.is_float_dtype(values) and not values.isna().any():
+        finite = np.isfinite(values.to_numpy())
+        if finite.all() and (values == np.floor(values)).all():
+            values = values.astype(np.int64)
+    if pd.api.types.is_integer_dtype(values):
+        return pd.to_numeric(values, downcast="integer")
+    downcast = pd.to_numeric(values, downcast="float")
+    return downcast if _is_lossless(values, downcast) else values
+
+
+def optimise_dtypes(
+    df: pd.DataFrame,
+    date_columns: list = DATE_COLUMNS,
+    categorical_max_unique_ratio: float = CATEGORICAL_MAX_UNIQUE_RATIO,
+) -> pd.DataFrame:
+    """
+    Stores the dataframe with smaller dtypes, without changing any value:
+        - the numeric columns are downcast when the values fit exactly (see _downcast_numeric)
+        - the date columns are parsed once into datetime64, the invalid dates become NaT
+        - the repetitive string columns (e.g. production_companies) become categoricals, each distinct string is
+          stored once. They are kept as raw strings, see parse_production_companies to read them.
+
+    returns: a new dataframe, df is not modified
+    """
+    optimised = {}
+    for col in df.columns:
+        values = df[col]
+        if col in date_columns:
+            optimised[col] = pd.to_datetime(values, errors="coerce")
+        elif pd.api.types.is_bool_dtype(values):
+            optimised[col] = values
+        elif pd.api.types.is_numeric_dtype(values):
+            optimised[col] = _downcast_numeric(values)
+        elif values.dtype == object and len(values):
+            unique_ratio = values.nunique(dropna=False) / len(values)
+            if unique_ratio <= categorical_max_unique_ratio:
+                optimised[col] = values.astype("category")
+            else:
+                optimised[col] = values
+        else:
+            optimised[col] = values
+    return pd.DataFrame(optimised, index=df.index)
+
+
+def memory_report(
+    df_before: pd.DataFrame,
+    df_after: pd.DataFrame,
+    file_path: Optional[str] = MEMORY_REPORT_FILE,
+) -> pd.DataFrame:
+    """
+    Compares the memory used by each column (strings included) of the same dataframe before and after
+    optimise_dtypes, and writes it to file_path as csv when given.
+
+    returns: dataframe with one row per column and a total row: dtype and bytes before and after
+    """
+    report = pd.DataFrame(
+        {
+            "dtype_before": df_before.dtypes.astype(str),
+            "bytes_before": df_before.memory_usage(index=False, deep=True),
+            "dtype_after": df_after.dtypes.astype(str),
+            "bytes_after": df_after.memory_usage(index=False, deep=True),
+        }
+    )
+    report.loc["total"] = [
+        "",
+        report["bytes_before"].sum(),
+        "",
+        report["bytes_after"].sum(),
+    ]
+    if file_path is not None:
+        report.to_csv(file_path, index_label="column")
+    return report
+
+
+def _parse_companies(value) -> list:
+    """
+    The names in a production_companies value such as "[{'name': 'Pixar', 'id': 3}]", [] when it is invalid.
+    """
+    try:
+        return [company["name"] for company in ast.literal_eval(value)]
+    except (ValueError, SyntaxError, TypeError, KeyError):
+        return []
+
+
+def parse_production_companies(values: pd.Series) -> pd.Series:
+    """
+    Parses the production_companies column into lists of company names, only when they are needed: the pipeline
+    itself keeps the raw strings. On a categorical column each distinct value is parsed once.
+
+    returns: series of lists of names, with the index of values
+    """
+    if isinstance(values.dtype, pd.CategoricalDtype):
+        names = [_parse_companies(value) for value in values.cat.categories]
+        names.append([])
+        codes = values.cat.codes.to_numpy()
+        return pd.Series([names[code] for code in codes], index=values.index)
+    return values.map(_parse_companies)
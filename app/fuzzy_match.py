@@ -0,0 +1,266 @@
+import re
+from concurrent.futures import ProcessPoolExecutor
+from difflib import SequenceMatcher
+from typing import Optional, Union
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+
+from arrow_frames import ArrowFrame
+from instrumentation import stage
+from title_keys import Titles, title_key_array
+
+# Pairs scoring at least this (difflib ratio of the comparison keys, see comparison_key) are a match
+FUZZY_MIN_SCORE = 0.9
+# Each film is compared to the wiki titles sharing one of its BLOCKING_TOKENS rarest tokens (words)
+BLOCKING_TOKENS = 2
+# Tokens in more wiki titles than this ("the", "love") don't block anything, the films made only of them are skipped
+MAX_BLOCK_SIZE = 200
+# A wiki title disambiguated with a year ("Heat (1995 film)") can only match a film released that year, give or take
+YEAR_TOLERANCE = 1
+# Candidate pairs scored by each worker task
+SCORING_CHUNK_SIZE = 50_000
+WIKI_YEAR_PATTERN = r"\((\d{4}) (?:[^()]* )?film\)$"
+
+
+def comparison_key(titles: Titles, strip_disambiguator: bool = False) -> pa.Array:
+    """
+    The title_key of the titles without punctuation nor symbols: "Mr. Smith Goes to Washington!" and
+    "mr smith goes to washington" get the same comparison key. Computed in arrow, so the millions of wiki titles
+    never become python strings.
+
+    returns: arrow string array of the comparison keys, null for the titles without key
+    """
+    keys = title_key_array(titles, strip_disambiguator)
+    keys = pc.replace_substring_regex(keys, r"[\p{P}\p{S}]+", " ")
+    keys = pc.utf8_trim_whitespace(pc.replace_substring_regex(keys, r"\s\s+", " "))
+    return pc.if_else(pc.equal(keys, ""), pa.scalar(None, pa.string()), keys)
+
+
+def wiki_title_years(titles: pa.Array) -> np.ndarray:
+    """
+    The year of the "(1995 film)" like disambiguators, nan for the titles without one. The regex only runs on the
+    titles ending with "film)".
+    """
+    years = np.full(len(titles), np.nan)
+    disambiguated = np.flatnonzero(
+        pc.fill_null(pc.match_substring_regex(titles, r"film\)$"), False).to_numpy(
+            zero_copy_only=False
+        )
+    )
+    if len(disambiguated):
+        extracted = pd.Series(
+            titles.take(pa.array(disambiguated)).to_pandas()
+        ).str.extract(WIKI_YEAR_PATTERN)[0]
+        years[disambiguated] = pd.to_numeric(extracted).to_numpy(dtype=np.float64)
+    return years
+
+
+def _tokens(keys: pa.Array, token_set: Optional[pa.Array] = None) -> pd.DataFrame:
+    """
+    One row per (position of the key, token) of the space separated keys, without repeated tokens in a key.
+
+    param: token_set: only keep these tokens, filtered in arrow before any python string is created
+    """
+    split = pc.split_pattern(keys, " ")
+    rows = pc.list_parent_indices(split)
+    tokens = pc.list_flatten(split)
+    if token_set is not None:
+        kept = pc.is_in(tokens, value_set=token_set)
+        rows = pc.filter(rows, kept)
+        tokens = pc.filter(tokens, kept)
+    df_tokens = pd.DataFrame(
+        {
+            "row": rows.to_numpy(),
+            "token": tokens.to_numpy(zero_copy_only=False),
+        }
+    )
+    return df_tokens.drop_duplicates()
+
+
+def _score_pair(imdb_key: str, wiki_key: str) -> float:
+    # "Toy Story" and "Toy Story 2" are close but different films: the numbers must be the same
+    if re.findall(r"\d+", imdb_key) != re.findall(r"\d+", wiki_key):
+        return 0.0
+    return SequenceMatcher(None, imdb_key, wiki_key, autojunk=False).ratio()
+
+
+def _score_pairs(imdb_keys: list, wiki_keys: list) -> np.ndarray:
+    """
+    The score of each pair of keys, run in the worker processes.
+    """
+    return np.array(
+        [
+            _score_pair(imdb_key, wiki_key)
+            for imdb_key, wiki_key in zip(imdb_keys, wiki_keys)
+        ],
+        dtype=np.float64,
+    )
+
+
+def candidate_pairs(
+    imdb_keys: pa.Array,
+    imdb_years: np.ndarray,
+    wiki_keys: pa.Array,
+    wiki_years: np.ndarray,
+    min_score: float = FUZZY_MIN_SCORE,
+) -> pd.DataFrame:
+    """
+    The blocking of fuzzy_match_titles: the (imdb position, wiki position) pairs worth scoring.
+
+    A pair shares one of the BLOCKING_TOKENS rarest tokens of the imdb key, the tokens of more than MAX_BLOCK_SIZE
+    wiki keys are ignored. The pairs whose wiki title has a year more than YEAR_TOLERANCE away from the imdb release
+    year, and the pairs whose lengths are too different to ever reach min_score, are dropped.
+
+    returns: dataframe of the imdb and wiki positions of the pairs, with their keys and whether the years match
+    """
+    df_imdb_tokens = _tokens(imdb_keys)
+    token_set = pa.array(df_imdb_tokens["token"].unique(), type=pa.string())
+    df_wiki_tokens = _tokens(wiki_keys, token_set)
+    block_sizes = df_wiki_tokens["token"].value_counts()
+    block_sizes = block_sizes[block_sizes <= MAX_BLOCK_SIZE]
+
+    df_imdb_tokens = df_imdb_tokens.assign(
+        block_size=df_imdb_tokens["token"].map(block_sizes)
+    ).dropna(subset=["block_size"])
+    df_imdb_tokens = (
+        df_imdb_tokens.sort_values(["row", "block_size"], kind="stable")
+        .groupby("row")
+        .head(BLOCKING_TOKENS)
+    )
+    pairs = df_imdb_tokens[["row", "token"]].merge(
+        df_wiki_tokens, on="token", suffixes=("_imdb", "_wiki")
+    )
+    pairs = pairs[["row_imdb", "row_wiki"]].drop_duplicates()
+    imdb_rows = pairs["row_imdb"].to_numpy(dtype=np.int64)
+    wiki_rows = pairs["row_wiki"].to_numpy(dtype=np.int64)
+
+    year_gap = np.abs(imdb_years[imdb_rows] - wiki_years[wiki_rows])
+    imdb_pair_keys = imdb_keys.take(pa.array(imdb_rows))
+    wiki_pair_keys = wiki_keys.take(pa.array(wiki_rows))
+    # The ratio of difflib is at most 2 * min(len_a, len_b) / (len_a + len_b)
+    imdb_lengths = pc.utf8_length(imdb_pair_keys).to_numpy()
+    wiki_lengths = pc.utf8_length(wiki_pair_keys).to_numpy()
+    max_score = (
+        2 * np.minimum(imdb_lengths, wiki_lengths) / (imdb_lengths + wiki_lengths)
+    )
+    kept = ~(year_gap > YEAR_TOLERANCE) & (max_score >= min_score)
+    kept_positions = pa.array(np.flatnonzero(kept))
+    return pd.DataFrame(
+        {
+            "imdb": imdb_rows[kept],
+            "wiki": wiki_rows[kept],
+            "imdb_key": imdb_pair_keys.take(kept_positions).to_numpy(
+                zero_copy_only=False
+            ),
+            "wiki_key": wiki_pair_keys.take(kept_positions).to_numpy(
+                zero_copy_only=False
+            ),
+            "same_year": year_gap[kept] <= YEAR_TOLERANCE,
+        }
+    )
+
+
+def score_pairs(
+    imdb_keys: np.ndarray,
+    wiki_keys: np.ndarray,
+    workers: int = 1,
+    chunk_size: int = SCORING_CHUNK_SIZE,
+) -> np.ndarray:
+    """
+    The similarity (difflib ratio, from 0 to 1, 0 when the numbers in the keys differ) of each pair of keys.
+    With workers > 1 the pairs are scored chunk_size at a time in that many processes.
+    """
+    if workers <= 1 or len(imdb_keys) <= chunk_size:
+        return _score_pairs(list(imdb_keys), list(wiki_keys))
+    starts = range(0, len(imdb_keys), chunk_size)
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        scores = executor.map(
+            _score_pairs,
+            [list(imdb_keys[start : start + chunk_size]) for start in starts],
+            [list(wiki_keys[start : start + chunk_size]) for start in starts],
+        )
+        return np.concatenate(list(scores))
+
+
+def fuzzy_match_titles(
+    imdb_keys: pa.Array,
+    imdb_years: np.ndarray,
+    wiki_keys: pa.Array,
+    wiki_years: np.ndarray,
+    min_score: float = FUZZY_MIN_SCORE,
+    workers: int = 1,
+) -> np.ndarray:
+    """
+    Matches each imdb key to its most similar wiki key, among the blocked candidates (see candidate_pairs).
+
+    The best score wins, then a wiki title whose year matches the imdb one, then the last wiki row as in
+    merge_imdb_and_wiki.
+
+    param: imdb_keys, wiki_keys: comparison keys, see comparison_key
+    param: imdb_years, wiki_years: float arrays of the years, nan when unknown
+    param: min_score: lowest similarity accepted, from 0 to 1
+    param: workers: number of processes scoring the pairs
+    returns: for each imdb key the position of its wiki key, -1 when none scores min_score
+    """
+    pairs = candidate_pairs(imdb_keys, imdb_years, wiki_keys, wiki_years, min_score)
+    pairs["score"] = score_pairs(
+        pairs["imdb_key"].to_numpy(), pairs["wiki_key"].to_numpy(), workers
+    )
+    pairs = pairs[pairs["score"] >= min_score]
+    best = pairs.sort_values(["imdb", "score", "same_year", "wiki"]).drop_duplicates(
+        "imdb", keep="last"
+    )
+    positions = np.full(len(imdb_keys), -1)
+    positions[best["imdb"].to_numpy()] = best["wiki"].to_numpy()
+    return positions
+
+
+def fill_unmatched_urls(
+    df_joined: pd.DataFrame,
+    df_wiki: Union[pd.DataFrame, ArrowFrame],
+    min_score: float = FUZZY_MIN_SCORE,
+    workers: int = 1,
+) -> pd.DataFrame:
+    """
+    Second pass of merge_imdb_and_wiki: the films left without url are fuzzy matched (see fuzzy_match_titles) on
+    their original_title, then on their title, to the wiki titles without their "(1995 film)" disambiguators.
+
+    param: df_joined: the output of merge_imdb_and_wiki
+    param: df_wiki: the wiki dataset it was merged with, title and url, as a dataframe or an ArrowFrame
+    returns: df_joined with the url of the fuzzy matched films filled
+    """
+    unmatched = np.flatnonzero(df_joined["url"].isna().to_numpy())
+    with stage("fuzzy_match", rows_in=len(unmatched)) as record:
+        df_unmatched = df_joined.iloc[unmatched]
+        imdb_years = pd.to_datetime(
+            df_unmatched["release_date"], errors="coerce"
+        ).dt.year.to_numpy(dtype=np.float64)
+        if isinstance(df_wiki, ArrowFrame):
+            wiki_titles = df_wiki.selected_column("title")
+        else:
+            wiki_titles = pa.array(df_wiki["title"], type=pa.string(), from_pandas=True)
+        wiki_keys = comparison_key(wiki_titles, strip_disambiguator=True)
+        wiki_years = wiki_title_years(wiki_titles)
+        positions = np.full(len(unmatched), -1)
+        for col in ["original_title", "title"]:
+            todo = np.flatnonzero(positions == -1)
+            positions[todo] = fuzzy_match_titles(
+                comparison_key(df_unmatched[col].iloc[todo]),
+                imdb_years[todo],
+                wiki_keys,
+                wiki_years,
+                min_score,
+                workers,
+            )
+        matched = positions != -1
+        urls = df_joined["url"].to_numpy(dtype=object, copy=True)
+        if isinstance(df_wiki, ArrowFrame):
+            urls[unmatched[matched]] = df_wiki.to_pandas(positions[matched])["url"]
+        else:
+            urls[unmatched[matched]] = df_wiki["url"].to_numpy()[positions[matched]]
+        record.rows_out = int(matched.sum())
+    # The urls keep their dtype, arrow backed strings when the wiki side ran in arrow
+    return df_joined.assign(url=pd.array(urls, dtype=df_joined["url"].dtype))
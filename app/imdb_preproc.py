@@ -1,19 +1,3 @@
-import pandas as pd
-
-
-def imdb_set_datatypes(df: pd.DataFrame) -> pd.DataFrame:
-    """
-    Preproc: change data types
-
-    param: df: imdb dataset as a pd dataframe
-    returns: df: processed dataframe
-    """
-    df["revenue"] = pd.to_numeric(df["revenue"], errors="coerce")
-    df["budget"] = pd.to_numeric(df["budget"], errors="coerce")
-
-    return df
-
-
-imdb_preproc_list = [
-    imdb_set_datatypes,
-]
+# The preprocessing steps run on the imdb dataset before the cleaner, each takes and returns the dataframe. The numeric
+# columns are already coerced to float by read_imdb_movies_metadata.
+imdb_preproc_list = []
@@ -0,0 +1,272 @@
+import json
+import os
+import resource
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from typing import Callable, Dict, Iterator, Optional
+
+import pandas as pd
+from arrow_frames import ArrowFrame
+from psycopg2 import sql
+
+RUN_REPORT_FILE = "./logs_pipeline_run_report.json"
+PIPELINE_RUNS_SCHEMA = "truelayer_schema"
+PIPELINE_RUNS_TABLE = "pipeline_runs"
+# How often the resident memory is sampled while a run is active
+RSS_SAMPLING_INTERVAL = 0.01
+# Name of the thread sampling it, which the profiler leaves out
+RSS_SAMPLER_THREAD_NAME = "rss_sampler"
+
+_PAGE_SIZE = os.sysconf("SC_PAGE_SIZE") if hasattr(os, "sysconf") else 4096
+
+
+def current_rss_mb() -> float:
+    """
+    Resident memory of the process in MB, read from /proc on linux, the peak so far (ru_maxrss) elsewhere.
+    """
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * _PAGE_SIZE / 1024**2
+    except OSError:
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+class StageRecord:
+    def __init__(self, name: str, rows_in: Optional[int] = None):
+        """
+        Measurements of one execution of a stage, rows_out is set by the stage itself when it knows it.
+        """
+        self.name = name
+        self.rows_in = rows_in
+        self.rows_out = None
+        self.skipped = False
+        self.peak_rss_mb = current_rss_mb()
+        self._wall_start = time.perf_counter()
+        self._cpu_start = time.process_time()
+        self.wall_s = None
+        self.cpu_s = None
+
+    def finish(self) -> None:
+        self.wall_s = time.perf_counter() - self._wall_start
+        self.cpu_s = time.process_time() - self._cpu_start
+        self.peak_rss_mb = max(self.peak_rss_mb, current_rss_mb())
+
+
+class RunReport:
+    def __init__(self):
+        """
+        Collects the wall time, cpu time, rows in/out and peak resident memory of every stage of a run.
+        The executions of a stage with the same name (e.g. a cleaner rule over many batches) are aggregated:
+        times and rows are summed and the peak memory is the max.
+
+        Stages can run concurrently in several threads, each thread nests its own stages. The cpu time of a stage
+        is the one of the whole process while it ran, so it includes the stages running at the same time.
+        """
+        self.run_id = uuid.uuid4().hex
+        self.started_at = datetime.now(timezone.utc)
+        self._wall_start = time.perf_counter()
+        self._cpu_start = time.process_time()
+        self.stages = {}
+        self._lock = threading.Lock()
+        # Stack of the stages open in the current thread, the stack of every thread by thread id, and all the
+        # stages open in any thread
+        self._thread_records = threading.local()
+        self._thread_stacks = {}
+        self._open_records = set()
+        self._stop_sampling = threading.Event()
+        self._sampler = threading.Thread(
+            target=self._sample_rss, name=RSS_SAMPLER_THREAD_NAME, daemon=True
+        )
+        self._sampler.start()
+
+    def _sample_rss(self) -> None:
+        """
+        Background thread updating the peak memory of the stages running, so short lived peaks inside a stage
+        are seen and not just the memory at its start and end.
+        """
+        while not self._stop_sampling.wait(RSS_SAMPLING_INTERVAL):
+            rss_mb = current_rss_mb()
+            with self._lock:
+                open_records = list(self._open_records)
+            for record in open_records:
+                record.peak_rss_mb = max(record.peak_rss_mb, rss_mb)
+
+    @contextmanager
+    def stage(self, name: str, rows_in: Optional[int] = None) -> Iterator[StageRecord]:
+        """
+        Measures the code run inside the with block as the stage name. Nested stages are named parent/child.
+        """
+        if not hasattr(self._thread_records, "stack"):
+            self._thread_records.stack = []
+            with self._lock:
+                self._thread_stacks[threading.get_ident()] = self._thread_records.stack
+        stack = self._thread_records.stack
+        if stack:
+            name = f"{stack[-1].name}/{name}"
+        record = StageRecord(name, rows_in)
+        stack.append(record)
+        with self._lock:
+            self._open_records.add(record)
+        try:
+            yield record
+        finally:
+            record.finish()
+            stack.pop()
+            with self._lock:
+                self._open_records.discard(record)
+                self._add(record)
+
+    def open_stages(self) -> Dict[int, str]:
+        """
+        The innermost stage open in each thread, by thread id, as its full parent/child name.
+        """
+        with self._lock:
+            stacks = list(self._thread_stacks.items())
+        open_stages = {}
+        for thread_id, stack in stacks:
+            # Copied first, the thread may close its stage meanwhile
+            records = list(stack)
+            if records:
+                open_stages[thread_id] = records[-1].name
+        return open_stages
+
+    def _add(self, record: StageRecord) -> None:
+        stage = self.stages.setdefault(
+            record.name,
+            {
+                "calls": 0,
+                "wall_s": 0.0,
+                "cpu_s": 0.0,
+                "rows_in": None,
+                "rows_out": None,
+                "peak_rss_mb": 0.0,
+                "skipped": False,
+            },
+        )
+        stage["calls"] += 1
+        stage["wall_s"] += record.wall_s
+        stage["cpu_s"] += record.cpu_s
+        for rows in ["rows_in", "rows_out"]:
+            if getattr(record, rows) is not None:
+                stage[rows] = (stage[rows] or 0) + getattr(record, rows)
+        stage["peak_rss_mb"] = max(stage["peak_rss_mb"], record.peak_rss_mb)
+        stage["skipped"] = stage["skipped"] or record.skipped
+
+    def finish(self) -> dict:
+        """
+        Stops the memory sampling and returns the report as a dict.
+        """
+        self._stop_sampling.set()
+        self._sampler.join()
+        return self.to_dict()
+
+    def to_dict(self) -> dict:
+        return {
+            "run_id": self.run_id,
+            "started_at": self.started_at.isoformat(),
+            "wall_s": time.perf_counter() - self._wall_start,
+            "cpu_s": time.process_time() - self._cpu_start,
+            "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+            "stages": self.stages,
+        }
+
+    def write_json(self, file_path: str = RUN_REPORT_FILE) -> None:
+        with open(file_path, "w") as f:
+            json.dump(self.to_dict(), f, indent=2)
+
+    def write_to_db(
+        self,
+        engine,
+        schema: str = PIPELINE_RUNS_SCHEMA,
+        table_name: str = PIPELINE_RUNS_TABLE,
+    ) -> None:
+        """
+        Appends the report as a row of schema.table_name, created if needed, to track the runs over time.
+        """
+        report = self.to_dict()
+        table = sql.Identifier(schema, table_name)
+        connection = engine.raw_connection()
+        try:
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    sql.SQL(
+                        "CREATE TABLE IF NOT EXISTS {} (run_id text PRIMARY KEY, started_at timestamptz, "
+                        "wall_s double precision, cpu_s double precision, peak_rss_mb double precision, "
+                        "report jsonb)"
+                    ).format(table)
+                )
+                cursor.execute(
+                    sql.SQL(
+                        "INSERT INTO {} (run_id, started_at, wall_s, cpu_s, peak_rss_mb, report) "
+                        "VALUES (%s, %s, %s, %s, %s, %s)"
+                    ).format(table),
+                    (
+                        report["run_id"],
+                        self.started_at,
+                        report["wall_s"],
+                        report["cpu_s"],
+                        report["peak_rss_mb"],
+                        json.dumps(report),
+                    ),
+                )
+            connection.commit()
+        except Exception:
+            connection.rollback()
+            raise
+        finally:
+            connection.close()
+
+
+# The report of the run in progress. The stages are measured only while a run is active, otherwise stage and
+# measure cost next to nothing, so the pipeline functions can be instrumented without changing their signature.
+_active_report = None
+
+
+def start_run() -> RunReport:
+    global _active_report
+    _active_report = RunReport()
+    return _active_report
+
+
+def finish_run() -> Optional[dict]:
+    global _active_report
+    report, _active_report = _active_report, None
+    return report.finish() if report is not None else None
+
+
+def active_stages() -> Dict[int, str]:
+    """
+    The innermost stage open in each thread of the active run, see RunReport.open_stages. Empty without a run.
+    """
+    report = _active_report
+    return report.open_stages() if report is not None else {}
+
+
+@contextmanager
+def stage(name: str, rows_in: Optional[int] = None) -> Iterator[StageRecord]:
+    """
+    Measures the with block as a stage of the active run, see RunReport.stage. Without an active run it only
+    yields a record that is not kept.
+    """
+    if _active_report is None:
+        yield StageRecord(name, rows_in)
+        return
+    with _active_report.stage(name, rows_in) as record:
+        yield record
+
+
+def measure(name: str, func: Callable, *args, **kwargs):
+    """
+    Runs func(*args, **kwargs) as a stage of the active run. The rows in are the rows of the first dataframe
+    argument and the rows out the rows of the dataframe returned, if any.
+    """
+    frame_types = (pd.DataFrame, ArrowFrame)
+    rows_in = next((len(arg) for arg in args if isinstance(arg, frame_types)), None)
+    with stage(name, rows_in) as record:
+        result = func(*args, **kwargs)
+        if isinstance(result, frame_types):
+            record.rows_out = len(result)
+    return result
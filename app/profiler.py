@@ -0,0 +1,297 @@
+import os
+import sys
+import threading
+import time
+import tracemalloc
+import zlib
+from collections import Counter
+from contextlib import contextmanager
+from datetime import datetime
+from html import escape
+from typing import Dict, Iterator, List, Optional
+
+import pyarrow as pa
+from instrumentation import RSS_SAMPLER_THREAD_NAME, active_stages
+
+# "cpu" samples the call stacks of the running threads, "alloc" traces the allocations and keeps the ones alive at
+# the peak of the traced memory
+PROFILE_MODES = ["cpu", "alloc"]
+# The profiles are written next to the cleaner logs as {prefix}_{start time}_{mode}.collapsed and .svg
+PROFILE_FILE_PREFIX = "./logs_profile"
+# Time between two samples of the call stacks, or two checks of the traced memory
+PROFILE_SAMPLING_INTERVAL = 0.005
+# Frames kept in the traceback of each allocation
+ALLOC_TRACE_FRAMES = 32
+# A new snapshot of the allocations is taken when the traced memory grew by this much since the last one, from
+# ALLOC_SNAPSHOT_MIN_BYTES on. Each snapshot copies every trace (about 0.5s per million objects), so they stay few.
+ALLOC_SNAPSHOT_GROWTH = 0.2
+ALLOC_SNAPSHOT_MIN_BYTES = 16 * 1024**2
+
+FLAMEGRAPH_WIDTH = 1200
+FLAMEGRAPH_FRAME_HEIGHT = 16
+# Frames narrower than this (in pixels) are not drawn
+FLAMEGRAPH_MIN_WIDTH = 0.5
+_FLAMEGRAPH_CHAR_WIDTH = 7
+
+# A thread whose innermost python frame is in one of these files is waiting, e.g. an idle pool worker
+_IDLE_FILES = ("threading.py", "queue.py", "selectors.py")
+
+
+def _is_selected(stage_name: Optional[str], stages: Optional[List[str]]) -> bool:
+    """
+    Whether stage_name (a full parent/child name) is in one of the selected stages, "wiki" selects "wiki/read" and
+    "merge" selects "result/merge". Everything is selected when stages is None.
+    """
+    if stages is None:
+        return True
+    if stage_name is None:
+        return False
+    return any(f"/{selected}/" in f"/{stage_name}/" for selected in stages)
+
+
+class SamplingProfiler:
+    def __init__(
+        self,
+        mode: str = "cpu",
+        stages: Optional[List[str]] = None,
+        interval: float = PROFILE_SAMPLING_INTERVAL,
+    ):
+        """
+        Profiles the process from a background thread, without changing the profiled code.
+
+        In "cpu" mode the call stack of every thread is sampled each interval (sys._current_frames), a sample is
+        weighted by the intervals elapsed since the previous one, as the sampling thread can be delayed by a call
+        holding the GIL. Each stack starts with the stage open in its thread (see instrumentation.stage), or the
+        name of the thread outside the stages. The idle threads, such as the workers of an empty pool, are skipped.
+
+        In "alloc" mode the allocations are traced with tracemalloc, and a snapshot of the allocations alive is
+        taken each time the traced memory grows past the last snapshot by ALLOC_SNAPSHOT_GROWTH. The last snapshot
+        is the peak: its allocations are reported by traceback, in KB, next to the bytes held by the arrow memory
+        pool, which tracemalloc doesn't see. Tracing slows the run down several times, it is meant to find where
+        the peak memory comes from rather than to time the run.
+
+        param: mode: one of PROFILE_MODES
+        param: stages: only profile these stages (the names of the run report, see _is_selected), None profiles
+                       the whole process. The stages are only known inside run_process, a run without them (e.g.
+                       run_create_wiki_csv.py) is profiled as a whole.
+        """
+        if mode not in PROFILE_MODES:
+            raise ValueError(f"mode must be one of {PROFILE_MODES}.")
+        self.mode = mode
+        self.stages = stages
+        self.interval = interval
+        self.counts = Counter()
+        self.samples = 0
+        self._labels = {}
+        self._snapshot = None
+        self._snapshot_bytes = 0
+        self._snapshot_stages = None
+        self._snapshot_arrow_bytes = 0
+        self._started_tracemalloc = False
+        self._stop_sampling = threading.Event()
+        self._sampler = threading.Thread(
+            target=self._sample, name="profile_sampler", daemon=True
+        )
+
+    def start(self) -> None:
+        if self.mode == "alloc" and not tracemalloc.is_tracing():
+            tracemalloc.start(ALLOC_TRACE_FRAMES)
+            self._started_tracemalloc = True
+        self._sampler.start()
+
+    def stop(self) -> None:
+        self._stop_sampling.set()
+        self._sampler.join()
+        if self._started_tracemalloc:
+            tracemalloc.stop()
+
+    def _sample(self) -> None:
+        last = time.perf_counter()
+        while not self._stop_sampling.wait(self.interval):
+            now = time.perf_counter()
+            weight = max(1, round((now - last) / self.interval))
+            last = now
+            if self.mode == "cpu":
+                self._sample_stacks(weight)
+            else:
+                self._sample_allocations()
+
+    def _label(self, code) -> str:
+        label = self._labels.get(code)
+        if label is None:
+            file_name = os.path.basename(code.co_filename)
+            label = f"{code.co_name} ({file_name}:{code.co_firstlineno})"
+            label = label.replace(";", ":")
+            self._labels[code] = label
+        return label
+
+    def _sample_stacks(self, weight: int) -> None:
+        stages = active_stages()
+        thread_names = {thread.ident: thread.name for thread in threading.enumerate()}
+        main_id = threading.main_thread().ident
+        for thread_id, frame in sys._current_frames().items():
+            # The sampling threads only measure the run
+            if thread_id == self._sampler.ident:
+                continue
+            if thread_names.get(thread_id) == RSS_SAMPLER_THREAD_NAME:
+                continue
+            stage_name = stages.get(thread_id)
+            if not _is_selected(stage_name, self.stages):
+                continue
+            code = frame.f_code
+            idle = code.co_filename.endswith(_IDLE_FILES) or (
+                code.co_name == "_worker"
+                and code.co_filename.endswith(os.path.join("futures", "thread.py"))
+            )
+            if idle and stage_name is None and thread_id != main_id:
+                continue
+            labels = []
+            while frame is not None:
+                labels.append(self._label(frame.f_code))
+                frame = frame.f_back
+            root = f"[{stage_name or thread_names.get(thread_id, thread_id)}]"
+            labels.append(root)
+            self.counts[";".join(reversed(labels))] += weight
+            self.samples += 1
+
+    def _sample_allocations(self) -> None:
+        current, _ = tracemalloc.get_traced_memory()
+        threshold = max(
+            self._snapshot_bytes * (1 + ALLOC_SNAPSHOT_GROWTH), ALLOC_SNAPSHOT_MIN_BYTES
+        )
+        if current <= threshold:
+            return
+        stages = sorted(set(active_stages().values()))
+        if self.stages is not None and not any(
+            _is_selected(stage_name, self.stages) for stage_name in stages
+        ):
+            return
+        # The traces are only grouped by traceback once the run is over, see collapsed_stacks
+        self._snapshot = tracemalloc.take_snapshot()
+        self._snapshot_bytes = current
+        self._snapshot_stages = stages
+        self._snapshot_arrow_bytes = pa.total_allocated_bytes()
+        self.samples += 1
+
+    def collapsed_stacks(self) -> Dict[str, int]:
+        """
+        The profile as collapsed stacks: "root;caller;callee" -> samples in "cpu" mode, KB allocated at the peak
+        in "alloc" mode.
+        """
+        if self.mode == "cpu":
+            return dict(self.counts)
+        if self._snapshot is None:
+            return {}
+        root = f"[peak {self._snapshot_bytes / 1024 ** 2:.0f} MB in {'+'.join(self._snapshot_stages) or 'run'}]"
+        stacks = Counter()
+        for statistic in self._snapshot.statistics("traceback"):
+            labels = [
+                f"{os.path.basename(frame.filename)}:{frame.lineno}".replace(";", ":")
+                for frame in statistic.traceback
+                if frame.lineno
+            ]
+            # e.g. the python strings created by the conversion threads of arrow in to_pandas
+            labels = labels or ["[no python frame]"]
+            stacks[";".join([root] + labels)] += statistic.size // 1024
+        stacks[f"{root};[arrow memory pool]"] += self._snapshot_arrow_bytes // 1024
+        return {stack: size for stack, size in stacks.items() if size > 0}
+
+    def write(self, file_prefix: str) -> List[str]:
+        """
+        Writes the collapsed stacks (the input format of flamegraph.pl and speedscope) to {file_prefix}.collapsed
+        and their flamegraph to {file_prefix}.svg.
+
+        returns: the paths of the files written
+        """
+        stacks = self.collapsed_stacks()
+        collapsed_file = f"{file_prefix}.collapsed"
+        with open(collapsed_file, "w") as f:
+            for stack, count in sorted(stacks.items()):
+                f.write(f"{stack} {count}\n")
+        svg_file = f"{file_prefix}.svg"
+        unit = "samples" if self.mode == "cpu" else "KB"
+        write_flamegraph(
+            stacks, svg_file, f"{self.mode} profile, {self.samples} samples", unit
+        )
+        return [collapsed_file, svg_file]
+
+
+def _frame_color(name: str) -> str:
+    # The same frame gets the same warm color in every flamegraph
+    value = zlib.crc32(name.encode())
+    return f"rgb({205 + value % 50},{80 + (value >> 8) % 130},{(value >> 16) % 55})"
+
+
+def write_flamegraph(
+    stacks: Dict[str, int], file_path: str, title: str = "", unit: str = "samples"
+) -> None:
+    """
+    Renders collapsed stacks as a flamegraph svg: one box per frame, as wide as the samples (or KB) of its stacks,
+    on top of its caller. The full name and share of each frame are shown when hovering it.
+    """
+    tree = {"children": {}, "count": 0}
+    for stack, count in stacks.items():
+        node = tree
+        node["count"] += count
+        for name in stack.split(";"):
+            node = node["children"].setdefault(name, {"children": {}, "count": 0})
+            node["count"] += count
+
+    def depth(node: dict) -> int:
+        return 1 + max((depth(child) for child in node["children"].values()), default=0)
+
+    total = max(tree["count"], 1)
+    scale = FLAMEGRAPH_WIDTH / total
+    height = (depth(tree) + 1) * FLAMEGRAPH_FRAME_HEIGHT
+    boxes = []
+
+    def draw(node: dict, x: float, level: int) -> None:
+        for name, child in node["children"].items():
+            width = child["count"] * scale
+            if width >= FLAMEGRAPH_MIN_WIDTH:
+                y = height - (level + 1) * FLAMEGRAPH_FRAME_HEIGHT
+                text = name[: int(width / _FLAMEGRAPH_CHAR_WIDTH)]
+                if len(text) < len(name):
+                    text = text[:-2] + ".." if len(text) > 2 else ""
+                boxes.append(
+                    f'<g><title>{escape(name)} ({child["count"]} {unit}, {100 * child["count"] / total:.2f}%)'
+                    f'</title><rect x="{x:.2f}" y="{y}" width="{width:.2f}" '
+                    f'height="{FLAMEGRAPH_FRAME_HEIGHT - 1}" fill="{_frame_color(name)}"/>'
+                    f'<text x="{x + 2:.2f}" y="{y + FLAMEGRAPH_FRAME_HEIGHT - 4}">{escape(text)}</text></g>'
+                )
+                draw(child, x, level + 1)
+            x += width
+
+    draw(tree, 0.0, 0)
+    with open(file_path, "w") as f:
+        f.write(
+            f'<svg xmlns="http://www.w3.org/2000/svg" width="{FLAMEGRAPH_WIDTH}" height="{height}" '
+            f'font-family="monospace" font-size="11">\n'
+            f'<text x="4" y="12">{escape(title)}</text>\n'
+        )
+        f.write("\n".join(boxes))
+        f.write("\n</svg>\n")
+
+
+@contextmanager
+def profile_run(
+    mode: Optional[str] = None,
+    stages: Optional[List[str]] = None,
+    file_prefix: str = PROFILE_FILE_PREFIX,
+) -> Iterator[Optional[SamplingProfiler]]:
+    """
+    Profiles the with block (see SamplingProfiler) and writes the profile to
+    {file_prefix}_{start time}_{mode}.collapsed and .svg once it ends, even if it failed.
+    Without a mode nothing is profiled and nothing is written.
+    """
+    if not mode:
+        yield None
+        return
+    profiler = SamplingProfiler(mode, stages)
+    run_prefix = f"{file_prefix}_{datetime.now().strftime('%Y%m%dT%H%M%S')}_{mode}"
+    profiler.start()
+    try:
+        yield profiler
+    finally:
+        profiler.stop()
+        print(f"Profile written to {', '.join(profiler.write(run_prefix))}")
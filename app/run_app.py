@@ -1,3 +1,41 @@
+import os
 from app import run_process
+from db_loader import UPLOAD_PARTITIONS
+from profiler import profile_run
+from stage_cache import STAGE_CACHE_DIR
 
-run_process()
+# PIPELINE_CHUNK_ROWS sets the number of wiki rows held in memory at once, the whole dataset is read when not set
+# PIPELINE_SEMI_JOIN=1 only reads the wiki rows whose title matches an imdb title, PIPELINE_WIKI_FROM_XML=1 streams the
+# wiki rows from the xml dump instead of the cache
+chunk_rows = os.environ.get("PIPELINE_CHUNK_ROWS")
+# PIPELINE_FORCE=1 runs every stage even if its inputs did not change, PIPELINE_NO_CACHE=1 doesn't persist the stages
+# PIPELINE_REPORT_TO_DB=1 also stores the run report in truelayer_schema.pipeline_runs
+# PIPELINE_NORMALISE_TITLES=1 joins on the normalised titles, PIPELINE_STRIP_DISAMBIGUATORS=1 also ignores "(1995 film)"
+# PIPELINE_FUZZY_TITLES=1 fuzzy matches the films left without url, in PIPELINE_FUZZY_WORKERS processes
+# PIPELINE_UPLOAD_PARTITIONS sets the number of connections uploading the result concurrently
+# PIPELINE_ARROW_WIKI=1 keeps the wiki side in arrow, memory mapped from the cache, instead of pandas
+# PIPELINE_PROFILE=cpu writes a flamegraph of the run next to the cleaner logs, =alloc one of the memory at its peak,
+# PIPELINE_PROFILE_STAGES=wiki,merge only profiles these stages
+profile_stages = os.environ.get("PIPELINE_PROFILE_STAGES")
+with profile_run(
+    os.environ.get("PIPELINE_PROFILE"),
+    profile_stages.split(",") if profile_stages else None,
+):
+    run_process(
+        wiki_from_xml=os.environ.get("PIPELINE_WIKI_FROM_XML") == "1",
+        semi_join=os.environ.get("PIPELINE_SEMI_JOIN") == "1",
+        chunk_rows=int(chunk_rows) if chunk_rows else None,
+        force=os.environ.get("PIPELINE_FORCE") == "1",
+        cache_dir=(
+            None if os.environ.get("PIPELINE_NO_CACHE") == "1" else STAGE_CACHE_DIR
+        ),
+        report_to_db=os.environ.get("PIPELINE_REPORT_TO_DB") == "1",
+        normalise_titles=os.environ.get("PIPELINE_NORMALISE_TITLES") == "1",
+        strip_disambiguators=os.environ.get("PIPELINE_STRIP_DISAMBIGUATORS") == "1",
+        fuzzy_titles=os.environ.get("PIPELINE_FUZZY_TITLES") == "1",
+        fuzzy_workers=int(os.environ.get("PIPELINE_FUZZY_WORKERS", "1")),
+        upload_partitions=int(
+            os.environ.get("PIPELINE_UPLOAD_PARTITIONS", UPLOAD_PARTITIONS)
+        ),
+        arrow_wiki=os.environ.get("PIPELINE_ARROW_WIKI") == "1",
+    )
@@ -1,3 +1,7 @@
-from files_handler import write_wiki_to_csv
+import os
+from files_handler import write_wiki_cache
+from profiler import profile_run
 
-write_wiki_to_csv()
+# PIPELINE_PROFILE=cpu or alloc profiles the parsing of the dump, only the main process is seen with several workers
+with profile_run(os.environ.get("PIPELINE_PROFILE")):
+    write_wiki_cache(workers=int(os.environ.get("WIKI_PARSE_WORKERS", os.cpu_count())))
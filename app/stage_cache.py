@@ -0,0 +1,167 @@
+import hashlib
+import inspect
+import json
+import os
+from typing import Callable, Optional, Union
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.feather as feather
+from arrow_frames import ArrowFrame
+from instrumentation import stage
+
+STAGE_CACHE_DIR = "/workdir/data_cache"
+HASH_BLOCK_SIZE = 16 * 1024 * 1024
+
+
+def file_fingerprint(file_path: str, content_hash: bool = False) -> dict:
+    """
+    Identifies the version of an input file by its size and mtime, plus the sha256 of its content if content_hash.
+    Hashing is only worth it for the small files, the size and mtime are enough to detect a new wiki dump.
+    """
+    stat = os.stat(file_path)
+    fingerprint = {
+        "path": os.path.abspath(file_path),
+        "size": stat.st_size,
+        "mtime_ns": stat.st_mtime_ns,
+    }
+    if content_hash:
+        sha256 = hashlib.sha256()
+        with open(file_path, "rb") as f:
+            for block in iter(lambda: f.read(HASH_BLOCK_SIZE), b""):
+                sha256.update(block)
+        fingerprint["sha256"] = sha256.hexdigest()
+    return fingerprint
+
+
+def code_fingerprint(*objects) -> str:
+    """
+    Returns the sha256 of the source code of the given modules, classes or functions, so the output of a stage
+    is recomputed when the code producing it (e.g. the cleaner rules or the preprocessing) changes.
+    """
+    sha256 = hashlib.sha256()
+    for obj in objects:
+        sha256.update(inspect.getsource(obj).encode())
+    return sha256.hexdigest()
+
+
+class StageCache:
+    def __init__(self, cache_dir: Optional[str] = STAGE_CACHE_DIR, force: bool = False):
+        """
+        Persists the output dataframe of each pipeline stage with the fingerprint of the stage inputs.
+        A stage whose inputs have the same fingerprint as in the previous run is skipped and its output reused.
+
+        param: cache_dir: where the stage outputs are stored, None disables the cache and every stage runs
+        param: force: run every stage, the outputs are still persisted for the next runs
+        """
+        self._cache_dir = cache_dir
+        self._force = force
+        # The key of every stage ran or reused, so the downstream stages can depend on them
+        self.keys = {}
+        if cache_dir is not None:
+            os.makedirs(cache_dir, exist_ok=True)
+
+    @staticmethod
+    def fingerprint_key(inputs: dict) -> str:
+        return hashlib.sha256(
+            json.dumps(inputs, sort_keys=True, default=str).encode()
+        ).hexdigest()
+
+    def _paths(self, stage_name: str) -> tuple:
+        return (
+            os.path.join(self._cache_dir, f"{stage_name}.feather"),
+            os.path.join(self._cache_dir, f"{stage_name}.json"),
+        )
+
+    def _stored(self, stage_name: str) -> Optional[dict]:
+        if self._cache_dir is None:
+            return None
+        _, key_file = self._paths(stage_name)
+        if not os.path.exists(key_file):
+            return None
+        with open(key_file) as f:
+            return json.load(f)
+
+    def stored_key(self, stage_name: str) -> Optional[str]:
+        """
+        The key of the stored output of the stage, None when there is none.
+        """
+        stored = self._stored(stage_name)
+        return None if stored is None else stored["key"]
+
+    def is_fresh(self, stage_name: str, key: str) -> bool:
+        """
+        Checks the stored output of the stage was computed from inputs with the same key.
+        """
+        if self._force:
+            return False
+        return self.stored_key(stage_name) == key
+
+    def load(self, stage_name: str) -> Union[pd.DataFrame, ArrowFrame, None]:
+        """
+        Returns the stored output of the stage, None for a stage without output (e.g. the upload).
+        An ArrowFrame output is memory mapped back as an ArrowFrame.
+        """
+        frame_file, _ = self._paths(stage_name)
+        if not os.path.exists(frame_file):
+            return None
+        stored = self._stored(stage_name)
+        if stored is not None and stored.get("arrow"):
+            return ArrowFrame(feather.read_table(frame_file, memory_map=True))
+        return feather.read_table(frame_file).to_pandas()
+
+    def save(
+        self, stage_name: str, key: str, df: Union[pd.DataFrame, ArrowFrame, None]
+    ) -> None:
+        """
+        Stores the output of the stage, then its key, so a crash in between never leaves a key with a stale output.
+        The selected rows of an ArrowFrame are written batch by batch as an uncompressed arrow file.
+        """
+        frame_file, key_file = self._paths(stage_name)
+        if os.path.exists(key_file):
+            os.remove(key_file)
+        if isinstance(df, ArrowFrame):
+            with pa.OSFile(frame_file + ".tmp", "wb") as sink:
+                with pa.ipc.new_file(sink, df.table.schema) as writer:
+                    for batch in df.iter_batches():
+                        writer.write_table(batch)
+            os.replace(frame_file + ".tmp", frame_file)
+        elif df is not None:
+            # The index is stored too, as the stages return filtered dataframes
+            feather.write_feather(pa.Table.from_pandas(df), frame_file + ".tmp")
+            os.replace(frame_file + ".tmp", frame_file)
+        elif os.path.exists(frame_file):
+            os.remove(frame_file)
+        with open(key_file, "w") as f:
+            json.dump({"key": key, "arrow": isinstance(df, ArrowFrame)}, f)
+
+    def run(
+        self,
+        stage_name: str,
+        inputs: dict,
+        func: Callable[[], Union[pd.DataFrame, ArrowFrame, None]],
+        force: bool = False,
+    ) -> Union[pd.DataFrame, ArrowFrame, None]:
+        """
+        Runs func, the stage, unless its inputs didn't change since the last run, in which case the stored output
+        is returned instead.
+
+        param: inputs: everything the output of the stage depends on (file fingerprints, parameters, code,
+                       keys of the upstream stages), must be json serialisable
+        param: force: run this stage even if its inputs didn't change, e.g. when its side effect was undone
+        returns: the output of the stage
+        """
+        key = self.fingerprint_key(inputs)
+        self.keys[stage_name] = key
+        with stage(stage_name) as record:
+            if not force and self.is_fresh(stage_name, key):
+                print(f"Skipping stage {stage_name}, its inputs did not change.")
+                record.skipped = True
+                df = self.load(stage_name)
+            else:
+                df = func()
+                if self._cache_dir is not None:
+                    self.save(stage_name, key, df)
+            if df is not None:
+                record.rows_out = len(df)
+        return df
@@ -0,0 +1,336 @@
+import argparse
+from typing import Callable, Dict, List, NamedTuple, Optional, Union
+
+import pandas as pd
+
+import app
+from arrow_frames import ArrowFrame
+from app import (
+    calculate_columns_ratio,
+    imdb_run_preproc_and_cleaner,
+    merge_imdb_and_wiki,
+    pipeline_code_fingerprint,
+    wiki_run_preproc_and_cleaner,
+    wiki_source_fingerprint,
+)
+from db_loader import (
+    RESULT_SCHEMA,
+    RESULT_TABLE,
+    UPLOAD_PARTITIONS,
+    copy_dataframe_to_table,
+)
+from files_handler import (
+    IMDB_CSV_FILE,
+    WIKI_CACHE_FILE,
+    WIKI_XML_FILE,
+    read_imdb_movies_metadata,
+    read_wiki,
+    read_wiki_arrow,
+    read_wiki_batches,
+)
+from frame_dtypes import MEMORY_REPORT_FILE, memory_report, optimise_dtypes
+from fuzzy_match import fill_unmatched_urls
+from instrumentation import RUN_REPORT_FILE, finish_run, measure, stage, start_run
+from profiler import PROFILE_MODES, profile_run
+from stage_cache import StageCache, file_fingerprint
+from title_keys import add_title_keys
+from top_k import TOP_COLUMN, TOP_N, select_top_k
+
+CHECKPOINT_DIR = "/workdir/data_checkpoints"
+
+Frames = Dict[str, Union[pd.DataFrame, ArrowFrame]]
+
+
+def _read_imdb(frames: Frames, options: dict) -> Frames:
+    return {"imdb": measure("read", read_imdb_movies_metadata, options["imdb_file"])}
+
+
+def _read_wiki(frames: Frames, options: dict) -> Frames:
+    # The batches streamed from the xml are gathered into one frame, which is checkpointed
+    batches = (
+        read_wiki_batches(options["wiki_xml_file"])
+        if options["wiki_from_xml"]
+        else None
+    )
+    read = read_wiki_arrow if options["arrow_wiki"] else read_wiki
+    return {
+        "wiki": measure(
+            "read",
+            read,
+            options["wiki_cache_file"],
+            batches=batches,
+            xml_file=options["wiki_xml_file"],
+        )
+    }
+
+
+def _clean(frames: Frames, options: dict) -> Frames:
+    df_imdb = imdb_run_preproc_and_cleaner(frames["imdb"])
+    df_wiki = wiki_run_preproc_and_cleaner(frames["wiki"])
+    if options["normalise_titles"]:
+        strip_disambiguators = options["strip_disambiguators"]
+        df_imdb = add_title_keys(
+            df_imdb, ["title", "original_title"], strip_disambiguators
+        )
+        df_wiki = add_title_keys(df_wiki, ["title"], strip_disambiguators)
+    return {"imdb": df_imdb, "wiki": df_wiki}
+
+
+def _merge(frames: Frames, options: dict) -> Frames:
+    df_joined = measure(
+        "merge",
+        merge_imdb_and_wiki,
+        frames["imdb"],
+        frames["wiki"],
+        title_keys=options["normalise_titles"],
+    )
+    if options["fuzzy_titles"]:
+        df_joined = fill_unmatched_urls(
+            df_joined, frames["wiki"], workers=options["fuzzy_workers"]
+        )
+    if options["optimise_frame_dtypes"]:
+        df_optimised = measure("dtypes", optimise_dtypes, df_joined)
+        print(memory_report(df_joined, df_optimised, MEMORY_REPORT_FILE))
+        df_joined = df_optimised
+    return {"joined": df_joined}
+
+
+def _ratio(frames: Frames, options: dict) -> Frames:
+    return {"joined": calculate_columns_ratio(frames["joined"])}
+
+
+def _topk(frames: Frames, options: dict) -> Frames:
+    return {
+        "result": select_top_k(
+            frames["joined"], n=options["top_n"], column=options["sort_column"]
+        )
+    }
+
+
+def _upload(frames: Frames, options: dict) -> Frames:
+    copy_dataframe_to_table(
+        frames["result"],
+        app.engine,
+        table_name=RESULT_TABLE,
+        schema=RESULT_SCHEMA,
+        partitions=options["upload_partitions"],
+    )
+    return {}
+
+
+def _imdb_source(options: dict) -> dict:
+    return file_fingerprint(options["imdb_file"], content_hash=True)
+
+
+def _wiki_source(options: dict) -> dict:
+    return wiki_source_fingerprint(options["wiki_xml_file"], options["wiki_cache_file"])
+
+
+class PipelineStage(NamedTuple):
+    # Names of the frames read and written by func(frames, options), which returns the written ones
+    inputs: List[str]
+    outputs: List[str]
+    func: Callable[[Frames, dict], Frames]
+    # Fingerprint of the input files of the stage (given the options), and the options its output depends on
+    source: Optional[Callable[[dict], dict]] = None
+    options: List[str] = []
+
+
+# The stages in the order they run
+PIPELINE_STAGES = {
+    "read_imdb": PipelineStage([], ["imdb"], _read_imdb, _imdb_source),
+    "read_wiki": PipelineStage(
+        [],
+        ["wiki"],
+        _read_wiki,
+        _wiki_source,
+        ["wiki_from_xml", "arrow_wiki"],
+    ),
+    "clean": PipelineStage(
+        ["imdb", "wiki"],
+        ["imdb", "wiki"],
+        _clean,
+        options=["normalise_titles", "strip_disambiguators"],
+    ),
+    "merge": PipelineStage(
+        ["imdb", "wiki"],
+        ["joined"],
+        _merge,
+        options=["normalise_titles", "fuzzy_titles", "optimise_frame_dtypes"],
+    ),
+    "ratio": PipelineStage(["joined"], ["joined"], _ratio),
+    "topk": PipelineStage(
+        ["joined"], ["result"], _topk, options=["top_n", "sort_column"]
+    ),
+    "upload": PipelineStage(["result"], [], _upload),
+}
+
+
+def _checkpoint_name(stage_name: str, frame: Optional[str]) -> str:
+    # A stage without output (the upload) only stores its key
+    return stage_name if frame is None else f"{stage_name}.{frame}"
+
+
+def run_stages(
+    first: str = "read_imdb",
+    last: str = "upload",
+    checkpoint_dir: str = CHECKPOINT_DIR,
+    resume: bool = False,
+    report_file: Optional[str] = RUN_REPORT_FILE,
+    stages: Optional[dict] = None,
+    **options,
+) -> None:
+    """
+    Runs the stages of PIPELINE_STAGES from first to last, and checkpoints the frames written by each of them as
+    feather files in checkpoint_dir (see StageCache), so the next stages can run on their own later.
+
+    The frames read by first come from the checkpoints of the stages before it, which must have run once: e.g.
+    run_stages("upload", "upload") uploads the checkpointed top k again without reading or cleaning anything.
+
+    Each checkpoint is stored with the key of its inputs (source files, options of the stage, code and keys of the
+    upstream checkpoints). With resume, the stages whose checkpoints are up to date are skipped: after a crash the same
+    command starts again from the stage that failed.
+
+    param: first, last: names of the first and last stages to run, see PIPELINE_STAGES
+    param: stages: the stages to run instead of PIPELINE_STAGES
+    param: options: the ones of run_process: wiki_from_xml, normalise_titles, strip_disambiguators, fuzzy_titles,
+                    fuzzy_workers, optimise_frame_dtypes, top_n, sort_column, upload_partitions, arrow_wiki.
+                    With arrow_wiki the wiki checkpoints are arrow files, memory mapped when they are loaded.
+                    imdb_file, wiki_xml_file and wiki_cache_file default to the files of files_handler.
+    """
+    stages = stages or PIPELINE_STAGES
+    options = {
+        "imdb_file": IMDB_CSV_FILE,
+        "wiki_xml_file": WIKI_XML_FILE,
+        "wiki_cache_file": WIKI_CACHE_FILE,
+        **options,
+    }
+    stage_names = list(stages)
+    assert first in stage_names, f"Unknown stage {first}, one of {stage_names}."
+    assert last in stage_names, f"Unknown stage {last}, one of {stage_names}."
+    first_position, last_position = stage_names.index(first), stage_names.index(last)
+    assert first_position <= last_position, f"Stage {first} runs after {last}."
+
+    checkpoints = StageCache(checkpoint_dir, force=not resume)
+    code = pipeline_code_fingerprint()
+    # The frames in memory, and for each frame the key of the checkpoint holding its latest version
+    frames = {}
+    frame_keys = {}
+    frame_checkpoints = {}
+
+    run_report = start_run()
+    try:
+        for position, stage_name in enumerate(stage_names[: last_position + 1]):
+            inputs, outputs, func, source, stage_options = stages[stage_name]
+            names = [_checkpoint_name(stage_name, frame) for frame in outputs or [None]]
+            written = None
+            if position < first_position:
+                # Before the range only the keys of the checkpoints are needed
+                keys = [checkpoints.stored_key(name) for name in names]
+                if None in keys:
+                    raise FileNotFoundError(
+                        f"No checkpoint of stage {stage_name} in {checkpoint_dir}, run it before {first}."
+                    )
+                key = keys[0]
+            else:
+                key = checkpoints.fingerprint_key(
+                    {
+                        "stage": stage_name,
+                        "inputs": [frame_keys[frame] for frame in inputs],
+                        "source": source(options) if source is not None else None,
+                        "options": {name: options[name] for name in stage_options},
+                        "code": code,
+                    }
+                )
+                with stage(stage_name) as record:
+                    if all(checkpoints.is_fresh(name, key) for name in names):
+                        print(
+                            f"Skipping stage {stage_name}, its checkpoint is up to date."
+                        )
+                        record.skipped = True
+                    else:
+                        print(f"Running stage {stage_name}")
+                        for frame in inputs:
+                            if frame not in frames:
+                                frames[frame] = checkpoints.load(
+                                    frame_checkpoints[frame]
+                                )
+                        written = func(frames, options)
+                        for frame, name in zip(outputs or [None], names):
+                            checkpoints.save(name, key, written.get(frame))
+                        if outputs:
+                            record.rows_out = len(written[outputs[-1]])
+            for frame, name in zip(outputs, names):
+                if written is None:
+                    # Not run: the checkpointed frame is loaded if a later stage reads it
+                    frames.pop(frame, None)
+                else:
+                    frames[frame] = written[frame]
+                frame_keys[frame] = key
+                frame_checkpoints[frame] = name
+    finally:
+        finish_run()
+        if report_file is not None:
+            run_report.write_json(report_file)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Runs the pipeline stages one at a time or as a range, checkpointing the output of each stage. "
+        f"Stages: {', '.join(PIPELINE_STAGES)}."
+    )
+    parser.add_argument("--stage", choices=PIPELINE_STAGES, help="run only this stage")
+    parser.add_argument(
+        "--from", dest="first", choices=PIPELINE_STAGES, default="read_imdb"
+    )
+    parser.add_argument("--to", dest="last", choices=PIPELINE_STAGES, default="upload")
+    parser.add_argument(
+        "--resume",
+        action="store_true",
+        help="skip the stages whose checkpoint is up to date, to continue a run that failed",
+    )
+    parser.add_argument("--checkpoint-dir", default=CHECKPOINT_DIR)
+    parser.add_argument("--imdb-file", default=IMDB_CSV_FILE)
+    parser.add_argument("--wiki-xml-file", default=WIKI_XML_FILE)
+    parser.add_argument("--wiki-cache-file", default=WIKI_CACHE_FILE)
+    parser.add_argument("--wiki-from-xml", action="store_true")
+    parser.add_argument("--normalise-titles", action="store_true")
+    parser.add_argument("--strip-disambiguators", action="store_true")
+    parser.add_argument("--fuzzy-titles", action="store_true")
+    parser.add_argument("--fuzzy-workers", type=int, default=1)
+    parser.add_argument("--no-optimise-dtypes", action="store_true")
+    parser.add_argument("--top-n", type=int, default=TOP_N)
+    parser.add_argument("--sort-column", default=TOP_COLUMN)
+    parser.add_argument("--upload-partitions", type=int, default=UPLOAD_PARTITIONS)
+    parser.add_argument("--arrow-wiki", action="store_true")
+    parser.add_argument(
+        "--profile",
+        choices=PROFILE_MODES,
+        help="write a flamegraph of the call stacks (cpu) or of the memory at its peak (alloc), see profile_run",
+    )
+    parser.add_argument(
+        "--profile-stages",
+        nargs="+",
+        help="only profile these stages, e.g. clean merge",
+    )
+    args = parser.parse_args()
+    with profile_run(args.profile, args.profile_stages):
+        run_stages(
+            args.stage or args.first,
+            args.stage or args.last,
+            args.checkpoint_dir,
+            args.resume,
+            imdb_file=args.imdb_file,
+            wiki_xml_file=args.wiki_xml_file,
+            wiki_cache_file=args.wiki_cache_file,
+            wiki_from_xml=args.wiki_from_xml,
+            normalise_titles=args.normalise_titles,
+            strip_disambiguators=args.strip_disambiguators,
+            fuzzy_titles=args.fuzzy_titles,
+            fuzzy_workers=args.fuzzy_workers,
+            optimise_frame_dtypes=not args.no_optimise_dtypes,
+            top_n=args.top_n,
+            sort_column=args.sort_column,
+            upload_partitions=args.upload_partitions,
+            arrow_wiki=args.arrow_wiki,
+        )
@@ -0,0 +1,293 @@
+import os
+from typing import Optional
+from xml.sax.saxutils import escape
+
+import numpy as np
+import pandas as pd
+from files_handler import gzip_module
+from title_keys import WIKI_TITLE_PREFIX
+
+# All the columns of movies_metadata.csv, in the order of the kaggle file, most are never parsed by the pipeline
+# but they give the rows their real width
+IMDB_FILE_COLUMNS = [
+    "adult",
+    "belongs_to_collection",
+    "budget",
+    "genres",
+    "homepage",
+    "id",
+    "imdb_id",
+    "original_language",
+    "original_title",
+    "overview",
+    "popularity",
+    "poster_path",
+    "production_companies",
+    "production_countries",
+    "release_date",
+    "revenue",
+    "runtime",
+    "spoken_languages",
+    "status",
+    "tagline",
+    "title",
+    "video",
+    "vote_average",
+    "vote_count",
+]
+# Rates measured on the kaggle movies_metadata.csv (45k movies)
+ZERO_BUDGET_RATE = 0.80
+ZERO_REVENUE_RATE = 0.84
+MISSING_VALUE_RATE = 0.0002
+MALFORMED_ROW_RATE = 0.0001
+ORIGINAL_TITLE_DIFFERS_RATE = 0.25
+# Share of the imdb original titles that have a wikipedia abstract, and of those pages whose title carries a
+# disambiguator such as "Heat (1995 film)" and so doesn't match the imdb title exactly
+WIKI_OVERLAP_RATE = 0.6
+WIKI_DISAMBIGUATED_RATE = 0.3
+# Share of the other pages spelled a bit differently from the imdb title: "Heat!", "Mr. Smith", a doubled letter
+WIKI_VARIANT_RATE = 0.1
+# The dump has ~6M abstracts for 45k imdb movies
+IMDB_ROWS_PER_WIKI_DOC = 0.0075
+MIN_IMDB_ROWS = 1000
+GENERATION_CHUNK_SIZE = 100_000
+
+# fmt: off
+_SYLLABLES = [
+    "ka", "lo", "mi", "ne", "ru", "ta", "vi", "so", "de", "an", "el", "or", "un", "is", "ber", "con", "dar",
+    "fen", "gor", "hal", "jin", "kel", "lar", "mon", "nor", "pal", "quin", "ros", "sel", "tor", "val", "wen",
+]
+# fmt: on
+_VOCABULARY_SIZE = 5000
+
+
+def _vocabulary(rng: np.random.Generator) -> np.ndarray:
+    """
+    Capitalised made up words of 2 to 3 syllables, the building blocks of the titles.
+    """
+    syllables = np.array(_SYLLABLES, dtype=object)
+    words = syllables[rng.integers(0, len(syllables), (_VOCABULARY_SIZE, 3))]
+    lengths = rng.integers(2, 4, _VOCABULARY_SIZE)
+    return np.array(
+        ["".join(word[:length]).capitalize() for word, length in zip(words, lengths)],
+        dtype=object,
+    )
+
+
+def _random_titles(rng: np.random.Generator, vocabulary: np.ndarray, n: int) -> list:
+    """
+    Titles of 1 to 4 words. The short ones collide, as remakes and homonyms do in the real datasets.
+    """
+    words = vocabulary[rng.integers(0, len(vocabulary), (n, 4))]
+    lengths = rng.choice([1, 2, 3, 4], n, p=[0.3, 0.4, 0.2, 0.1])
+    return [" ".join(title[:length]) for title, length in zip(words, lengths)]
+
+
+def _with_missing(values: np.ndarray, rng: np.random.Generator) -> np.ndarray:
+    values = values.astype(object)
+    values[rng.random(len(values)) < MISSING_VALUE_RATE] = None
+    return values
+
+
+def generate_imdb_metadata(n_rows: int, seed: int = 0) -> pd.DataFrame:
+    """
+    A synthetic movies_metadata dataset with the columns of the kaggle file and its rates of zero (unknown)
+    budgets and revenues, missing values, malformed rows and original titles differing from the title.
+
+    param: n_rows: number of movies
+    param: seed: same seed, same dataset
+    returns: dataframe with the IMDB_FILE_COLUMNS, all the values as they would be written in the csv
+    """
+    rng = np.random.default_rng(seed)
+    vocabulary = _vocabulary(rng)
+    titles = np.array(_random_titles(rng, vocabulary, n_rows), dtype=object)
+    original_titles = titles.copy()
+    differs = rng.random(n_rows) < ORIGINAL_TITLE_DIFFERS_RATE
+    original_titles[differs] = _random_titles(rng, vocabulary, int(differs.sum()))
+
+    budget = np.round(rng.lognormal(16, 1.2, n_rows), -3)
+    budget[rng.random(n_rows) < ZERO_BUDGET_RATE] = 0
+    revenue = np.round(budget * rng.lognormal(0.8, 1.0, n_rows), 0)
+    revenue[rng.random(n_rows) < ZERO_REVENUE_RATE] = 0
+    budget = budget.astype(np.int64).astype(str).astype(object)
+    # A few rows are shifted in the kaggle file, leaving a poster path in the budget column
+    budget[rng.random(n_rows) < MALFORMED_ROW_RATE] = "/ff9qCepilowshEtG2GYWwzt2bs4.jpg"
+    release_dates = pd.Timestamp("1900-01-01") + pd.to_timedelta(
+        rng.integers(0, 120 * 365, n_rows), unit="D"
+    )
+
+    df = pd.DataFrame(
+        {
+            "adult": "False",
+            "belongs_to_collection": None,
+            "budget": _with_missing(budget, rng),
+            "genres": "[{'id': 18, 'name': 'Drama'}]",
+            "homepage": None,
+            "id": np.arange(n_rows),
+            "imdb_id": [f"tt{i:07d}" for i in range(n_rows)],
+            "original_language": "en",
+            "original_title": _with_missing(original_titles, rng),
+            "overview": " ".join(["overview"] * 30),
+            "popularity": np.round(rng.exponential(3, n_rows), 6),
+            "poster_path": None,
+            "production_companies": "[{'name': 'Pictures', 'id': 1}]",
+            "production_countries": "[{'iso_3166_1': 'US', 'name': 'United States of America'}]",
+            "release_date": _with_missing(
+                release_dates.strftime("%Y-%m-%d").to_numpy(), rng
+            ),
+            "revenue": _with_missing(revenue, rng),
+            "runtime": rng.integers(60, 180, n_rows).astype(float),
+            "spoken_languages": "[{'iso_639_1': 'en', 'name': 'English'}]",
+            "status": "Released",
+            "tagline": None,
+            "title": _with_missing(titles, rng),
+            "video": "False",
+            "vote_average": np.round(rng.uniform(0, 10, n_rows), 1),
+            "vote_count": rng.integers(0, 10000, n_rows),
+        },
+        columns=IMDB_FILE_COLUMNS,
+    )
+    return df
+
+
+def write_imdb_csv(csv_file: str, n_rows: int, seed: int = 0) -> pd.DataFrame:
+    """
+    Writes generate_imdb_metadata(n_rows, seed) as a movies_metadata.csv file.
+
+    returns: the generated dataframe, to derive the wiki titles from it
+    """
+    df = generate_imdb_metadata(n_rows, seed)
+    df.to_csv(csv_file, index=False)
+    return df
+
+
+def _wiki_doc(title: str, url: Optional[str]) -> str:
+    return (
+        f"<doc>\n<title>{escape(WIKI_TITLE_PREFIX + title)}</title>\n"
+        f"<url>{escape(url) if url is not None else ''}</url>\n"
+        f"<abstract>{escape(title)} is a page of the synthetic dump.</abstract>\n"
+        '<links>\n<sublink linktype="nav"><anchor>Plot</anchor>'
+        f"<link>https://en.wikipedia.org/wiki/Plot</link></sublink>\n</links>\n</doc>\n"
+    )
+
+
+def _title_variant(title: str, rng: np.random.Generator) -> str:
+    """
+    The title with punctuation added after its first word or at its end, or with one of its letters doubled.
+    """
+    variant = rng.integers(0, 3)
+    if variant == 0 and " " in title:
+        first_word, rest = title.split(" ", 1)
+        return f"{first_word}: {rest}"
+    if variant <= 1:
+        return title + "!"
+    position = rng.integers(0, len(title))
+    return title[: position + 1] + title[position:]
+
+
+def generate_wiki_titles(
+    n_docs: int,
+    df_imdb: pd.DataFrame,
+    seed: int = 0,
+    overlap_rate: float = WIKI_OVERLAP_RATE,
+    disambiguated_rate: float = WIKI_DISAMBIGUATED_RATE,
+    variant_rate: float = WIKI_VARIANT_RATE,
+) -> np.ndarray:
+    """
+    The titles (without the "Wikipedia: " prefix) of a synthetic dump of n_docs abstracts: overlap_rate of the imdb
+    original titles, disambiguated_rate of them as "Title (1995 film)" and variant_rate of the others spelled
+    differently (see _title_variant), shuffled among unrelated pages.
+    """
+    rng = np.random.default_rng(seed + 1)
+    imdb_titles = df_imdb["original_title"].dropna().to_numpy()
+    years = pd.to_datetime(df_imdb["release_date"]).dt.year
+    imdb_years = years[df_imdb["original_title"].notna()].to_numpy()
+    film_rows = rng.permutation(len(imdb_titles))[
+        : min(int(len(imdb_titles) * overlap_rate), n_docs)
+    ]
+    film_titles = imdb_titles[film_rows].astype(object)
+    disambiguated = rng.random(len(film_rows)) < disambiguated_rate
+    film_titles[disambiguated] = [
+        f"{title} ({year:.0f} film)" if not np.isnan(year) else f"{title} (film)"
+        for title, year in zip(
+            film_titles[disambiguated], imdb_years[film_rows][disambiguated]
+        )
+    ]
+    # A separate generator, so the other titles don't depend on variant_rate
+    variant_rng = np.random.default_rng(seed + 4)
+    variant = ~disambiguated & (variant_rng.random(len(film_rows)) < variant_rate)
+    film_titles[variant] = [
+        _title_variant(title, variant_rng) for title in film_titles[variant]
+    ]
+    other_titles = _random_titles(
+        rng, _vocabulary(np.random.default_rng(seed + 2)), n_docs - len(film_titles)
+    )
+    titles = np.concatenate([film_titles, np.array(other_titles, dtype=object)])
+    return titles[rng.permutation(n_docs)]
+
+
+def write_wiki_xml(
+    xml_file: str,
+    n_docs: int,
+    df_imdb: pd.DataFrame,
+    seed: int = 0,
+    overlap_rate: float = WIKI_OVERLAP_RATE,
+    disambiguated_rate: float = WIKI_DISAMBIGUATED_RATE,
+    variant_rate: float = WIKI_VARIANT_RATE,
+) -> None:
+    """
+    Writes a synthetic enwiki abstract dump of n_docs docs with the titles of generate_wiki_titles, in the layout
+    of the real one. A path ending in .gz is gzip compressed. The docs are written GENERATION_CHUNK_SIZE at a time,
+    so a 10M docs dump never sits in memory as text.
+    """
+    rng = np.random.default_rng(seed + 3)
+    titles = generate_wiki_titles(
+        n_docs, df_imdb, seed, overlap_rate, disambiguated_rate, variant_rate
+    )
+    missing_url = rng.random(n_docs) < MISSING_VALUE_RATE
+    opener = gzip_module.open if xml_file.endswith(".gz") else open
+    with opener(xml_file, "wt", encoding="utf-8") as f:
+        f.write("<feed>\n")
+        for start in range(0, n_docs, GENERATION_CHUNK_SIZE):
+            stop = start + GENERATION_CHUNK_SIZE
+            f.write(
+                "".join(
+                    _wiki_doc(
+                        title,
+                        (
+                            None
+                            if missing
+                            else "https://en.wikipedia.org/wiki/"
+                            + title.replace(" ", "_")
+                        ),
+                    )
+                    for title, missing in zip(
+                        titles[start:stop], missing_url[start:stop]
+                    )
+                )
+            )
+        f.write("</feed>\n")
+
+
+def imdb_rows_for_scale(n_docs: int) -> int:
+    """
+    Number of imdb movies going with a dump of n_docs abstracts, keeping the ratio of the real datasets.
+    """
+    return max(int(n_docs * IMDB_ROWS_PER_WIKI_DOC), MIN_IMDB_ROWS)
+
+
+def generate_datasets(data_dir: str, n_docs: int, seed: int = 0) -> tuple:
+    """
+    Writes the synthetic movies_metadata.csv and abstract dump for a scale of n_docs abstracts in data_dir,
+    unless they are already there.
+
+    returns: (imdb csv path, wiki xml path)
+    """
+    os.makedirs(data_dir, exist_ok=True)
+    csv_file = os.path.join(data_dir, f"movies_metadata_{n_docs}_{seed}.csv")
+    xml_file = os.path.join(data_dir, f"enwiki-abstract_{n_docs}_{seed}.xml")
+    if not (os.path.exists(csv_file) and os.path.exists(xml_file)):
+        df_imdb = write_imdb_csv(csv_file, imdb_rows_for_scale(n_docs), seed)
+        write_wiki_xml(xml_file + ".tmp", n_docs, df_imdb, seed)
+        os.replace(xml_file + ".tmp", xml_file)
+    return csv_file, xml_file
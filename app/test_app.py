@@ -1,8 +1,22 @@
+import os
+import tempfile
+import threading
+import time
 import unittest
 import pandas as pd
 import numpy as np
 from pandas.testing import assert_frame_equal
-from app import calculate_columns_ratio, merge_imdb_and_wiki
+from app import (
+    calculate_columns_ratio,
+    imdb_candidate_titles,
+    match_wiki_batches,
+    merge_imdb_and_wiki,
+    run_concurrently,
+    wiki_iter_preproc_and_cleaner,
+    wiki_run_preproc_and_cleaner,
+)
+from instrumentation import finish_run, start_run
+from title_keys import add_title_keys
 
 
 class TestCalculateColumnsRatio1(unittest.TestCase):
@@ -142,6 +156,259 @@ class TestMergeImdbAndWiki3(unittest.TestCase):
         assert_frame_equal(expected_df, result_df)
 
 
+def merge_imdb_and_wiki_double_merge(
+    df_imdb: pd.DataFrame, df_wiki: pd.DataFrame
+) -> pd.DataFrame:
+    """
+    The former implementation of merge_imdb_and_wiki, kept as a reference for the equivalence test.
+    """
+    df_joined_on_title = df_imdb.merge(df_wiki, on="title", how="left")
+    df_joined_on_original_title = pd.merge(
+        df_imdb, df_wiki, how="left", left_on=["original_title"], right_on=["title"]
+    )
+    df_joined_on_original_title = df_joined_on_original_title.rename(
+        columns={"title_x": "title"}
+    )
+    df_joined_on_original_title = df_joined_on_original_title.drop("title_y", axis=1)
+    return pd.concat([df_joined_on_title, df_joined_on_original_title]).drop_duplicates(
+        ["title", "original_title", "release_date"], keep="last"
+    )
+
+
+class TestMergeImdbAndWiki4(unittest.TestCase):
+    """
+    Test the hash join gives the same result as the former double merge, on random data with duplicated
+    titles on both sides, titles only matching on one of the keys and rows without any match
+    """
+
+    def setUp(self) -> None:
+        self._cwd = os.getcwd()
+        rng = np.random.default_rng(0)
+        n_imdb = 500
+        n_wiki = 2000
+        self._imdb_df = pd.DataFrame(
+            {
+                "title": [f"title{i}" for i in rng.integers(0, 800, n_imdb)],
+                "original_title": [f"title{i}" for i in rng.integers(0, 800, n_imdb)],
+                "release_date": [f"date{i}" for i in rng.integers(0, 3, n_imdb)],
+                "budget": rng.integers(0, 100, n_imdb).astype(float),
+            }
+        )
+        self._wiki_df = pd.DataFrame(
+            {
+                "title": [f"title{i}" for i in rng.integers(0, 1500, n_wiki)],
+                "url": [f"url{i}" for i in range(n_wiki)],
+            }
+        )
+
+    def test_merge_imdb_and_wiki_1(self) -> None:
+        expected_df = merge_imdb_and_wiki_double_merge(self._imdb_df, self._wiki_df)
+        result_df = merge_imdb_and_wiki(self._imdb_df, self._wiki_df)
+        assert_frame_equal(
+            expected_df.reset_index(drop=True), result_df.reset_index(drop=True)
+        )
+
+    def test_merge_imdb_and_wiki_title_fallback_1(self) -> None:
+        imdb_df = pd.DataFrame(
+            {
+                "title": ["title1", "title2", "title3"],
+                "original_title": ["original1", "title2", "original3"],
+                "release_date": ["date1", "date2", "date3"],
+            }
+        )
+        wiki_df = pd.DataFrame(
+            {
+                "url": ["url1", "url2", "url2_original", "url3"],
+                "title": ["title1", "title2", "title2", "title3_other"],
+            }
+        )
+        expected_df = pd.DataFrame(
+            {**imdb_df, "url": ["url1", "url2_original", np.nan]}
+        )
+        result_df = merge_imdb_and_wiki(imdb_df, wiki_df, title_fallback=True)
+        assert_frame_equal(expected_df, result_df)
+
+    def test_merge_imdb_and_wiki_chunked_1(self) -> None:
+        """
+        The wiki side cleaned and matched by chunks gives the same result as in memory
+        """
+        wiki_df = self._wiki_df.copy()
+        wiki_df.loc[::17, "url"] = np.nan
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            os.chdir(tmp_dir)
+            try:
+                expected_df = merge_imdb_and_wiki(
+                    self._imdb_df, wiki_run_preproc_and_cleaner(wiki_df)
+                )
+                wiki_batches = (
+                    wiki_df.iloc[start : start + 300]
+                    for start in range(0, len(wiki_df), 300)
+                )
+                df_matched = match_wiki_batches(
+                    self._imdb_df, wiki_iter_preproc_and_cleaner(wiki_batches)
+                )
+                result_df = merge_imdb_and_wiki(self._imdb_df, df_matched)
+            finally:
+                os.chdir(self._cwd)
+        assert_frame_equal(expected_df, result_df)
+
+
+class TestMergeImdbAndWiki5(unittest.TestCase):
+    """
+    Test the merge on the title keys: the titles differing only by case and whitespace match, with the same
+    precedence as the exact merge
+    """
+
+    def setUp(self) -> None:
+        self._cwd = os.getcwd()
+        rng = np.random.default_rng(1)
+        n_imdb = 500
+        n_wiki = 2000
+        self._imdb_df = pd.DataFrame(
+            {
+                "title": [f"title {i}" for i in rng.integers(0, 800, n_imdb)],
+                "original_title": [f"title {i}" for i in rng.integers(0, 800, n_imdb)],
+                "release_date": [f"date{i}" for i in rng.integers(0, 3, n_imdb)],
+            }
+        )
+        self._wiki_df = pd.DataFrame(
+            {
+                "title": [f"title {i}" for i in rng.integers(0, 1500, n_wiki)],
+                "url": [f"url{i}" for i in range(n_wiki)],
+            }
+        )
+        # Same titles as written on wikipedia, upper case and with extra spaces
+        self._messy_wiki_df = self._wiki_df.assign(
+            title=" " + self._wiki_df["title"].str.upper().str.replace(" ", "  ")
+        )
+
+    def test_merge_imdb_and_wiki_1(self) -> None:
+        for title_fallback in [False, True]:
+            expected_df = merge_imdb_and_wiki(
+                self._imdb_df, self._wiki_df, title_fallback=title_fallback
+            )
+            result_df = merge_imdb_and_wiki(
+                self._imdb_df,
+                self._messy_wiki_df,
+                title_fallback=title_fallback,
+                title_keys=True,
+            )
+            assert_frame_equal(expected_df, result_df)
+
+    def test_merge_imdb_and_wiki_disambiguator_1(self) -> None:
+        imdb_df = pd.DataFrame(
+            {
+                "title": ["Heat", "Heat", "Alien"],
+                "original_title": ["Heat", "Heat", "Alien"],
+                "release_date": ["1995-12-15", "1986-03-14", "1979-05-25"],
+            }
+        )
+        wiki_df = pd.DataFrame(
+            {"title": ["Heat (1995 film)", "Alien (film)"], "url": ["url1", "url2"]}
+        )
+        result_df = merge_imdb_and_wiki(imdb_df, wiki_df, title_keys=True)
+        self.assertTrue(result_df["url"].isna().all())
+        result_df = merge_imdb_and_wiki(
+            imdb_df, wiki_df, title_keys=True, strip_disambiguator=True
+        )
+        self.assertEqual(result_df["url"].tolist(), ["url1", "url1", "url2"])
+
+    def test_merge_imdb_and_wiki_chunked_1(self) -> None:
+        """
+        The precomputed keys and the keys computed by chunks give the same result
+        """
+        imdb_df = add_title_keys(self._imdb_df.copy(), ["title", "original_title"])
+        wiki_df = add_title_keys(self._messy_wiki_df.copy(), ["title"])
+        expected_df = merge_imdb_and_wiki(imdb_df, wiki_df, title_keys=True)
+        wiki_batches = (
+            self._messy_wiki_df.iloc[start : start + 300]
+            for start in range(0, len(self._messy_wiki_df), 300)
+        )
+        df_matched = match_wiki_batches(imdb_df, wiki_batches, title_keys=True)
+        result_df = merge_imdb_and_wiki(imdb_df, df_matched, title_keys=True)
+        assert_frame_equal(expected_df, result_df)
+
+
+class TestCleanerStage1(unittest.TestCase):
+    """
+    The rules of the cleaners are measured inside the cleaner stage, audit included.
+    """
+
+    def setUp(self) -> None:
+        self._cwd = os.getcwd()
+        self._tmp_dir = tempfile.TemporaryDirectory()
+        os.chdir(self._tmp_dir.name)
+        start_run()
+
+    def tearDown(self) -> None:
+        finish_run()
+        os.chdir(self._cwd)
+        self._tmp_dir.cleanup()
+
+    def test_wiki_cleaner_stage_1(self) -> None:
+        wiki_df = pd.DataFrame(
+            {"title": ["title1", None, "title3"], "url": ["url1", "url2", None]}
+        )
+        self.assertEqual(len(wiki_run_preproc_and_cleaner(wiki_df)), 1)
+        stages = finish_run()["stages"]
+        self.assertEqual(
+            sorted(stages),
+            ["cleaner", "cleaner/no_missing_title", "cleaner/no_missing_url"],
+        )
+        self.assertEqual(
+            (stages["cleaner"]["rows_in"], stages["cleaner"]["rows_out"]), (3, 1)
+        )
+        self.assertTrue(os.path.exists("logs_dataset_cleaner_result_wiki.csv"))
+
+
+class TestImdbCandidateTitles1(unittest.TestCase):
+    """
+    Test the missing titles are not candidates, on the exact titles and on their keys.
+    """
+
+    def test_imdb_candidate_titles_1(self) -> None:
+        imdb_df = pd.DataFrame(
+            {
+                "title": ["Title1", np.nan, "title1"],
+                "original_title": [np.nan, "Title2", "Title1"],
+            }
+        )
+        self.assertEqual(
+            sorted(imdb_candidate_titles(imdb_df)), ["Title1", "Title2", "title1"]
+        )
+        imdb_df = add_title_keys(imdb_df, ["title", "original_title"])
+        self.assertEqual(
+            sorted(imdb_candidate_titles(imdb_df, title_keys=True)),
+            ["title1", "title2"],
+        )
+
+
+class TestRunConcurrently1(unittest.TestCase):
+    """
+    The results are returned in order, and an error is raised without waiting for the functions still running.
+    """
+
+    def test_run_concurrently_1(self) -> None:
+        self.assertEqual(run_concurrently(lambda: 1, lambda: 2), [1, 2])
+
+    def test_run_concurrently_error_1(self) -> None:
+        release = threading.Event()
+
+        def load_imdb() -> None:
+            raise ValueError("imdb")
+
+        def load_wiki() -> bool:
+            return release.wait(10)
+
+        start = time.perf_counter()
+        try:
+            with self.assertRaisesRegex(ValueError, "imdb"):
+                run_concurrently(load_imdb, load_wiki)
+            self.assertLess(time.perf_counter() - start, 5)
+        finally:
+            release.set()
+
+
 def suite() -> None:
     """
     Creates the test suites to be ran.
@@ -153,6 +420,16 @@ def suite() -> None:
     suite.addTest(TestMergeImdbAndWiki1("test_merge_imdb_and_wiki_1"))
     suite.addTest(TestMergeImdbAndWiki2("test_merge_imdb_and_wiki_1"))
     suite.addTest(TestMergeImdbAndWiki3("test_merge_imdb_and_wiki_1"))
+    suite.addTest(TestMergeImdbAndWiki4("test_merge_imdb_and_wiki_1"))
+    suite.addTest(TestMergeImdbAndWiki4("test_merge_imdb_and_wiki_title_fallback_1"))
+    suite.addTest(TestMergeImdbAndWiki4("test_merge_imdb_and_wiki_chunked_1"))
+    suite.addTest(TestMergeImdbAndWiki5("test_merge_imdb_and_wiki_1"))
+    suite.addTest(TestMergeImdbAndWiki5("test_merge_imdb_and_wiki_disambiguator_1"))
+    suite.addTest(TestMergeImdbAndWiki5("test_merge_imdb_and_wiki_chunked_1"))
+    suite.addTest(TestCleanerStage1("test_wiki_cleaner_stage_1"))
+    suite.addTest(TestImdbCandidateTitles1("test_imdb_candidate_titles_1"))
+    suite.addTest(TestRunConcurrently1("test_run_concurrently_1"))
+    suite.addTest(TestRunConcurrently1("test_run_concurrently_error_1"))
 
     return suite
 
@@ -0,0 +1,165 @@
+import os
+import tempfile
+import unittest
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+from pandas.testing import assert_frame_equal
+from app import merge_imdb_and_wiki
+from arrow_frames import ArrowFrame
+from dataset_cleaner import REASON_CODE_COLUMN, DatasetCleaner
+from stage_cache import StageCache
+from title_keys import add_title_keys
+
+
+class TestArrowFrame1(unittest.TestCase):
+    """
+    Filtering an ArrowFrame narrows its selection vector, the table itself is never copied.
+    """
+
+    def setUp(self) -> None:
+        self._table = pa.table(
+            {
+                "title": ["Heat", None, "The Matrix", "Heat", "Vertigo"],
+                "url": ["url_1", "url_2", None, "url_4", "url_5"],
+            }
+        )
+        self._frame = ArrowFrame(self._table)
+
+    def test_filter_1(self) -> None:
+        frame = self._frame.filter(np.array([True, False, True, True, True]))
+        frame = frame.filter(frame.isin("title", ["Heat", "Vertigo"]))
+        self.assertIs(frame.table, self._table)
+        np.testing.assert_array_equal(frame.selection, [0, 3, 4])
+        self.assertEqual(len(frame), 3)
+
+        df = frame.to_pandas(np.array([1, 2]))
+        self.assertEqual(df.index.tolist(), [3, 4])
+        self.assertEqual(df["url"].tolist(), ["url_4", "url_5"])
+        # The strings stay arrow backed
+        self.assertEqual(df["url"].dtype, pd.StringDtype("pyarrow"))
+
+    def test_cleaner_1(self) -> None:
+        # The rules give the same rows and audit on an ArrowFrame as on the dataframe
+        df = self._table.to_pandas()
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            audits = []
+            cleaned = []
+            for data in [df, self._frame]:
+                dataset_cleaner = DatasetCleaner(data)
+                dataset_cleaner.check_missing_values(["title", "url"])
+                dataset_cleaner.check_duplicates(["title"])
+                audit_file = os.path.join(tmp_dir, "audit.csv")
+                dataset_cleaner.write_to_csv(audit_file)
+                audits.append(pd.read_csv(audit_file, index_col=0))
+                cleaned.append(dataset_cleaner.get_cleaned_dataframe())
+        self.assertIsInstance(cleaned[1], ArrowFrame)
+        assert_frame_equal(cleaned[1].to_pandas().astype(object), cleaned[0])
+        assert_frame_equal(audits[1], audits[0])
+        self.assertEqual(audits[0][REASON_CODE_COLUMN].tolist(), [1, 2, 4])
+
+    def test_cleaner_zero_values_1(self) -> None:
+        # As in pandas, a string is never 0 and False is
+        table = pa.table(
+            {"title": ["0", "Heat"], "adult": [True, False], "budget": [0.0, 1.0]}
+        )
+        audits = []
+        for data in [table.to_pandas(), ArrowFrame(table)]:
+            dataset_cleaner = DatasetCleaner(data)
+            dataset_cleaner.check_zero_values(["title", "adult", "budget"])
+            audits.append(dataset_cleaner.get_audit_dataframe().iloc[:, 3:])
+        assert_frame_equal(audits[1], audits[0])
+        self.assertEqual(
+            audits[0].values.tolist(), [[True, True, False], [True, False, True]]
+        )
+
+
+class TestArrowMerge1(unittest.TestCase):
+    """
+    The merge gives the same result on the ArrowFrame of the wiki dataset as on its dataframe.
+    """
+
+    def setUp(self) -> None:
+        self._df_imdb = pd.DataFrame(
+            {
+                "title": ["Heat", "The Matrix", "Vertigo", "Amelie"],
+                "original_title": ["Heat", "The Matrix", "Vertigo", "Amélie"],
+                "release_date": ["1995-12-15", "1999-03-30", "1958-05-09", "2001"],
+            }
+        )
+        self._df_wiki = pd.DataFrame(
+            {
+                "title": ["Heat", "The matrix", "Vertigo", "Heat", "Amélie (film)"],
+                "url": ["url_1", "url_2", "url_3", "url_4", "url_5"],
+            }
+        )
+        self._frame = ArrowFrame(pa.Table.from_pandas(self._df_wiki))
+
+    def test_merge_1(self) -> None:
+        for title_keys in [False, True]:
+            expected = merge_imdb_and_wiki(
+                self._df_imdb,
+                self._df_wiki,
+                title_keys=title_keys,
+                strip_disambiguator=True,
+            )
+            df_joined = merge_imdb_and_wiki(
+                self._df_imdb,
+                self._frame.filter(np.array([True, True, True, True, True])),
+                title_keys=title_keys,
+                strip_disambiguator=True,
+            )
+            self.assertEqual(df_joined["url"].dtype, pd.StringDtype("pyarrow"))
+            assert_frame_equal(df_joined.astype({"url": object}), expected)
+
+    def test_merge_title_keys_1(self) -> None:
+        # The keys computed on the ArrowFrame are used by the merge
+        frame = add_title_keys(self._frame, ["title"], strip_disambiguator=True)
+        self.assertIn("title_key", frame)
+        df_joined = merge_imdb_and_wiki(
+            add_title_keys(self._df_imdb.copy(), ["title", "original_title"]),
+            frame.filter(np.array([False, True, True, True, True])),
+            title_keys=True,
+        )
+        self.assertEqual(
+            df_joined["url"].tolist(), ["url_4", "url_2", "url_3", "url_5"]
+        )
+
+
+class TestArrowStageCache1(unittest.TestCase):
+    """
+    Only the selected rows of an ArrowFrame are stored, and they are loaded back as an ArrowFrame.
+    """
+
+    def test_save_load_1(self) -> None:
+        table = pa.table({"title": ["a", "b", "c"], "url": ["u1", "u2", "u3"]})
+        frame = ArrowFrame(table, np.array([0, 2]))
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            stage_cache = StageCache(tmp_dir)
+            stage_cache.save("wiki", "key", frame)
+            loaded = stage_cache.load("wiki")
+            self.assertIsInstance(loaded, ArrowFrame)
+            self.assertEqual(
+                loaded.table.to_pydict(), {"title": ["a", "c"], "url": ["u1", "u3"]}
+            )
+            self.assertEqual(stage_cache.stored_key("wiki"), "key")
+
+
+def suite() -> None:
+    """
+    Creates the test suites to be ran.
+    """
+    suite = unittest.TestSuite()
+    suite.addTest(TestArrowFrame1("test_filter_1"))
+    suite.addTest(TestArrowFrame1("test_cleaner_1"))
+    suite.addTest(TestArrowFrame1("test_cleaner_zero_values_1"))
+    suite.addTest(TestArrowMerge1("test_merge_1"))
+    suite.addTest(TestArrowMerge1("test_merge_title_keys_1"))
+    suite.addTest(TestArrowStageCache1("test_save_load_1"))
+
+    return suite
+
+
+if __name__ == "__main__":
+    runner = unittest.TextTestRunner()
+    runner.run(suite())
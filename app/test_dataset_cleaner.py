@@ -1,3 +1,5 @@
+import os
+import tempfile
 import unittest
 import pandas as pd
 from pandas.testing import assert_frame_equal
@@ -182,6 +184,217 @@ class TestDatasetCleanerContainsMissingValues2(unittest.TestCase):
         assert_frame_equal(cleaned_df, expected_df)
 
 
+class TestDatasetCleanerZeroValues1(unittest.TestCase):
+    """
+    Input data contains zero values and missing values, the input dataframe must not be modified
+    """
+
+    def setUp(self) -> None:
+        self._data = {
+            "budget": [100.0, 0.0, np.nan, 30.0],
+            "revenue": [10.0, 5.0, 20.0, 0.0],
+        }
+        self._input_df = pd.DataFrame(self._data)
+        self._dataset_cleaner = DatasetCleaner(self._input_df)
+
+    def test_check_zero_values_1(self) -> None:
+        """
+        Test if DatasetCleaner.check_zero_values for the case: zero values in multiple columns, mixed with missing values
+        """
+        expected_data = {
+            **self._data,
+            "no_missing_budget": [True, True, False, True],
+            "no_zero_values_budget": [True, False, True, True],
+            "no_zero_values_revenue": [True, True, True, False],
+        }
+        expected_df = pd.DataFrame(expected_data)
+        self._dataset_cleaner.check_missing_values(columns=["budget"])
+        self._dataset_cleaner.check_zero_values(columns=["budget", "revenue"])
+        assert_frame_equal(self._dataset_cleaner.df, expected_df)
+        assert_frame_equal(self._input_df, pd.DataFrame(self._data))
+
+    def test_get_cleaned_dataframe_1(self) -> None:
+        """
+        Test if DatasetCleaner.get_cleaned_dataframe for the case: more rules than bits in a byte
+        """
+        expected_df = pd.DataFrame(self._data).iloc[[0]]
+        for _ in range(5):
+            self._dataset_cleaner.check_missing_values(columns=["budget", "revenue"])
+        self._dataset_cleaner.check_zero_values(columns=["budget", "revenue"])
+        cleaned_df = self._dataset_cleaner.get_cleaned_dataframe()
+        assert_frame_equal(cleaned_df, expected_df)
+
+
+class TestDatasetCleanerRulePlan1(unittest.TestCase):
+    """
+    Range, regex and duplicates rules, evaluated on a dataframe and on a stream of batches
+    """
+
+    def setUp(self) -> None:
+        self._data = {
+            "title": ["title1", "title2", "title1", "title3", "title4"],
+            "url": ["https://a", "https://b", "https://c", "ftp://d", np.nan],
+            "budget": [10.0, -1.0, 20.0, 30.0, 40.0],
+        }
+        self._expected_audit_data = {
+            **self._data,
+            "in_range_budget": [True, False, True, True, True],
+            "matches_regex_url": [True, True, True, False, True],
+            "no_duplicates_title": [True, True, False, True, True],
+        }
+
+    def _add_rules(self, dataset_cleaner: DatasetCleaner) -> None:
+        dataset_cleaner.check_range(columns=["budget"], min_value=0)
+        dataset_cleaner.check_regex(columns=["url"], pattern="https://")
+        dataset_cleaner.check_duplicates(columns=["title"])
+
+    def test_get_cleaned_dataframe_1(self) -> None:
+        """
+        Test if DatasetCleaner.get_cleaned_dataframe for the case: range, regex and duplicates rules
+        """
+        input_df = pd.DataFrame(self._data)
+        dataset_cleaner = DatasetCleaner(input_df)
+        self._add_rules(dataset_cleaner)
+        assert_frame_equal(dataset_cleaner.df, pd.DataFrame(self._expected_audit_data))
+        expected_df = input_df.iloc[[0, 4]]
+        assert_frame_equal(dataset_cleaner.get_cleaned_dataframe(), expected_df)
+
+    def test_iter_cleaned_batches_1(self) -> None:
+        """
+        Test if DatasetCleaner over a stream gives the same result, duplicates are found across batches
+        """
+        input_df = pd.DataFrame(self._data)
+        batches = [input_df.iloc[:2], input_df.iloc[2:]]
+        dataset_cleaner = DatasetCleaner(iter(batches))
+        self._add_rules(dataset_cleaner)
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            audit_file = os.path.join(tmp_dir, "audit.csv")
+            dataset_cleaner.write_to_csv(audit_file, audit_mode="full")
+            cleaned_df = dataset_cleaner.get_cleaned_dataframe()
+            audit_df = pd.read_csv(audit_file, index_col=0)
+        expected_df = input_df.iloc[[0, 4]].reset_index(drop=True)
+        assert_frame_equal(cleaned_df, expected_df)
+        assert_frame_equal(audit_df, pd.DataFrame(self._expected_audit_data))
+
+    def test_iter_cleaned_batches_nan_duplicates_1(self) -> None:
+        """
+        Test the missing values of a key are duplicates of each other across batches, as inside a batch
+        """
+        input_df = pd.DataFrame(
+            {
+                "title": [np.nan, "title1", np.nan, "title1"],
+                "budget": [1.0, np.nan, 1.0, np.nan],
+            }
+        )
+        dataset_cleaner = DatasetCleaner(iter([input_df.iloc[:2], input_df.iloc[2:]]))
+        dataset_cleaner.check_duplicates(columns=["title", "budget"])
+        expected_df = input_df.iloc[:2]
+        assert_frame_equal(dataset_cleaner.get_cleaned_dataframe(), expected_df)
+
+    def test_write_to_csv_rejected_1(self) -> None:
+        """
+        Test if DatasetCleaner.write_to_csv for the case: only the rejected rows and the summary are written
+        """
+        input_df = pd.DataFrame(self._data)
+        expected_rejected_df = input_df.iloc[[1, 2, 3]].copy()
+        # Bit 0 is the range rule, bit 1 the regex rule and bit 2 the duplicates rule
+        expected_rejected_df["failed_rules"] = np.array([1, 4, 2], dtype=np.uint8)
+        expected_summary_df = pd.DataFrame(
+            {
+                "rule": [
+                    "in_range_budget",
+                    "matches_regex_url",
+                    "no_duplicates_title",
+                    "rejected_rows",
+                    "total_rows",
+                ],
+                "bit": [0, 1, 2, np.nan, np.nan],
+                "failed_rows": [1, 1, 1, 3, 5],
+            }
+        )
+        for file_name in ["audit.csv", "audit.parquet"]:
+            dataset_cleaner = DatasetCleaner(input_df)
+            self._add_rules(dataset_cleaner)
+            with tempfile.TemporaryDirectory() as tmp_dir:
+                audit_file = os.path.join(tmp_dir, file_name)
+                dataset_cleaner.write_to_csv(audit_file)
+                if file_name.endswith(".parquet"):
+                    rejected_df = pd.read_parquet(audit_file)
+                else:
+                    rejected_df = pd.read_csv(audit_file, index_col=0)
+                    rejected_df["failed_rules"] = rejected_df["failed_rules"].astype(
+                        np.uint8
+                    )
+                summary_df = pd.read_csv(os.path.join(tmp_dir, "audit_summary.csv"))
+            assert_frame_equal(rejected_df, expected_rejected_df)
+            assert_frame_equal(summary_df, expected_summary_df)
+
+    def test_iter_cleaned_batches_rejected_1(self) -> None:
+        """
+        Test the rejected rows of a stream are appended to the audit file batch by batch, and that a stream
+        without rejected rows still writes the header
+        """
+        input_df = pd.DataFrame(self._data)
+        expected_rejected_df = input_df.iloc[[1, 2, 3]].copy()
+        expected_rejected_df["failed_rules"] = np.array([1, 4, 2], dtype=np.uint8)
+        for file_name in ["audit.csv", "audit.parquet"]:
+            with tempfile.TemporaryDirectory() as tmp_dir:
+                audit_file = os.path.join(tmp_dir, file_name)
+                read_audit = (
+                    pd.read_parquet
+                    if file_name.endswith(".parquet")
+                    else lambda path: pd.read_csv(
+                        path, index_col=0, dtype={"failed_rules": np.uint8}
+                    )
+                )
+                dataset_cleaner = DatasetCleaner(
+                    iter([input_df.iloc[:2], input_df.iloc[2:]])
+                )
+                self._add_rules(dataset_cleaner)
+                dataset_cleaner.write_to_csv(audit_file)
+                batches = dataset_cleaner.iter_cleaned_batches()
+                next(batches)
+                if not file_name.endswith(".parquet"):
+                    # The rejected row of the first batch is written before the next batch is read
+                    self.assertEqual(read_audit(audit_file).index.tolist(), [1])
+                list(batches)
+                assert_frame_equal(read_audit(audit_file), expected_rejected_df)
+
+                dataset_cleaner = DatasetCleaner(iter([input_df.iloc[[0, 4]]]))
+                self._add_rules(dataset_cleaner)
+                dataset_cleaner.write_to_csv(audit_file)
+                dataset_cleaner.get_cleaned_dataframe()
+                self.assertEqual(
+                    read_audit(audit_file).columns.tolist(),
+                    list(self._data) + ["failed_rules"],
+                )
+                self.assertEqual(len(read_audit(audit_file)), 0)
+
+    def test_iter_cleaned_batches_parquet_dtypes_1(self) -> None:
+        """
+        Test the parquet audit of a stream keeps the dtypes of the batches, whatever the rejected rows of the first
+        batch hold
+        """
+        batches = [
+            pd.DataFrame(
+                {"title": [None, "title2"], "budget": [None, 7]}, dtype=object
+            ),
+            pd.DataFrame({"title": [None], "budget": [3]}, index=[2], dtype=object),
+        ]
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            audit_file = os.path.join(tmp_dir, "audit.parquet")
+            dataset_cleaner = DatasetCleaner(iter(batches))
+            dataset_cleaner.check_missing_values(["title"])
+            dataset_cleaner.write_to_csv(audit_file)
+            dataset_cleaner.get_cleaned_dataframe()
+            audit_df = pd.read_parquet(audit_file)
+        self.assertEqual(audit_df.index.tolist(), [0, 2])
+        self.assertEqual(audit_df["budget"].dtype, np.float64)
+        self.assertTrue(
+            np.array_equal(audit_df["budget"], [np.nan, 3.0], equal_nan=True)
+        )
+
+
 def suite() -> None:
     """
     Creates the test suites to be ran.
@@ -204,6 +417,18 @@ def suite() -> None:
     suite.addTest(
         TestDatasetCleanerContainsMissingValues2("test_get_cleaned_dataframe_1")
     )
+    suite.addTest(TestDatasetCleanerZeroValues1("test_check_zero_values_1"))
+    suite.addTest(TestDatasetCleanerZeroValues1("test_get_cleaned_dataframe_1"))
+    suite.addTest(TestDatasetCleanerRulePlan1("test_get_cleaned_dataframe_1"))
+    suite.addTest(TestDatasetCleanerRulePlan1("test_iter_cleaned_batches_1"))
+    suite.addTest(
+        TestDatasetCleanerRulePlan1("test_iter_cleaned_batches_nan_duplicates_1")
+    )
+    suite.addTest(TestDatasetCleanerRulePlan1("test_write_to_csv_rejected_1"))
+    suite.addTest(TestDatasetCleanerRulePlan1("test_iter_cleaned_batches_rejected_1"))
+    suite.addTest(
+        TestDatasetCleanerRulePlan1("test_iter_cleaned_batches_parquet_dtypes_1")
+    )
     return suite
 
 
@@ -0,0 +1,251 @@
+import threading
+import unittest
+import numpy as np
+import pandas as pd
+from psycopg2 import sql
+from db_loader import (
+    copy_dataframe_to_table,
+    iter_csv_chunks,
+    partition_bounds,
+    postgres_column_types,
+)
+
+
+def _render(statement) -> str:
+    """
+    The text of a psycopg2 sql statement, with the identifiers unquoted, without a database connection.
+    """
+    if isinstance(statement, sql.Composed):
+        return "".join(_render(part) for part in statement.seq)
+    if isinstance(statement, sql.Identifier):
+        return ".".join(statement.strings)
+    if isinstance(statement, sql.SQL):
+        return statement.string
+    return str(statement)
+
+
+class _FakeCursor:
+    def __init__(self, connection: "_FakeConnection") -> None:
+        self._connection = connection
+
+    def __enter__(self) -> "_FakeCursor":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        pass
+
+    def execute(self, statement) -> None:
+        self._connection.statements.append(_render(statement))
+
+    def copy_expert(self, statement, buffer) -> None:
+        rows = buffer.read()
+        if self._connection.fail_on in rows:
+            raise RuntimeError(f"COPY failed on {rows}")
+        self._connection.statements.append(_render(statement))
+        self._connection.rows.append(rows)
+
+
+class _FakeConnection:
+    """
+    Records the statements run on a connection of _FakeEngine, and the csv rows copied.
+    """
+
+    def __init__(self, fail_on: str) -> None:
+        self.fail_on = fail_on
+        self.statements = []
+        self.rows = []
+
+    def cursor(self) -> _FakeCursor:
+        return _FakeCursor(self)
+
+    def commit(self) -> None:
+        self.statements.append("COMMIT")
+
+    def rollback(self) -> None:
+        self.statements.append("ROLLBACK")
+
+    def close(self) -> None:
+        self.statements.append("CLOSE")
+
+
+class _FakePool:
+    def __init__(self, size: int) -> None:
+        self._size = size
+
+    def size(self) -> int:
+        return self._size
+
+
+class _FakeEngine:
+    """
+    Stands for a sqlalchemy engine, its raw connections are _FakeConnection. A COPY of rows containing fail_on raises.
+    """
+
+    def __init__(self, pool_size: int, fail_on: str = "\0") -> None:
+        self.pool = _FakePool(pool_size)
+        self.connections = []
+        self._fail_on = fail_on
+        self._lock = threading.Lock()
+
+    def raw_connection(self) -> _FakeConnection:
+        with self._lock:
+            self.connections.append(_FakeConnection(self._fail_on))
+            return self.connections[-1]
+
+
+class TestPostgresColumnTypes1(unittest.TestCase):
+    """
+    Simple test to check the dtypes of the result dataframe are mapped to postgres types.
+    """
+
+    def test_postgres_column_types_1(self) -> None:
+        df = pd.DataFrame(
+            {
+                "title": ["title1"],
+                "budget": [10.0],
+                "vote_count": [3],
+                "adult": [False],
+                "release_date": pd.to_datetime(["1995-10-30"]),
+            }
+        )
+        expected_types = {
+            "title": "text",
+            "budget": "double precision",
+            "vote_count": "bigint",
+            "adult": "boolean",
+            "release_date": "timestamp",
+        }
+        self.assertEqual(postgres_column_types(df), expected_types)
+
+
+class TestIterCsvChunks1(unittest.TestCase):
+    """
+    Test the csv chunks sent to COPY: no header, no index and missing values as empty fields.
+    """
+
+    def test_iter_csv_chunks_1(self) -> None:
+        df = pd.DataFrame(
+            {"title": ["title1", "title2", "title,3"], "ratio": [1.5, np.nan, 2.0]}
+        )
+        chunks = [buffer.read() for buffer in iter_csv_chunks(df, chunk_rows=2)]
+        self.assertEqual(chunks, ["title1,1.5\ntitle2,\n", '"title,3",2.0\n'])
+
+
+class TestPartitionBounds1(unittest.TestCase):
+    """
+    The partitions cover all the rows once, and small frames are not split.
+    """
+
+    def test_partition_bounds_1(self) -> None:
+        self.assertEqual(
+            partition_bounds(10, partitions=3, min_partition_rows=1),
+            [(0, 3), (3, 6), (6, 10)],
+        )
+        self.assertEqual(
+            partition_bounds(10, partitions=4, min_partition_rows=4), [(0, 5), (5, 10)]
+        )
+        self.assertEqual(
+            partition_bounds(3, partitions=4, min_partition_rows=10), [(0, 3)]
+        )
+        self.assertEqual(partition_bounds(0, partitions=4), [])
+
+
+class TestCopyDataframeToTable1(unittest.TestCase):
+    """
+    Test the statements of the load: the staging table is created, copied by partitions, indexed and renamed, and
+    a failing partition rolls the load back without touching the table.
+    """
+
+    def setUp(self) -> None:
+        self._df = pd.DataFrame(
+            {
+                "title": ["title1", "title2", "title3", "title4"],
+                "ratio": [1.5, 2.0, 0.5, 3.0],
+            }
+        )
+
+    def _copy(self, engine: _FakeEngine, partitions: int = 2) -> None:
+        copy_dataframe_to_table(
+            self._df,
+            engine,
+            table_name="films",
+            schema="schema",
+            chunk_rows=1,
+            partitions=partitions,
+            index_columns=["ratio"],
+            min_partition_rows=1,
+        )
+
+    def test_copy_dataframe_to_table_1(self) -> None:
+        engine = _FakeEngine(pool_size=3)
+        self._copy(engine)
+        main_connection, *partition_connections = engine.connections
+        self.assertEqual(
+            main_connection.statements,
+            [
+                "DROP TABLE IF EXISTS schema.films_staging",
+                "CREATE TABLE schema.films_staging (title text, ratio double precision)",
+                "COMMIT",
+                "CREATE INDEX films_staging_ratio_idx ON schema.films_staging (ratio)",
+                "ANALYZE schema.films_staging",
+                "COMMIT",
+                "DROP TABLE IF EXISTS schema.films",
+                "ALTER TABLE schema.films_staging RENAME TO films",
+                "ALTER INDEX schema.films_staging_ratio_idx RENAME TO films_ratio_idx",
+                "COMMIT",
+                "CLOSE",
+            ],
+        )
+        self.assertEqual(len(partition_connections), 2)
+        copy_statement = (
+            "COPY schema.films_staging (title, ratio) FROM STDIN WITH (FORMAT csv)"
+        )
+        for connection in partition_connections:
+            self.assertEqual(
+                connection.statements, [copy_statement] * 2 + ["COMMIT", "CLOSE"]
+            )
+        self.assertEqual(
+            sorted(rows for c in partition_connections for rows in c.rows),
+            ["title1,1.5\n", "title2,2.0\n", "title3,0.5\n", "title4,3.0\n"],
+        )
+
+    def test_copy_dataframe_to_table_pool_1(self) -> None:
+        # The partitions are lowered to the connections left in the pool
+        engine = _FakeEngine(pool_size=2)
+        self._copy(engine, partitions=4)
+        self.assertEqual(len(engine.connections), 2)
+        self.assertEqual(len(engine.connections[1].rows), 4)
+
+    def test_copy_dataframe_to_table_rollback_1(self) -> None:
+        engine = _FakeEngine(pool_size=3, fail_on="title4")
+        with self.assertRaisesRegex(RuntimeError, "title4"):
+            self._copy(engine)
+        main_connection, *partition_connections = engine.connections
+        self.assertEqual(main_connection.statements[-2:], ["ROLLBACK", "CLOSE"])
+        self.assertFalse(
+            any("RENAME" in statement for statement in main_connection.statements)
+        )
+        self.assertEqual(
+            sorted(c.statements[-2:] for c in partition_connections),
+            [["COMMIT", "CLOSE"], ["ROLLBACK", "CLOSE"]],
+        )
+
+
+def suite() -> None:
+    """
+    Creates the test suites to be ran.
+    """
+    suite = unittest.TestSuite()
+    suite.addTest(TestPostgresColumnTypes1("test_postgres_column_types_1"))
+    suite.addTest(TestIterCsvChunks1("test_iter_csv_chunks_1"))
+    suite.addTest(TestPartitionBounds1("test_partition_bounds_1"))
+    suite.addTest(TestCopyDataframeToTable1("test_copy_dataframe_to_table_1"))
+    suite.addTest(TestCopyDataframeToTable1("test_copy_dataframe_to_table_pool_1"))
+    suite.addTest(TestCopyDataframeToTable1("test_copy_dataframe_to_table_rollback_1"))
+
+    return suite
+
+
+if __name__ == "__main__":
+    runner = unittest.TextTestRunner()
+    runner.run(suite())
@@ -0,0 +1,310 @@
+import bz2
+import gzip
+import os
+import tempfile
+import unittest
+import warnings
+import numpy as np
+import pandas as pd
+from pandas.testing import assert_frame_equal
+from files_handler import (
+    iter_wiki_cache,
+    iter_wiki_xml,
+    iter_wiki_xml_sharded,
+    read_imdb_movies_metadata,
+    read_wiki,
+    read_wiki_arrow,
+    read_wiki_batches,
+    split_wiki_dump,
+    wiki_cache_is_fresh,
+    write_wiki_to_csv,
+)
+
+WIKI_XML = """<feed>
+<doc>
+<title>Wikipedia: title1</title>
+<url>https://en.wikipedia.org/wiki/title1</url>
+<abstract>abstract1</abstract>
+<links><sublink linktype="nav"><anchor>a</anchor><link>l</link></sublink></links>
+</doc>
+<doc>
+<title>Wikipedia: title2</title>
+<url>https://en.wikipedia.org/wiki/title2</url>
+<abstract>abstract2</abstract>
+<links></links>
+</doc>
+<doc>
+<title>Wikipedia: title3</title>
+<url>https://en.wikipedia.org/wiki/title3</url>
+<abstract></abstract>
+<links></links>
+</doc>
+</feed>
+"""
+
+
+class TestReadWikiBatches1(unittest.TestCase):
+    """
+    Simple test to check the streaming reader against the csv path.
+    """
+
+    def setUp(self) -> None:
+        self._tmp_dir = tempfile.TemporaryDirectory()
+        self._xml_file = os.path.join(self._tmp_dir.name, "abstract.xml")
+        self._csv_file = os.path.join(self._tmp_dir.name, "wiki_data.csv")
+        self._cache_file = os.path.join(self._tmp_dir.name, "wiki_data.feather")
+        with open(self._xml_file, "w") as f:
+            f.write(WIKI_XML)
+        self._expected_df = pd.DataFrame(
+            {
+                "title": ["title1", "title2", "title3"],
+                "url": [
+                    "https://en.wikipedia.org/wiki/title1",
+                    "https://en.wikipedia.org/wiki/title2",
+                    "https://en.wikipedia.org/wiki/title3",
+                ],
+            }
+        )
+
+    def tearDown(self) -> None:
+        self._tmp_dir.cleanup()
+
+    def test_iter_wiki_xml_1(self) -> None:
+        batches = list(iter_wiki_xml(self._xml_file, batch_size=2))
+        self.assertEqual([len(batch) for batch in batches], [2, 1])
+        self.assertEqual(
+            batches[0]["title"].tolist(), ["Wikipedia: title1", "Wikipedia: title2"]
+        )
+
+    def test_read_wiki_batches_1(self) -> None:
+        result_df = read_wiki(batches=read_wiki_batches(self._xml_file, batch_size=2))
+        assert_frame_equal(self._expected_df, result_df)
+
+    def test_write_wiki_to_csv_1(self) -> None:
+        write_wiki_to_csv(self._xml_file, self._csv_file, batch_size=2)
+        result_df = read_wiki(self._csv_file)
+        assert_frame_equal(self._expected_df, result_df)
+
+    def test_read_wiki_batches_gz_1(self) -> None:
+        with gzip.open(self._xml_file + ".gz", "wt") as f:
+            f.write(WIKI_XML)
+        result_df = read_wiki(batches=read_wiki_batches(self._xml_file + ".gz"))
+        assert_frame_equal(self._expected_df, result_df)
+
+    def test_read_wiki_batches_bz2_1(self) -> None:
+        bz2_file = os.path.join(self._tmp_dir.name, "abstract_bz2.xml")
+        with bz2.open(bz2_file + ".bz2", "wt") as f:
+            f.write(WIKI_XML)
+        # Only the compressed file exists, so the plain path resolves to it
+        result_df = read_wiki(batches=read_wiki_batches(bz2_file))
+        assert_frame_equal(self._expected_df, result_df)
+
+    def test_read_wiki_cache_1(self) -> None:
+        # The cache does not exist yet so it is built from the xml
+        self.assertFalse(wiki_cache_is_fresh(self._xml_file, self._cache_file))
+        result_df = read_wiki(self._cache_file, xml_file=self._xml_file)
+        assert_frame_equal(self._expected_df, result_df)
+        self.assertTrue(wiki_cache_is_fresh(self._xml_file, self._cache_file))
+        result_df = read_wiki(
+            self._cache_file, memory_map=True, xml_file=self._xml_file
+        )
+        assert_frame_equal(self._expected_df, result_df)
+
+    def test_iter_wiki_cache_1(self) -> None:
+        batches = list(
+            iter_wiki_cache(self._cache_file, batch_size=2, xml_file=self._xml_file)
+        )
+        self.assertEqual([len(batch) for batch in batches], [2, 1])
+        assert_frame_equal(self._expected_df, read_wiki(batches=batches))
+
+    def test_read_wiki_cache_invalidation_1(self) -> None:
+        read_wiki(self._cache_file, xml_file=self._xml_file)
+        with open(self._xml_file, "w") as f:
+            f.write(WIKI_XML.replace("title3", "title4"))
+        self.assertFalse(wiki_cache_is_fresh(self._xml_file, self._cache_file))
+        result_df = read_wiki(self._cache_file, xml_file=self._xml_file)
+        self.assertEqual(result_df["title"].tolist(), ["title1", "title2", "title4"])
+
+    def test_iter_wiki_xml_sharded_1(self) -> None:
+        # A tiny shard size forces one shard per <doc>
+        shards = split_wiki_dump(self._xml_file, shard_size=10)
+        self.assertEqual(len(shards), 3)
+        with open(self._xml_file, "rb") as f:
+            content = f.read()
+        for start, end in shards:
+            self.assertTrue(content[start:end].startswith(b"<doc>"))
+            self.assertTrue(content[start:end].strip().endswith(b"</doc>"))
+        expected_df = read_wiki(batches=read_wiki_batches(self._xml_file))
+        # With a single worker only 2 of the 3 shards are submitted ahead
+        for workers in [1, 2, None]:
+            result_df = read_wiki(
+                batches=iter_wiki_xml_sharded(
+                    self._xml_file, workers=workers, shard_size=10
+                )
+            )
+            assert_frame_equal(expected_df, result_df)
+        batches = iter_wiki_xml_sharded(self._xml_file, workers=1, shard_size=10)
+        self.assertEqual(next(batches)["title"].tolist(), ["title1"])
+        batches.close()
+
+    def test_read_wiki_cache_workers_1(self) -> None:
+        result_df = read_wiki(self._cache_file, xml_file=self._xml_file, workers=2)
+        assert_frame_equal(self._expected_df, result_df)
+
+    def test_read_wiki_titles_1(self) -> None:
+        titles = ["title3", "title1", "unknown"]
+        expected_df = self._expected_df.iloc[[0, 2]].reset_index(drop=True)
+        write_wiki_to_csv(self._xml_file, self._csv_file)
+        results = [
+            read_wiki(batches=read_wiki_batches(self._xml_file, titles=titles)),
+            read_wiki(
+                batches=iter_wiki_xml_sharded(
+                    self._xml_file, workers=2, shard_size=10, titles=titles
+                )
+            ),
+            read_wiki(self._cache_file, xml_file=self._xml_file, titles=titles),
+            read_wiki(self._csv_file, titles=titles),
+        ]
+        for result_df in results:
+            assert_frame_equal(expected_df, result_df.reset_index(drop=True))
+
+    def test_read_wiki_title_keys_1(self) -> None:
+        # The semi-join on the keys runs in every reader
+        with open(self._xml_file, "w") as f:
+            f.write(WIKI_XML.replace(": title3", ": The  Title3 (1995 film)"))
+        keys = ["the title3", "title1", "unknown"]
+        expected_df = pd.DataFrame(
+            {
+                "title": ["title1", "The  Title3 (1995 film)"],
+                "url": [
+                    "https://en.wikipedia.org/wiki/title1",
+                    "https://en.wikipedia.org/wiki/title3",
+                ],
+            }
+        )
+        options = dict(titles=keys, title_keys=True, strip_disambiguator=True)
+        results = [
+            read_wiki(batches=read_wiki_batches(self._xml_file, **options)),
+            read_wiki(
+                batches=iter_wiki_xml_sharded(
+                    self._xml_file, workers=2, shard_size=10, **options
+                )
+            ),
+            read_wiki(self._cache_file, xml_file=self._xml_file, **options),
+            read_wiki(
+                batches=iter_wiki_cache(
+                    self._cache_file, xml_file=self._xml_file, **options
+                )
+            ),
+            read_wiki_arrow(
+                self._cache_file, xml_file=self._xml_file, **options
+            ).to_pandas(),
+        ]
+        for result_df in results:
+            assert_frame_equal(
+                expected_df, result_df.reset_index(drop=True).astype(object)
+            )
+        # Without strip_disambiguator the key keeps the disambiguator
+        result_df = read_wiki(
+            self._cache_file, xml_file=self._xml_file, titles=keys, title_keys=True
+        )
+        self.assertEqual(result_df["title"].tolist(), ["title1"])
+
+    def test_read_wiki_arrow_1(self) -> None:
+        titles = ["title3", "title1", "unknown"]
+        expected_df = self._expected_df.iloc[[0, 2]]
+        results = [
+            read_wiki_arrow(self._cache_file, xml_file=self._xml_file, titles=titles),
+            read_wiki_arrow(batches=read_wiki_batches(self._xml_file), titles=titles),
+        ]
+        for frame in results:
+            # The memory mapped cache is only narrowed by a selection of its rows
+            self.assertEqual(frame.table.num_rows, 3)
+            assert_frame_equal(expected_df, frame.to_pandas().astype(object))
+
+
+class TestReadImdbMoviesMetadata1(unittest.TestCase):
+    """
+    Only the required columns are read and the numeric ones are coerced while parsing.
+    """
+
+    def setUp(self) -> None:
+        self._tmp_dir = tempfile.TemporaryDirectory()
+        self._csv_file = os.path.join(self._tmp_dir.name, "movies_metadata.csv")
+        pd.DataFrame(
+            {
+                "adult": ["False", "False"],
+                "budget": ["30000000", "/ff9qCepilowshEtG2GYWwzt2bs4.jpg"],
+                "original_title": ["title1", "title2"],
+                "overview": ["overview1", "overview2"],
+                "production_companies": ["[{'name': 'Pixar'}]", np.nan],
+                "release_date": ["1995-10-30", "1995-12-15"],
+                "revenue": ["373554033", ""],
+                "title": ["title1", "title2"],
+                "vote_average": ["7.7", "6.9"],
+            }
+        ).to_csv(self._csv_file, index=False)
+
+    def tearDown(self) -> None:
+        self._tmp_dir.cleanup()
+
+    def test_read_imdb_movies_metadata_1(self) -> None:
+        expected_df = pd.DataFrame(
+            {
+                "title": ["title1", "title2"],
+                "original_title": ["title1", "title2"],
+                "budget": [30000000.0, np.nan],
+                "revenue": [373554033.0, np.nan],
+                "release_date": ["1995-10-30", "1995-12-15"],
+                "vote_average": [7.7, 6.9],
+                "production_companies": ["[{'name': 'Pixar'}]", np.nan],
+            }
+        )
+        for engine in ["c", "pyarrow"]:
+            result_df = read_imdb_movies_metadata(self._csv_file, engine=engine)
+            assert_frame_equal(expected_df, result_df)
+
+    def test_read_imdb_movies_metadata_mixed_types_1(self) -> None:
+        """
+        A malformed row after the first chunks of the c parser doesn't change how the column is parsed
+        """
+        n_rows = 300_000
+        df = pd.read_csv(self._csv_file, dtype=str).iloc[[0] * n_rows]
+        df.iloc[-1, df.columns.get_loc("budget")] = "/ff9qCepilowshEtG2GYWwzt2bs4.jpg"
+        df.to_csv(self._csv_file, index=False)
+        with warnings.catch_warnings():
+            warnings.simplefilter("error", pd.errors.DtypeWarning)
+            result_df = read_imdb_movies_metadata(self._csv_file)
+        self.assertEqual(result_df["budget"].dtype, np.float64)
+        self.assertEqual(result_df["budget"].isna().sum(), 1)
+
+
+def suite() -> None:
+    """
+    Creates the test suites to be ran.
+    """
+    suite = unittest.TestSuite()
+    suite.addTest(TestReadWikiBatches1("test_iter_wiki_xml_1"))
+    suite.addTest(TestReadWikiBatches1("test_read_wiki_batches_1"))
+    suite.addTest(TestReadWikiBatches1("test_write_wiki_to_csv_1"))
+    suite.addTest(TestReadWikiBatches1("test_read_wiki_batches_gz_1"))
+    suite.addTest(TestReadWikiBatches1("test_read_wiki_batches_bz2_1"))
+    suite.addTest(TestReadWikiBatches1("test_read_wiki_cache_1"))
+    suite.addTest(TestReadWikiBatches1("test_read_wiki_cache_invalidation_1"))
+    suite.addTest(TestReadWikiBatches1("test_iter_wiki_cache_1"))
+    suite.addTest(TestReadWikiBatches1("test_iter_wiki_xml_sharded_1"))
+    suite.addTest(TestReadWikiBatches1("test_read_wiki_cache_workers_1"))
+    suite.addTest(TestReadWikiBatches1("test_read_wiki_titles_1"))
+    suite.addTest(TestReadWikiBatches1("test_read_wiki_title_keys_1"))
+    suite.addTest(TestReadWikiBatches1("test_read_wiki_arrow_1"))
+    suite.addTest(TestReadImdbMoviesMetadata1("test_read_imdb_movies_metadata_1"))
+    suite.addTest(
+        TestReadImdbMoviesMetadata1("test_read_imdb_movies_metadata_mixed_types_1")
+    )
+
+    return suite
+
+
+if __name__ == "__main__":
+    runner = unittest.TextTestRunner()
+    runner.run(suite())
@@ -0,0 +1,110 @@
+import unittest
+import numpy as np
+import pandas as pd
+from app import calculate_columns_ratio
+from frame_dtypes import memory_report, optimise_dtypes, parse_production_companies
+
+
+class TestOptimiseDtypes1(unittest.TestCase):
+    """
+    The columns get smaller dtypes and keep the same values.
+    """
+
+    def setUp(self) -> None:
+        companies = "[{'name': 'Pixar Animation Studios', 'id': 3}]"
+        self._df = pd.DataFrame(
+            {
+                "title": ["Toy Story", "Jumanji", "Heat", "Heat"],
+                "budget": [30000000.0, 65000000.0, 60000000.0, 1.0],
+                "revenue": [373554033.0, np.nan, 187436818.0, 12.0],
+                "vote_average": [7.7, 6.9, 7.7, 5.0],
+                "release_date": ["1995-10-30", "1995-12-15", "not a date", None],
+                "production_companies": [companies, companies, companies, "[]"],
+            }
+        )
+
+    def test_optimise_dtypes_1(self) -> None:
+        df_optimised = optimise_dtypes(self._df)
+        self.assertEqual(df_optimised["budget"].dtype, np.int32)
+        # nan can't be an integer, and float32 would round the revenues or the votes
+        self.assertEqual(df_optimised["revenue"].dtype, np.float64)
+        self.assertEqual(df_optimised["vote_average"].dtype, np.float64)
+        self.assertTrue(
+            pd.api.types.is_datetime64_any_dtype(df_optimised["release_date"])
+        )
+        self.assertEqual(df_optimised["release_date"].isna().sum(), 2)
+        self.assertEqual(df_optimised["production_companies"].dtype, "category")
+        # Too many distinct titles to gain anything with a categorical
+        self.assertEqual(df_optimised["title"].dtype, object)
+
+        np.testing.assert_array_equal(df_optimised["budget"], self._df["budget"])
+        pd.testing.assert_series_equal(
+            df_optimised["production_companies"].astype(object),
+            self._df["production_companies"],
+        )
+        # The input is left as it is
+        self.assertEqual(self._df["budget"].dtype, np.float64)
+
+    def test_memory_report_1(self) -> None:
+        df = pd.concat([self._df] * 100, ignore_index=True)
+        report = memory_report(df, optimise_dtypes(df), file_path=None)
+        self.assertEqual(report.loc["budget", "dtype_after"], "int32")
+        self.assertLess(
+            report.loc["production_companies", "bytes_after"],
+            report.loc["production_companies", "bytes_before"] / 10,
+        )
+        self.assertLess(
+            report.loc["total", "bytes_after"], report.loc["total", "bytes_before"]
+        )
+
+    def test_ratio_1(self) -> None:
+        # Same ratios on the optimised dtypes as on the original ones
+        df_ratio = calculate_columns_ratio(self._df.copy())
+        df_optimised_ratio = calculate_columns_ratio(optimise_dtypes(self._df))
+        pd.testing.assert_series_equal(df_optimised_ratio["ratio"], df_ratio["ratio"])
+
+
+class TestParseProductionCompanies1(unittest.TestCase):
+    """
+    The company names are parsed out of the raw strings, the invalid ones give no company.
+    """
+
+    def test_parse_production_companies_1(self) -> None:
+        values = pd.Series(
+            [
+                "[{'name': 'Pixar Animation Studios', 'id': 3}]",
+                "[{'name': 'TriStar Pictures', 'id': 559}, {'name': 'Teitler Film', 'id': 2550}]",
+                "[]",
+                "False",
+                None,
+            ]
+        )
+        expected = [
+            ["Pixar Animation Studios"],
+            ["TriStar Pictures", "Teitler Film"],
+            [],
+            [],
+            [],
+        ]
+        self.assertEqual(parse_production_companies(values).tolist(), expected)
+        self.assertEqual(
+            parse_production_companies(values.astype("category")).tolist(), expected
+        )
+
+
+def suite() -> None:
+    """
+    Creates the test suites to be ran.
+    """
+    suite = unittest.TestSuite()
+    suite.addTest(TestOptimiseDtypes1("test_optimise_dtypes_1"))
+    suite.addTest(TestOptimiseDtypes1("test_memory_report_1"))
+    suite.addTest(TestOptimiseDtypes1("test_ratio_1"))
+    suite.addTest(TestParseProductionCompanies1("test_parse_production_companies_1"))
+
+    return suite
+
+
+if __name__ == "__main__":
+    runner = unittest.TextTestRunner()
+    runner.run(suite())
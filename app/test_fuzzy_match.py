@@ -0,0 +1,158 @@
+import unittest
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+from app import merge_imdb_and_wiki, run_process
+from fuzzy_match import (
+    MAX_BLOCK_SIZE,
+    comparison_key,
+    fill_unmatched_urls,
+    fuzzy_match_titles,
+    score_pairs,
+    wiki_title_years,
+)
+
+
+class TestFuzzyMatchTitles1(unittest.TestCase):
+    """
+    Each imdb title gets its closest wiki title among the ones sharing a rare word and a compatible year.
+    """
+
+    def setUp(self) -> None:
+        self._imdb_titles = pd.Series(
+            [
+                "Heat",
+                "Mr. Smith Goes to Washington",
+                "The Matrix",
+                "Toy Story",
+                None,
+                "Amélie",
+                "Vertigo",
+            ]
+        )
+        self._imdb_years = np.array([1995, 1939, 1999, 1995, np.nan, 2001, 1958])
+        self._wiki_titles = pa.array(
+            [
+                "Heat (1995 film)",
+                "Heat (1986 film)",
+                "Mr Smith Goes to Washington!",
+                "The Matrixx",
+                "Toy Story 2",
+                "Amélie.",
+                "Vertigo (1931 film)",
+                None,
+            ]
+        )
+
+    def test_comparison_key_1(self) -> None:
+        self.assertEqual(
+            comparison_key(self._imdb_titles).to_pylist(),
+            [
+                "heat",
+                "mr smith goes to washington",
+                "the matrix",
+                "toy story",
+                None,
+                "amélie",
+                "vertigo",
+            ],
+        )
+        self.assertEqual(
+            comparison_key(pa.array(["Heat (1995 film)", " !? "]), True).to_pylist(),
+            ["heat", None],
+        )
+
+    def test_wiki_title_years_1(self) -> None:
+        np.testing.assert_array_equal(
+            wiki_title_years(self._wiki_titles),
+            [1995, 1986, np.nan, np.nan, np.nan, np.nan, 1931, np.nan],
+        )
+
+    def test_fuzzy_match_titles_1(self) -> None:
+        positions = fuzzy_match_titles(
+            comparison_key(self._imdb_titles),
+            self._imdb_years,
+            comparison_key(self._wiki_titles, strip_disambiguator=True),
+            wiki_title_years(self._wiki_titles),
+        )
+        # Toy Story 2 is another film, and the 1931 Vertigo page is not the 1958 film
+        np.testing.assert_array_equal(positions, [0, 2, 3, -1, -1, 5, -1])
+
+    def test_common_tokens_1(self) -> None:
+        # A word of too many wiki titles doesn't block, the titles made only of such words are not matched
+        wiki_titles = pa.array(["Love Story"] + ["Love"] * MAX_BLOCK_SIZE)
+        positions = fuzzy_match_titles(
+            comparison_key(pd.Series(["Love", "Love Story!"])),
+            np.array([np.nan, np.nan]),
+            comparison_key(wiki_titles),
+            wiki_title_years(wiki_titles),
+        )
+        np.testing.assert_array_equal(positions, [-1, 0])
+
+    def test_score_pairs_workers_1(self) -> None:
+        imdb_keys = np.array(["heat", "the matrix", "toy story"], dtype=object)
+        wiki_keys = np.array(["heat", "the matrixx", "toy story 2"], dtype=object)
+        scores = score_pairs(imdb_keys, wiki_keys)
+        self.assertEqual(scores[0], 1.0)
+        self.assertGreater(scores[1], 0.9)
+        self.assertEqual(scores[2], 0.0)
+        np.testing.assert_array_equal(
+            score_pairs(imdb_keys, wiki_keys, workers=2, chunk_size=1), scores
+        )
+
+
+class TestFillUnmatchedUrls1(unittest.TestCase):
+    """
+    The fuzzy matching only fills the urls the exact merge left missing.
+    """
+
+    def test_fill_unmatched_urls_1(self) -> None:
+        df_imdb = pd.DataFrame(
+            {
+                "title": ["Heat", "Toy Story", "Le Fabuleux Destin"],
+                "original_title": ["Heat", "Toy Story", "Amélie"],
+                "release_date": ["1995-12-15", "1995-10-30", "2001-04-25"],
+            }
+        )
+        df_wiki = pd.DataFrame(
+            {
+                "title": ["Heat (1995 film)", "Toy Story", "Amélie!"],
+                "url": ["url_heat", "url_toy_story", "url_amelie"],
+            }
+        )
+        df_joined = merge_imdb_and_wiki(df_imdb, df_wiki)
+        self.assertEqual(df_joined["url"].notna().sum(), 1)
+
+        df_filled = fill_unmatched_urls(df_joined, df_wiki)
+        self.assertEqual(
+            df_filled["url"].tolist(), ["url_heat", "url_toy_story", "url_amelie"]
+        )
+        pd.testing.assert_frame_equal(
+            df_filled.drop(columns=["url"]), df_joined.drop(columns=["url"])
+        )
+
+    def test_run_process_1(self) -> None:
+        # The semi-join only keeps the exact matches, there would be nothing left to fuzzy match
+        with self.assertRaises(ValueError):
+            run_process(fuzzy_titles=True, semi_join=True)
+
+
+def suite() -> None:
+    """
+    Creates the test suites to be ran.
+    """
+    suite = unittest.TestSuite()
+    suite.addTest(TestFuzzyMatchTitles1("test_comparison_key_1"))
+    suite.addTest(TestFuzzyMatchTitles1("test_wiki_title_years_1"))
+    suite.addTest(TestFuzzyMatchTitles1("test_fuzzy_match_titles_1"))
+    suite.addTest(TestFuzzyMatchTitles1("test_common_tokens_1"))
+    suite.addTest(TestFuzzyMatchTitles1("test_score_pairs_workers_1"))
+    suite.addTest(TestFillUnmatchedUrls1("test_fill_unmatched_urls_1"))
+    suite.addTest(TestFillUnmatchedUrls1("test_run_process_1"))
+
+    return suite
+
+
+if __name__ == "__main__":
+    runner = unittest.TextTestRunner()
+    runner.run(suite())
@@ -0,0 +1,97 @@
+import json
+import os
+import tempfile
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+import pandas as pd
+from dataset_cleaner import DatasetCleaner
+from instrumentation import finish_run, measure, stage, start_run
+
+
+class TestRunReport1(unittest.TestCase):
+    """
+    The stages of an active run are recorded with their rows, nested stages are named parent/child and repeated
+    stages are aggregated.
+    """
+
+    def setUp(self) -> None:
+        self._tmp_dir = tempfile.TemporaryDirectory()
+        self._run_report = start_run()
+
+    def tearDown(self) -> None:
+        finish_run()
+        self._tmp_dir.cleanup()
+
+    def test_stages_1(self) -> None:
+        df = pd.DataFrame({"budget": [1.0, None, 3.0]})
+        with stage("imdb"):
+            measure("preproc", lambda df: df.dropna(), df)
+        report = finish_run()
+        self.assertEqual(list(report["stages"]), ["imdb/preproc", "imdb"])
+        preproc = report["stages"]["imdb/preproc"]
+        self.assertEqual((preproc["rows_in"], preproc["rows_out"]), (3, 2))
+        self.assertEqual(preproc["calls"], 1)
+        self.assertGreaterEqual(report["stages"]["imdb"]["wall_s"], preproc["wall_s"])
+        self.assertGreater(preproc["peak_rss_mb"], 0)
+
+    def test_cleaner_rules_1(self) -> None:
+        batches = [
+            pd.DataFrame({"title": ["title1", None]}),
+            pd.DataFrame({"title": [None, "title2", "title3"]}),
+        ]
+        dataset_cleaner = DatasetCleaner(batches)
+        dataset_cleaner.check_missing_values(["title"])
+        with stage("wiki"):
+            dataset_cleaner.get_cleaned_dataframe()
+        rule = finish_run()["stages"]["wiki/no_missing_title"]
+        self.assertEqual(rule["calls"], 2)
+        self.assertEqual((rule["rows_in"], rule["rows_out"]), (5, 3))
+
+    def test_threads_1(self) -> None:
+        """
+        Stages running at the same time in two threads are nested in their own thread only
+        """
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            with stage("imdb"):
+                future = executor.submit(measure, "wiki", lambda: pd.DataFrame())
+                with stage("read"):
+                    future.result()
+        report = finish_run()
+        self.assertEqual(sorted(report["stages"]), ["imdb", "imdb/read", "wiki"])
+
+    def test_write_json_1(self) -> None:
+        with stage("upload") as record:
+            record.skipped = True
+        finish_run()
+        report_file = os.path.join(self._tmp_dir.name, "report.json")
+        self._run_report.write_json(report_file)
+        with open(report_file) as f:
+            report = json.load(f)
+        self.assertEqual(report["run_id"], self._run_report.run_id)
+        self.assertTrue(report["stages"]["upload"]["skipped"])
+
+    def test_no_active_run_1(self) -> None:
+        finish_run()
+        with stage("imdb"):
+            pass
+        self.assertEqual(self._run_report.stages, {})
+        self.assertIsNone(finish_run())
+
+
+def suite() -> None:
+    """
+    Creates the test suites to be ran.
+    """
+    suite = unittest.TestSuite()
+    suite.addTest(TestRunReport1("test_stages_1"))
+    suite.addTest(TestRunReport1("test_cleaner_rules_1"))
+    suite.addTest(TestRunReport1("test_threads_1"))
+    suite.addTest(TestRunReport1("test_write_json_1"))
+    suite.addTest(TestRunReport1("test_no_active_run_1"))
+
+    return suite
+
+
+if __name__ == "__main__":
+    runner = unittest.TextTestRunner()
+    runner.run(suite())
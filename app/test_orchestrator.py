@@ -1,21 +1,115 @@
+import json
+import os
+import sys
 import test_dataset_cleaner
 import test_app
+import test_db_loader
+import test_files_handler
+import test_stage_cache
+import test_top_k
+import test_instrumentation
+import test_synthetic_data
+import test_title_keys
+import test_frame_dtypes
+import test_fuzzy_match
+import test_stage_runner
+import test_arrow_frames
+import test_profiler
 import unittest
+from benchmark import (
+    BENCHMARK_BASELINE_FILE,
+    BENCHMARK_DATA_DIR,
+    BENCHMARK_TOLERANCE,
+    FAST_BENCHMARK_REPEAT,
+    FAST_BENCHMARK_SCALES,
+    compare_to_baseline,
+    run_benchmarks,
+)
 
 
-def run_tests() -> None:
+def run_tests() -> bool:
     """
     Orchestrates all the tests
+
+    returns: True when all the tests passed
     """
     tests = {
         "test_dataset_cleaner": test_dataset_cleaner.suite,
         "test_app": test_app.suite,
+        "test_files_handler": test_files_handler.suite,
+        "test_db_loader": test_db_loader.suite,
+        "test_stage_cache": test_stage_cache.suite,
+        "test_top_k": test_top_k.suite,
+        "test_instrumentation": test_instrumentation.suite,
+        "test_synthetic_data": test_synthetic_data.suite,
+        "test_title_keys": test_title_keys.suite,
+        "test_frame_dtypes": test_frame_dtypes.suite,
+        "test_fuzzy_match": test_fuzzy_match.suite,
+        "test_stage_runner": test_stage_runner.suite,
+        "test_arrow_frames": test_arrow_frames.suite,
+        "test_profiler": test_profiler.suite,
     }
     runner = unittest.TextTestRunner()
+    successful = True
     for test in tests:
         print(test)
-        runner.run(tests[test]())
+        successful = runner.run(tests[test]()).wasSuccessful() and successful
+    return successful
+
+
+def run_benchmark_gate(
+    baseline_file: str = BENCHMARK_BASELINE_FILE,
+    tolerance: float = BENCHMARK_TOLERANCE,
+    update_baseline: bool = False,
+) -> bool:
+    """
+    Runs the fast benchmark tier and compares the throughput and peak memory of every step to the baseline file.
+    With update_baseline, the results become the new baseline instead.
+
+    returns: False when a step regressed by more than tolerance, or when there is no baseline to compare to
+    """
+    print("benchmark_gate")
+    if not update_baseline and not os.path.exists(baseline_file):
+        print(
+            f"No benchmark baseline at {baseline_file}, write it with BENCHMARK_UPDATE_BASELINE=1 "
+            "(make test_benchmark_baseline)"
+        )
+        return False
+    results = run_benchmarks(
+        FAST_BENCHMARK_SCALES,
+        BENCHMARK_DATA_DIR,
+        output_file=None,
+        repeat=FAST_BENCHMARK_REPEAT,
+    )
+    if update_baseline:
+        os.makedirs(os.path.dirname(baseline_file) or ".", exist_ok=True)
+        with open(baseline_file, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"Benchmark baseline written to {baseline_file}")
+        return True
+
+    with open(baseline_file) as f:
+        baseline = json.load(f)
+    regressions = compare_to_baseline(results, baseline, tolerance)
+    for regression in regressions:
+        print(f"Performance regression: {regression}")
+    if not regressions:
+        print(f"No step regressed by more than {tolerance:.0%}")
+    return not regressions
 
 
 if __name__ == "__main__":
-    run_tests()
+    # BENCHMARK_GATE=1 also runs the benchmark regression gate, BENCHMARK_TOLERANCE (e.g. 0.3) sets how much slower
+    # or bigger a step can get and BENCHMARK_UPDATE_BASELINE=1 stores the results as the new baseline. The gate fails
+    # when BENCHMARK_BASELINE_FILE doesn't exist, make test_benchmark mounts it from data_benchmark/
+    successful = run_tests()
+    if os.environ.get("BENCHMARK_GATE") == "1":
+        successful = (
+            run_benchmark_gate(
+                os.environ.get("BENCHMARK_BASELINE_FILE", BENCHMARK_BASELINE_FILE),
+                float(os.environ.get("BENCHMARK_TOLERANCE", BENCHMARK_TOLERANCE)),
+                os.environ.get("BENCHMARK_UPDATE_BASELINE") == "1",
+            )
+            and successful
+        )
+    sys.exit(0 if successful else 1)
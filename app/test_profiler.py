@@ -0,0 +1,141 @@
+import glob
+import os
+import tempfile
+import time
+import unittest
+import xml.etree.ElementTree as ElementTree
+import numpy as np
+from instrumentation import finish_run, stage, start_run
+from profiler import SamplingProfiler, profile_run, write_flamegraph
+
+
+def _busy_loop(seconds: float) -> int:
+    total = 0
+    end = time.perf_counter() + seconds
+    while time.perf_counter() < end:
+        total += 1
+    return total
+
+
+class TestSamplingProfiler1(unittest.TestCase):
+    """
+    The sampled stacks start with the stage open in their thread, and only the selected stages are sampled.
+    """
+
+    def setUp(self) -> None:
+        start_run()
+
+    def tearDown(self) -> None:
+        finish_run()
+
+    def test_cpu_1(self) -> None:
+        profiler = SamplingProfiler("cpu", interval=0.001)
+        profiler.start()
+        with stage("imdb"):
+            with stage("read"):
+                _busy_loop(0.2)
+        profiler.stop()
+        stacks = profiler.collapsed_stacks()
+        busy = [stack for stack in stacks if "_busy_loop (test_profiler.py" in stack]
+        self.assertTrue(busy)
+        self.assertTrue(all(stack.startswith("[imdb/read];") for stack in busy))
+        self.assertGreater(profiler.samples, 0)
+
+    def test_stages_1(self) -> None:
+        profiler = SamplingProfiler("cpu", stages=["merge"], interval=0.001)
+        profiler.start()
+        with stage("wiki"):
+            _busy_loop(0.1)
+        with stage("result"):
+            with stage("merge"):
+                _busy_loop(0.1)
+        profiler.stop()
+        roots = {stack.split(";")[0] for stack in profiler.collapsed_stacks()}
+        self.assertEqual(roots, {"[result/merge]"})
+
+    def test_alloc_1(self) -> None:
+        profiler = SamplingProfiler("alloc", interval=0.001)
+        profiler.start()
+        with stage("wiki"):
+            values = np.ones(8 * 1024**2)
+            time.sleep(0.1)
+        profiler.stop()
+        stacks = profiler.collapsed_stacks()
+        allocated = sum(
+            size for stack, size in stacks.items() if "test_profiler.py" in stack
+        )
+        # The 64 MB array is alive at the peak
+        self.assertGreaterEqual(allocated, values.nbytes // 1024)
+        self.assertTrue(all(stack.startswith("[peak ") for stack in stacks))
+        self.assertTrue(all(" in wiki]" in stack.split(";")[0] for stack in stacks))
+
+    def test_mode_1(self) -> None:
+        with self.assertRaises(ValueError):
+            SamplingProfiler("wall")
+
+
+class TestProfileRun1(unittest.TestCase):
+    """
+    profile_run writes the collapsed stacks and the flamegraph of the block, and nothing without a mode.
+    """
+
+    def setUp(self) -> None:
+        self._tmp_dir = tempfile.TemporaryDirectory()
+        self._file_prefix = os.path.join(self._tmp_dir.name, "logs_profile")
+
+    def tearDown(self) -> None:
+        self._tmp_dir.cleanup()
+
+    def test_profile_run_1(self) -> None:
+        with profile_run(None, file_prefix=self._file_prefix) as profiler:
+            self.assertIsNone(profiler)
+        self.assertEqual(os.listdir(self._tmp_dir.name), [])
+
+        with profile_run("cpu", file_prefix=self._file_prefix):
+            _busy_loop(0.1)
+        files = sorted(glob.glob(f"{self._file_prefix}_*_cpu.*"))
+        self.assertEqual(
+            [os.path.splitext(f)[1] for f in files], [".collapsed", ".svg"]
+        )
+        with open(files[0]) as f:
+            lines = f.read().splitlines()
+        self.assertTrue(lines)
+        self.assertTrue(all(line.rsplit(" ", 1)[1].isdigit() for line in lines))
+        ElementTree.parse(files[1])
+
+    def test_flamegraph_1(self) -> None:
+        svg_file = f"{self._file_prefix}.svg"
+        write_flamegraph(
+            {"[wiki];read;parse": 3, "[wiki];read": 1, "[imdb];<lambda>": 4},
+            svg_file,
+            title="cpu profile",
+        )
+        titles = [
+            element.text
+            for element in ElementTree.parse(svg_file).iter(
+                "{http://www.w3.org/2000/svg}title"
+            )
+        ]
+        self.assertIn("[wiki] (4 samples, 50.00%)", titles)
+        self.assertIn("parse (3 samples, 37.50%)", titles)
+        self.assertIn("<lambda> (4 samples, 50.00%)", titles)
+
+
+def suite() -> None:
+    """
+    Creates the test suites to be ran.
+    """
+    suite = unittest.TestSuite()
+    suite.addTest(TestSamplingProfiler1("test_cpu_1"))
+    suite.addTest(TestSamplingProfiler1("test_stages_1"))
+    suite.addTest(TestSamplingProfiler1("test_alloc_1"))
+    suite.addTest(TestSamplingProfiler1("test_mode_1"))
+    suite.addTest(TestProfileRun1("test_profile_run_1"))
+    suite.addTest(TestProfileRun1("test_flamegraph_1"))
+
+    return suite
+
+
+if __name__ == "__main__":
+    runner = unittest.TextTestRunner()
+    runner.run(suite())
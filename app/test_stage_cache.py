@@ -0,0 +1,127 @@
+import importlib
+import os
+import sys
+import tempfile
+import unittest
+import pandas as pd
+from pandas.testing import assert_frame_equal
+from stage_cache import StageCache, code_fingerprint, file_fingerprint
+
+
+class TestStageCache1(unittest.TestCase):
+    """
+    A stage runs once for the same inputs, and again when they change.
+    """
+
+    def setUp(self) -> None:
+        self._tmp_dir = tempfile.TemporaryDirectory()
+        self._cache_dir = os.path.join(self._tmp_dir.name, "cache")
+        self._input_file = os.path.join(self._tmp_dir.name, "input.csv")
+        with open(self._input_file, "w") as f:
+            f.write("title\ntitle1\n")
+        self._calls = 0
+        # Filtered dataframe, the index must survive the round trip to the cache
+        self._expected_df = pd.DataFrame(
+            {"title": ["title1", "title2"], "ratio": [1.5, 2.0]}, index=[3, 7]
+        )
+
+    def tearDown(self) -> None:
+        self._tmp_dir.cleanup()
+
+    def _stage(self) -> pd.DataFrame:
+        self._calls += 1
+        return self._expected_df
+
+    def _run(self, force: bool = False) -> pd.DataFrame:
+        stage_cache = StageCache(self._cache_dir, force=force)
+        inputs = {"file": file_fingerprint(self._input_file, content_hash=True)}
+        return stage_cache.run("stage", inputs, self._stage)
+
+    def test_run_1(self) -> None:
+        assert_frame_equal(self._run(), self._expected_df)
+        assert_frame_equal(self._run(), self._expected_df)
+        self.assertEqual(self._calls, 1)
+
+    def test_run_changed_inputs_1(self) -> None:
+        self._run()
+        with open(self._input_file, "w") as f:
+            f.write("title\ntitle2\n")
+        self._run()
+        self.assertEqual(self._calls, 2)
+        self._run(force=True)
+        self.assertEqual(self._calls, 3)
+
+    def test_run_forced_stage_1(self) -> None:
+        # A single stage can be forced, e.g. the upload when the table was dropped
+        stage_cache = StageCache(self._cache_dir)
+        stage_cache.run("stage", {}, self._stage)
+        stage_cache.run("stage", {}, self._stage)
+        self.assertEqual(self._calls, 1)
+        assert_frame_equal(
+            stage_cache.run("stage", {}, self._stage, force=True), self._expected_df
+        )
+        self.assertEqual(self._calls, 2)
+
+    def test_run_without_cache_1(self) -> None:
+        stage_cache = StageCache(None)
+        stage_cache.run("stage", {}, self._stage)
+        stage_cache.run("stage", {}, self._stage)
+        self.assertEqual(self._calls, 2)
+
+
+class TestCodeFingerprint1(unittest.TestCase):
+    """
+    Changing the source of a module invalidates the stage depending on it.
+    """
+
+    def setUp(self) -> None:
+        self._tmp_dir = tempfile.TemporaryDirectory()
+        self._module_file = os.path.join(self._tmp_dir.name, "stage_module.py")
+        self._write_module("def select(df):\n    return df.head(1)\n")
+        sys.path.insert(0, self._tmp_dir.name)
+        self._module = importlib.import_module("stage_module")
+        self._calls = 0
+
+    def tearDown(self) -> None:
+        sys.path.remove(self._tmp_dir.name)
+        sys.modules.pop("stage_module", None)
+        self._tmp_dir.cleanup()
+
+    def _write_module(self, source: str) -> None:
+        with open(self._module_file, "w") as f:
+            f.write(source)
+
+    def _stage(self) -> pd.DataFrame:
+        self._calls += 1
+        return pd.DataFrame({"title": ["title1"]})
+
+    def _run(self) -> None:
+        stage_cache = StageCache(os.path.join(self._tmp_dir.name, "cache"))
+        stage_cache.run("stage", {"code": code_fingerprint(self._module)}, self._stage)
+
+    def test_code_fingerprint_1(self) -> None:
+        self._run()
+        self._run()
+        self.assertEqual(self._calls, 1)
+        self._write_module("def select(df):\n    return df.head(2)\n")
+        self._run()
+        self.assertEqual(self._calls, 2)
+
+
+def suite() -> None:
+    """
+    Creates the test suites to be ran.
+    """
+    suite = unittest.TestSuite()
+    suite.addTest(TestStageCache1("test_run_1"))
+    suite.addTest(TestStageCache1("test_run_changed_inputs_1"))
+    suite.addTest(TestStageCache1("test_run_forced_stage_1"))
+    suite.addTest(TestStageCache1("test_run_without_cache_1"))
+    suite.addTest(TestCodeFingerprint1("test_code_fingerprint_1"))
+
+    return suite
+
+
+if __name__ == "__main__":
+    runner = unittest.TextTestRunner()
+    runner.run(suite())
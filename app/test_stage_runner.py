@@ -0,0 +1,196 @@
+import os
+import tempfile
+import unittest
+import pandas as pd
+from pandas.testing import assert_frame_equal
+from stage_cache import StageCache
+from stage_runner import PipelineStage, run_stages
+from synthetic_data import generate_datasets
+from top_k import TOP_COLUMN
+
+
+class TestRunStages1(unittest.TestCase):
+    """
+    The stages run as a range from their checkpoints, and a failed run resumes from the stage that failed.
+    """
+
+    def setUp(self) -> None:
+        self._tmp_dir = tempfile.TemporaryDirectory()
+        self._checkpoint_dir = os.path.join(self._tmp_dir.name, "checkpoints")
+        self._source_file = os.path.join(self._tmp_dir.name, "source")
+        with open(self._source_file, "w") as f:
+            f.write("1")
+        self._calls = []
+        self._uploaded = []
+        self._fail_at = None
+        self._stages = {
+            "read": PipelineStage([], ["values"], self._read, self._source),
+            "double": PipelineStage(
+                ["values"], ["values"], self._double, options=["factor"]
+            ),
+            "total": PipelineStage(["values"], ["total"], self._total),
+            "upload": PipelineStage(["total"], [], self._upload),
+        }
+
+    def tearDown(self) -> None:
+        self._tmp_dir.cleanup()
+
+    def _source(self, options: dict) -> dict:
+        with open(self._source_file) as f:
+            return {"content": f.read()}
+
+    def _call(self, name: str) -> None:
+        self._calls.append(name)
+        if name == self._fail_at:
+            raise RuntimeError(f"{name} failed")
+
+    def _read(self, frames: dict, options: dict) -> dict:
+        self._call("read")
+        with open(self._source_file) as f:
+            value = int(f.read())
+        return {"values": pd.DataFrame({"value": [value, value + 1]}, index=[5, 6])}
+
+    def _double(self, frames: dict, options: dict) -> dict:
+        self._call("double")
+        return {"values": frames["values"] * options["factor"]}
+
+    def _total(self, frames: dict, options: dict) -> dict:
+        self._call("total")
+        return {"total": frames["values"].sum().to_frame("total")}
+
+    def _upload(self, frames: dict, options: dict) -> dict:
+        self._call("upload")
+        self._uploaded.append(frames["total"]["total"].iloc[0])
+        return {}
+
+    def _run(self, first: str = "read", last: str = "upload", **kwargs) -> None:
+        options = {"factor": 2}
+        options.update(kwargs.pop("options", {}))
+        run_stages(
+            first,
+            last,
+            self._checkpoint_dir,
+            report_file=None,
+            stages=self._stages,
+            **kwargs,
+            **options,
+        )
+
+    def test_run_stages_1(self) -> None:
+        self._run()
+        self.assertEqual(self._calls, ["read", "double", "total", "upload"])
+        self.assertEqual(self._uploaded, [6])
+        # Without resume every stage of the range runs again
+        self._run(first="double", last="total")
+        self.assertEqual(self._calls[4:], ["double", "total"])
+
+    def test_upload_only_1(self) -> None:
+        self._run(last="total")
+        self._run(first="upload", last="upload")
+        self.assertEqual(self._calls, ["read", "double", "total", "upload"])
+        self.assertEqual(self._uploaded, [6])
+
+    def test_resume_1(self) -> None:
+        self._fail_at = "total"
+        with self.assertRaises(RuntimeError):
+            self._run()
+        self._fail_at = None
+        self._run(resume=True)
+        # read and double are checkpointed, total loads the doubled values from the checkpoint
+        self.assertEqual(self._calls, ["read", "double", "total", "total", "upload"])
+        self.assertEqual(self._uploaded, [6])
+
+        # Nothing left to do, unless an option or a source file changes
+        self._run(resume=True)
+        self.assertEqual(len(self._calls), 5)
+        self._run(resume=True, options={"factor": 3})
+        self.assertEqual(self._calls[5:], ["double", "total", "upload"])
+        with open(self._source_file, "w") as f:
+            f.write("2")
+        self._run(resume=True, options={"factor": 3})
+        self.assertEqual(self._calls[8:], ["read", "double", "total", "upload"])
+        self.assertEqual(self._uploaded, [6, 9, 15])
+
+    def test_checkpoint_index_1(self) -> None:
+        # The filtered frames keep their index through the checkpoints
+        self._run(last="double")
+        loaded = []
+        self._stages["total"] = PipelineStage(
+            ["values"],
+            ["total"],
+            lambda frames, options: loaded.append(frames["values"])
+            or {"total": frames["values"]},
+        )
+        self._run(first="total", last="total")
+        assert_frame_equal(loaded[0], pd.DataFrame({"value": [2, 4]}, index=[5, 6]))
+
+    def test_missing_checkpoint_1(self) -> None:
+        with self.assertRaises(FileNotFoundError):
+            self._run(first="upload")
+
+
+class TestPipelineStages1(unittest.TestCase):
+    """
+    The stages of the pipeline run from the files up to the top k, with the wiki dataset read from the cache or
+    streamed from the xml.
+    """
+
+    def setUp(self) -> None:
+        self._tmp_dir = tempfile.TemporaryDirectory()
+        self._imdb_file, self._xml_file = generate_datasets(self._tmp_dir.name, 2000)
+        # The cleaner logs and the memory report are written to the working directory
+        self._cwd = os.getcwd()
+        os.chdir(self._tmp_dir.name)
+
+    def tearDown(self) -> None:
+        os.chdir(self._cwd)
+        self._tmp_dir.cleanup()
+
+    def _run(self, checkpoint_dir: str, wiki_from_xml: bool) -> pd.DataFrame:
+        checkpoint_dir = os.path.join(self._tmp_dir.name, checkpoint_dir)
+        run_stages(
+            "read_imdb",
+            "topk",
+            checkpoint_dir,
+            report_file=None,
+            imdb_file=self._imdb_file,
+            wiki_xml_file=self._xml_file,
+            wiki_cache_file=os.path.join(self._tmp_dir.name, "wiki_data.feather"),
+            wiki_from_xml=wiki_from_xml,
+            normalise_titles=False,
+            strip_disambiguators=False,
+            fuzzy_titles=False,
+            fuzzy_workers=1,
+            optimise_frame_dtypes=True,
+            top_n=10,
+            sort_column=TOP_COLUMN,
+            upload_partitions=1,
+            arrow_wiki=False,
+        )
+        return StageCache(checkpoint_dir).load("topk.result")
+
+    def test_wiki_from_xml_1(self) -> None:
+        df_result = self._run("checkpoints_xml", wiki_from_xml=True)
+        self.assertEqual(len(df_result), 10)
+        self.assertGreater(df_result["url"].notna().sum(), 0)
+        assert_frame_equal(df_result, self._run("checkpoints_cache", False))
+
+
+def suite() -> None:
+    """
+    Creates the test suites to be ran.
+    """
+    suite = unittest.TestSuite()
+    suite.addTest(TestRunStages1("test_run_stages_1"))
+    suite.addTest(TestRunStages1("test_upload_only_1"))
+    suite.addTest(TestRunStages1("test_resume_1"))
+    suite.addTest(TestRunStages1("test_checkpoint_index_1"))
+    suite.addTest(TestRunStages1("test_missing_checkpoint_1"))
+    suite.addTest(TestPipelineStages1("test_wiki_from_xml_1"))
+
+    return suite
+
+
+if __name__ == "__main__":
+    runner = unittest.TextTestRunner()
+    runner.run(suite())
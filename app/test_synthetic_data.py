@@ -0,0 +1,119 @@
+import os
+import tempfile
+import unittest
+import pandas as pd
+from app import merge_imdb_and_wiki
+from benchmark import benchmark_scale, compare_to_baseline
+from files_handler import read_imdb_movies_metadata, read_wiki_batches
+from synthetic_data import (
+    WIKI_DISAMBIGUATED_RATE,
+    WIKI_OVERLAP_RATE,
+    WIKI_VARIANT_RATE,
+    ZERO_BUDGET_RATE,
+    generate_datasets,
+    generate_imdb_metadata,
+    imdb_rows_for_scale,
+)
+
+
+class TestSyntheticData1(unittest.TestCase):
+    """
+    The synthetic files are read by the pipeline readers and keep the rates of the real datasets.
+    """
+
+    def setUp(self) -> None:
+        self._tmp_dir = tempfile.TemporaryDirectory()
+        self._n_docs = 20_000
+        self._csv_file, self._xml_file = generate_datasets(
+            self._tmp_dir.name, self._n_docs
+        )
+
+    def tearDown(self) -> None:
+        self._tmp_dir.cleanup()
+
+    def test_imdb_1(self) -> None:
+        df_imdb = read_imdb_movies_metadata(self._csv_file)
+        self.assertEqual(len(df_imdb), imdb_rows_for_scale(self._n_docs))
+        self.assertAlmostEqual((df_imdb["budget"] == 0).mean(), ZERO_BUDGET_RATE, 1)
+
+    def test_wiki_1(self) -> None:
+        df_wiki = pd.concat(read_wiki_batches(self._xml_file))
+        self.assertEqual(len(df_wiki), self._n_docs)
+        # The "Wikipedia: " prefix was in the dump and is removed by the reader
+        self.assertFalse(df_wiki["title"].str.startswith("Wikipedia").any())
+
+        df_imdb = read_imdb_movies_metadata(self._csv_file).dropna(
+            subset=["original_title"]
+        )
+        df_joined = merge_imdb_and_wiki(df_imdb, df_wiki)
+        match_rate = df_joined["url"].notna().mean()
+        expected_rate = (
+            WIKI_OVERLAP_RATE * (1 - WIKI_DISAMBIGUATED_RATE) * (1 - WIKI_VARIANT_RATE)
+        )
+        self.assertAlmostEqual(match_rate, expected_rate, delta=0.1)
+
+    def test_same_seed_1(self) -> None:
+        pd.testing.assert_frame_equal(
+            generate_imdb_metadata(100, seed=1), generate_imdb_metadata(100, seed=1)
+        )
+
+    def test_benchmark_scale_1(self) -> None:
+        results = benchmark_scale(self._n_docs, self._tmp_dir.name)
+        for step in ["write_wiki_to_csv", "read_wiki", "clean_imdb", "merge", "ratio"]:
+            self.assertGreater(results[step]["rows_per_s"], 0)
+        self.assertEqual(results["read_wiki"]["rows"], self._n_docs)
+        self.assertTrue(
+            os.path.exists(
+                os.path.join(
+                    self._tmp_dir.name,
+                    f"run_{self._n_docs}_0",
+                    "logs_dataset_cleaner_result_imdb.csv",
+                )
+            )
+        )
+
+
+class TestCompareToBaseline1(unittest.TestCase):
+    """
+    Only the steps slower or bigger than the baseline by more than the tolerance are reported.
+    """
+
+    @staticmethod
+    def _results(rows_per_s: float, peak_rss_mb: float, wall_s: float = 1.0) -> dict:
+        step = {"wall_s": wall_s, "rows_per_s": rows_per_s, "peak_rss_mb": peak_rss_mb}
+        return {"100000": {"merge": step}}
+
+    def test_compare_to_baseline_1(self) -> None:
+        baseline = self._results(1000, 100)
+        self.assertEqual(
+            compare_to_baseline(self._results(800, 120), baseline, 0.3), []
+        )
+        regressions = compare_to_baseline(self._results(600, 140), baseline, 0.3)
+        self.assertEqual(len(regressions), 2)
+        self.assertIn("merge", regressions[0])
+
+    def test_compare_to_baseline_noise_1(self) -> None:
+        # Too fast in the baseline to be compared, and steps missing from the baseline are ignored
+        baseline = self._results(1000, 100, wall_s=0.001)
+        self.assertEqual(compare_to_baseline(self._results(10, 1000), baseline), [])
+        self.assertEqual(compare_to_baseline(self._results(10, 1000), {}), [])
+
+
+def suite() -> None:
+    """
+    Creates the test suites to be ran.
+    """
+    suite = unittest.TestSuite()
+    suite.addTest(TestSyntheticData1("test_imdb_1"))
+    suite.addTest(TestSyntheticData1("test_wiki_1"))
+    suite.addTest(TestSyntheticData1("test_same_seed_1"))
+    suite.addTest(TestSyntheticData1("test_benchmark_scale_1"))
+    suite.addTest(TestCompareToBaseline1("test_compare_to_baseline_1"))
+    suite.addTest(TestCompareToBaseline1("test_compare_to_baseline_noise_1"))
+
+    return suite
+
+
+if __name__ == "__main__":
+    runner = unittest.TextTestRunner()
+    runner.run(suite())
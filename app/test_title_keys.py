@@ -0,0 +1,94 @@
+import unittest
+import numpy as np
+import pandas as pd
+from pandas.testing import assert_series_equal
+from title_keys import match_keys, strip_title_prefix, title_key
+
+
+class TestTitleKey1(unittest.TestCase):
+    """
+    Simple test to check the normalisation of the titles into keys.
+    """
+
+    def setUp(self) -> None:
+        self._titles = pd.Series(
+            [
+                "  The\tMatrix  ",
+                "the matrix",
+                "Heat (1995 film)",
+                "Heat (American film)",
+                None,
+                "   ",
+                "Ame\u0301lie",
+                "Am\u00e9lie",
+                "\uff21\uff2b\uff29\uff32\uff21",
+            ],
+            index=range(10, 19),
+        )
+
+    def test_title_key_1(self) -> None:
+        keys = title_key(self._titles)
+        self.assertEqual(keys.dtype, "category")
+        assert_series_equal(
+            keys.astype(object),
+            pd.Series(
+                [
+                    "the matrix",
+                    "the matrix",
+                    "heat (1995 film)",
+                    "heat (american film)",
+                    np.nan,
+                    np.nan,
+                    "am\u00e9lie",
+                    "am\u00e9lie",
+                    "akira",
+                ],
+                index=range(10, 19),
+                dtype=object,
+            ),
+        )
+
+    def test_title_key_disambiguator_1(self) -> None:
+        keys = title_key(self._titles, strip_disambiguator=True)
+        self.assertEqual(keys.iloc[2], "heat")
+        self.assertEqual(keys.iloc[3], "heat")
+
+    def test_strip_title_prefix_1(self) -> None:
+        titles = pd.Series(
+            ["Wikipedia: title1", "title2 Wikipedia: ", None], index=[5, 3, 1]
+        )
+        assert_series_equal(
+            strip_title_prefix(titles),
+            pd.Series(["title1", "title2 Wikipedia: ", None], index=[5, 3, 1]),
+        )
+
+
+class TestMatchKeys1(unittest.TestCase):
+    """
+    The imdb keys are looked up in the wiki keys, the last wiki row wins and missing keys never match.
+    """
+
+    def test_match_keys_1(self) -> None:
+        imdb_keys = pd.Series(["a", "b", None, "c", "a"], dtype="category")
+        wiki_keys = pd.Series(["b", "a", None, "a", "d"], dtype="category")
+        np.testing.assert_array_equal(
+            match_keys(imdb_keys, wiki_keys), [3, 0, -1, -1, 3]
+        )
+
+
+def suite() -> None:
+    """
+    Creates the test suites to be ran.
+    """
+    suite = unittest.TestSuite()
+    suite.addTest(TestTitleKey1("test_title_key_1"))
+    suite.addTest(TestTitleKey1("test_title_key_disambiguator_1"))
+    suite.addTest(TestTitleKey1("test_strip_title_prefix_1"))
+    suite.addTest(TestMatchKeys1("test_match_keys_1"))
+
+    return suite
+
+
+if __name__ == "__main__":
+    runner = unittest.TextTestRunner()
+    runner.run(suite())
@@ -0,0 +1,74 @@
+import unittest
+import numpy as np
+import pandas as pd
+from pandas.testing import assert_frame_equal
+from top_k import TopKSelector, select_top_k
+
+
+class TestSelectTopK1(unittest.TestCase):
+    """
+    Test the top k selection gives the same rows as a full sort, in memory and over batches.
+    """
+
+    def setUp(self) -> None:
+        rng = np.random.default_rng(0)
+        ratio = rng.permutation(1000).astype(float) / 7
+        ratio[rng.integers(0, 1000, 50)] = np.nan
+        ratio[3] = np.inf
+        self._df = pd.DataFrame(
+            {"title": [f"title{i}" for i in range(1000)], "ratio": ratio},
+            index=rng.permutation(1000),
+        )
+
+    def test_select_top_k_1(self) -> None:
+        for n in [1, 10, 100, 1000, 2000]:
+            expected_df = self._df.sort_values(by=["ratio"], ascending=False).head(n)
+            assert_frame_equal(expected_df, select_top_k(self._df, n=n))
+
+    def test_top_k_selector_1(self) -> None:
+        for n in [10, 100, 1000]:
+            expected_df = select_top_k(self._df, n=n)
+            selector = TopKSelector(n=n)
+            selector.update_all(
+                self._df.iloc[start : start + 64] for start in range(0, 1000, 64)
+            )
+            assert_frame_equal(expected_df, selector.result())
+
+    def test_select_top_k_ties_1(self) -> None:
+        df = pd.DataFrame({"ratio": [1.0, 2.0, 2.0, np.nan, 2.0, 0.5]})
+        expected_df = df.iloc[[1, 2]]
+        assert_frame_equal(expected_df, select_top_k(df, n=2))
+        selector = TopKSelector(n=2).update_all(
+            [df.iloc[:1], df.iloc[1:3], df.iloc[3:]]
+        )
+        assert_frame_equal(expected_df, selector.result())
+
+    def test_select_top_k_edges_1(self) -> None:
+        # Nothing is selected for n <= 0, everything for n above the number of rows
+        for n in [0, -1]:
+            assert_frame_equal(self._df.iloc[[]], select_top_k(self._df, n=n))
+            selector = TopKSelector(n=n).update_all(
+                [self._df.iloc[:500], self._df.iloc[500:]]
+            )
+            assert_frame_equal(self._df.iloc[[]], selector.result())
+        expected_df = self._df.sort_values(by=["ratio"], ascending=False)
+        assert_frame_equal(expected_df, select_top_k(self._df, n=len(self._df) + 1))
+        assert_frame_equal(self._df.iloc[[]], select_top_k(self._df.iloc[[]], n=10))
+
+
+def suite() -> None:
+    """
+    Creates the test suites to be ran.
+    """
+    suite = unittest.TestSuite()
+    suite.addTest(TestSelectTopK1("test_select_top_k_1"))
+    suite.addTest(TestSelectTopK1("test_top_k_selector_1"))
+    suite.addTest(TestSelectTopK1("test_select_top_k_ties_1"))
+    suite.addTest(TestSelectTopK1("test_select_top_k_edges_1"))
+
+    return suite
+
+
+if __name__ == "__main__":
+    runner = unittest.TextTestRunner()
+    runner.run(suite())
@@ -0,0 +1,173 @@
+import re
+import unicodedata
+from typing import Union
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+from arrow_frames import ArrowFrame
+
+WIKI_TITLE_PREFIX = "Wikipedia: "
+TITLE_KEY_SUFFIX = "_key"
+# Wikipedia disambiguates the films sharing a title with another page: "Heat (1995 film)", "Heat (film)",
+# "Heat (1986 american film)". The key is computed on lower case titles.
+DISAMBIGUATOR_PATTERN = r"\s*\((?:\d{4} )?(?:[^()]* )?film\)$"
+
+Titles = Union[pd.Series, pa.Array, pa.ChunkedArray]
+
+
+def _to_arrow(titles: Titles) -> pa.Array:
+    """
+    The titles as a single arrow string array, missing values (None or nan) as nulls.
+    """
+    if isinstance(titles, pd.Series):
+        return pa.array(titles, type=pa.string(), from_pandas=True)
+    if isinstance(titles, pa.ChunkedArray):
+        return titles.combine_chunks()
+    return titles
+
+
+def _to_pandas(values: pa.Array, titles: Titles) -> pd.Series:
+    """
+    Back to a pandas series, with the index of titles when it was a series.
+    """
+    series = pd.Series(values.to_pandas())
+    if isinstance(titles, pd.Series):
+        series.index = titles.index
+    return series
+
+
+def strip_title_prefix(titles: Titles, prefix: str = WIKI_TITLE_PREFIX) -> pd.Series:
+    """
+    Removes the prefix from the titles starting with it, in arrow rather than with a regex over python objects.
+
+    returns: series of the titles without the prefix, missing values stay missing
+    """
+    stripped = pc.replace_substring_regex(
+        _to_arrow(titles), "^" + re.escape(prefix), "", max_replacements=1
+    )
+    return _to_pandas(stripped, titles)
+
+
+def _normalise_unicode(values: pa.Array) -> pa.Array:
+    """
+    Lower cases the titles. The few non ascii ones are also NFKC normalised and case folded in python,
+    so "Amélie" written with a combining accent and "ＡＫＩＲＡ" get the same key as their usual spelling.
+    """
+    lowered = pc.utf8_lower(values)
+    non_ascii = pc.invert(pc.fill_null(pc.string_is_ascii(values), True))
+    positions = np.flatnonzero(non_ascii.to_numpy(zero_copy_only=False))
+    if len(positions) == 0:
+        return lowered
+    normalised = pa.array(
+        [
+            unicodedata.normalize("NFKC", title).casefold()
+            for title in values.take(pa.array(positions)).to_pylist()
+        ],
+        type=pa.string(),
+    )
+    return pc.replace_with_mask(lowered, non_ascii, normalised)
+
+
+def _replace_where(
+    values: pa.Array, mask: pa.Array, pattern: str, replacement: str
+) -> pa.Array:
+    """
+    Applies the regex replacement only to the values selected by mask. Checking a cheap condition first and
+    running the regex on the few titles concerned is several times faster than running it on all of them.
+    """
+    mask = pc.fill_null(mask, False)
+    positions = np.flatnonzero(mask.to_numpy(zero_copy_only=False))
+    if len(positions) == 0:
+        return values
+    replaced = pc.replace_substring_regex(
+        values.take(pa.array(positions)), pattern, replacement
+    )
+    return pc.replace_with_mask(values, mask, replaced)
+
+
+def title_key_array(titles: Titles, strip_disambiguator: bool = False) -> pa.Array:
+    """
+    The title_key of the titles as a plain arrow string array, for the computations staying in arrow.
+
+    returns: arrow array of the keys, null for the missing or blank titles
+    """
+    keys = _normalise_unicode(_to_arrow(titles))
+    # Runs of spaces, tabs or new lines become a single space
+    keys = _replace_where(
+        keys, pc.match_substring_regex(keys, r"\s\s|[^ \S]"), r"\s+", " "
+    )
+    keys = pc.utf8_trim_whitespace(keys)
+    if strip_disambiguator:
+        keys = _replace_where(
+            keys, pc.match_substring(keys, "film)"), DISAMBIGUATOR_PATTERN, ""
+        )
+    # A title made only of whitespace has no key, rather than matching every other blank title
+    return pc.if_else(pc.equal(keys, ""), pa.scalar(None, pa.string()), keys)
+
+
+def title_key(titles: Titles, strip_disambiguator: bool = False) -> pd.Series:
+    """
+    The join key of the titles: unicode, case and whitespace normalised, "The  Matrix " and "the matrix" get the
+    same key. The computation runs on arrow strings and the key is returned as a categorical, so each distinct key
+    is stored and hashed once and the rows only hold integer codes.
+
+    param: titles: series or arrow array of titles, already without the "Wikipedia: " prefix (see strip_title_prefix)
+    param: strip_disambiguator: remove the "(1995 film)" like disambiguators of the wikipedia titles
+    returns: categorical series of the keys, missing for the missing or blank titles
+    """
+    keys = title_key_array(titles, strip_disambiguator)
+    return _to_pandas(keys.dictionary_encode(), titles)
+
+
+def add_title_keys(
+    df: Union[pd.DataFrame, ArrowFrame],
+    columns: list,
+    strip_disambiguator: bool = False,
+) -> Union[pd.DataFrame, ArrowFrame]:
+    """
+    Adds the title_key of each of the columns as a column named {column}_key.
+    The keys of an ArrowFrame are computed chunk by chunk and kept as an arrow string column.
+
+    returns: df with the key columns added
+    """
+    if isinstance(df, ArrowFrame):
+        for col in columns:
+            keys = [
+                title_key_array(chunk, strip_disambiguator)
+                for chunk in df.column(col).chunks
+            ]
+            df = df.with_column(
+                col + TITLE_KEY_SUFFIX, pa.chunked_array(keys, type=pa.string())
+            )
+        return df
+    for col in columns:
+        df[col + TITLE_KEY_SUFFIX] = title_key(df[col], strip_disambiguator)
+    return df
+
+
+def match_keys(imdb_keys: pd.Series, wiki_keys: pd.Series) -> np.ndarray:
+    """
+    Looks each imdb key up in the wiki keys, the last wiki row wins when several have the same key.
+
+    Only the distinct keys (the categories) are hashed, the rows are then matched through their integer codes.
+
+    param: imdb_keys, wiki_keys: categorical series as returned by title_key
+    returns: for each imdb row the position of its wiki row in wiki_keys, -1 when there is none
+    """
+    imdb_keys = imdb_keys.astype("category")
+    wiki_keys = wiki_keys.astype("category")
+    # imdb category of each wiki category, -1 when the imdb dataset doesn't have it
+    wiki_to_imdb = np.append(
+        imdb_keys.cat.categories.get_indexer(wiki_keys.cat.categories), -1
+    )
+    # Code -1 (missing key) picks the -1 appended above
+    wiki_imdb_codes = wiki_to_imdb[wiki_keys.cat.codes.to_numpy()]
+    matched_rows = np.flatnonzero(wiki_imdb_codes != -1)
+    matched = pd.Series(matched_rows, index=wiki_imdb_codes[matched_rows])
+    matched = matched[~matched.index.duplicated(keep="last")]
+
+    wiki_row_of_imdb_code = np.full(len(imdb_keys.cat.categories) + 1, -1)
+    wiki_row_of_imdb_code[matched.index.to_numpy()] = matched.to_numpy()
+    return wiki_row_of_imdb_code[imdb_keys.cat.codes.to_numpy()]
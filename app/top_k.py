@@ -0,0 +1,81 @@
+from typing import Iterable, Optional
+
+import numpy as np
+import pandas as pd
+
+TOP_N = 1000
+TOP_COLUMN = "ratio"
+
+
+def _top_k_positions(values: np.ndarray, n: int) -> np.ndarray:
+    """
+    Returns the positions of the n highest values, ordered from the highest one.
+
+    The n-th highest value is found with a linear time selection (np.partition) and only the n selected values are
+    sorted. Missing values rank last, and equal values keep their input order, so the result is deterministic.
+    n <= 0 selects nothing and n above the number of values selects all of them.
+    """
+    if n <= 0:
+        return np.array([], dtype=np.intp)
+    values = values.astype(np.float64, copy=False)
+    n = min(n, len(values))
+    if n < len(values):
+        keys = np.where(np.isnan(values), -np.inf, values)
+        kth = np.partition(keys, len(keys) - n)[len(keys) - n]
+        above = np.flatnonzero(keys > kth)
+        ties = np.flatnonzero(keys == kth)[: n - len(above)]
+        positions = np.sort(np.concatenate([above, ties]))
+    else:
+        positions = np.arange(len(values))
+    # np.argsort puts the nan last, and the negation sorts the values from the highest
+    order = np.argsort(-values[positions], kind="stable")
+    return positions[order]
+
+
+def select_top_k(
+    df: pd.DataFrame, n: int = TOP_N, column: str = TOP_COLUMN
+) -> pd.DataFrame:
+    """
+    Returns the n rows of df with the highest values in column, from the highest one, without sorting the whole
+    dataframe. Same rows as df.sort_values(by=[column], ascending=False).head(n), ties are kept in input order.
+    """
+    assert column in df.columns, f"Column {column} not in the dataframe columns."
+    return df.iloc[_top_k_positions(df[column].to_numpy(), n)]
+
+
+class TopKSelector:
+    def __init__(self, n: int = TOP_N, column: str = TOP_COLUMN):
+        """
+        Keeps the n rows with the highest values in column over a stream of batches, without ever holding more
+        than n rows plus the current batch. The result is the same as select_top_k over all the batches concatenated.
+        """
+        self._n = n
+        self._column = column
+        self._best = None
+
+    def update(self, batch: pd.DataFrame) -> None:
+        """
+        Merges a batch into the n best rows seen so far.
+        """
+        if self._best is not None and len(self._best) == self._n:
+            if self._n <= 0:
+                return
+            # The lowest value kept is the bar to pass, rows equal to it lose to the earlier rows already kept
+            threshold = self._best[self._column].iloc[-1]
+            if not np.isnan(threshold):
+                batch = batch[batch[self._column] > threshold]
+            if batch.empty:
+                return
+        candidates = batch if self._best is None else pd.concat([self._best, batch])
+        self._best = select_top_k(candidates, self._n, self._column)
+
+    def update_all(self, batches: Iterable[pd.DataFrame]) -> "TopKSelector":
+        for batch in batches:
+            self.update(batch)
+        return self
+
+    def result(self) -> Optional[pd.DataFrame]:
+        """
+        Returns the n best rows, from the highest one, None if no batch was given.
+        """
+        return self._best
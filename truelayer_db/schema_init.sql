@@ -3,3 +3,12 @@ create database truelayer;
 
 create schema truelayer_schema;
 
+create table truelayer_schema.pipeline_runs (
+    run_id text primary key,
+    started_at timestamptz,
+    wall_s double precision,
+    cpu_s double precision,
+    peak_rss_mb double precision,
+    report jsonb
+);
+